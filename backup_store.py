@@ -0,0 +1,402 @@
+"""
+内容寻址的备份存储（mac-setup.py 与 rollback.py 共用）
+
+目录结构（BACKUP_DIR）:
+- objects/ab/abcdef...      文件内容 blob，相同内容只保存一份
+- manifest.jsonl            每次备份事件追加一行（来源、前缀、时间、大小、哈希）
+- <prefix><name>.<时间戳>    指向 blob 的硬链接（保持原有的备份文件布局）
+- <prefix><name>.latest     指向最新备份的符号链接
+
+同一文件内容未变化时，再次备份只计算一次哈希并追加一条清单记录，不复制文件。
+
+清单按时间顺序追加，记录 id 以时间戳开头，因此可以直接在文件上二分查找，
+按 id 或时间点定位备份为 O(log n)，无需列出备份目录。清单缺失时根据已有的
+备份文件自动重建。
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+MANIFEST_NAME = "manifest.jsonl"
+OBJECTS_DIR = "objects"
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+# 各脚本使用的备份前缀（用于从已有备份文件重建清单）-> 文件名中不含来源时的来源文件
+# （rollback.sh 写入 zshrc.before-env.<时间戳>，rollback.py 写入 zshrc.before-env..zshrc.<时间戳>）
+KNOWN_PREFIXES = {
+    "original-": None,
+    "zshrc.before-env.": ".zshrc",
+    "zshrc.before-full.": ".zshrc",
+    "Brewfile.before-full.": "Brewfile",
+    "before-restore.": None,
+}
+# setup-macos.sh 的 original-plugins/original-theme 记录的是插件列表和主题，不是文件副本
+SHELL_RECORD_NAMES = {"plugins", "theme"}
+# 写了一半的清单行中已写入的 id（时间戳部分）
+TORN_ID_PATTERN = re.compile(rb'^\{"id": "([0-9a-f-]+)')
+BACKUP_NAME_PATTERN = re.compile(
+    r"^(%s)(?:(.+)\.)?(\d{14})(?:-\d+)?$"
+    % "|".join(re.escape(p) for p in KNOWN_PREFIXES)
+)
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BackupStore:
+    """内容寻址备份存储"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.manifest = self.root / MANIFEST_NAME
+        self.objects = self.root / OBJECTS_DIR
+
+    @contextmanager
+    def _locked(self):
+        """跨进程互斥（多个脚本同时备份/清理时保护清单）"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".manifest.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def blob_path(self, sha: str) -> Path:
+        return self.objects / sha[:2] / sha
+
+    def entries(self) -> List[Dict]:
+        """读取全部备份记录（按写入顺序）"""
+        self._ensure_manifest()
+        entries = []
+        with open(self.manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue  # 跳过写了一半的行
+        return entries
+
+    def _append(self, entry: Dict) -> None:
+        with open(self.manifest, "a+b") as f:
+            # 上次追加被中断时末尾没有换行，先补上，避免新记录接在半行之后
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")  # 追加模式下写入总在文件末尾
+            f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def _ensure_manifest(self) -> None:
+        if not self.manifest.exists() and self.root.is_dir():
+            self.rebuild()
+
+    def rebuild(self, source_dir: Optional[Path] = None) -> int:
+        """根据备份目录中已有的备份文件重建清单，返回记录数
+
+        来源按 <source_dir>/<文件名> 推断（默认用户主目录），文件名中不含来源时
+        按 KNOWN_PREFIXES 映射；setup-macos.sh 的插件/主题记录不加入清单。
+        文件内容同时硬链接进 objects/，后续备份可直接去重。
+        """
+        source_dir = Path(source_dir) if source_dir else Path.home()
+        found = []
+        for path in self.root.iterdir():
+            match = BACKUP_NAME_PATTERN.match(path.name)
+            if not match or path.is_symlink() or not path.is_file():
+                continue
+            prefix, name, timestamp = match.groups()
+            name = name or KNOWN_PREFIXES[prefix]
+            if not name or (prefix == "original-" and name in SHELL_RECORD_NAMES):
+                continue
+            found.append((timestamp, prefix, name, path))
+
+        entries = []
+        for timestamp, prefix, name, path in sorted(found):
+            sha = sha256_file(path)
+            blob = self.blob_path(sha)
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(path, blob)
+                except OSError:
+                    shutil.copy2(path, blob)
+            entries.append(
+                self._entry(
+                    timestamp,
+                    source_dir / name,
+                    prefix,
+                    path.name,
+                    path.stat().st_size,
+                    sha,
+                )
+            )
+
+        tmp = self.manifest.with_name(MANIFEST_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.manifest)
+        return len(entries)
+
+    @staticmethod
+    def _entry(timestamp, source: Path, prefix, file_name, size, sha) -> Dict:
+        # 同一秒内可能先后备份同一文件的不同前缀（如 original- 与普通备份），
+        # id 的哈希部分同时覆盖前缀、来源和内容，保证各条记录可区分
+        key = hashlib.sha256(f"{prefix}\0{source}\0{sha}".encode("utf-8"))
+        return {
+            "id": f"{timestamp}-{key.hexdigest()[:12]}",
+            "time": timestamp,
+            "source": str(source),
+            "prefix": prefix,
+            "name": Path(source).name,
+            "file": file_name,
+            "size": size,
+            "sha256": sha,
+        }
+
+    # ---------- 二分查找（直接在清单文件上进行） ----------
+
+    @staticmethod
+    def _key(line: bytes) -> str:
+        try:
+            return json.loads(line).get("id", "")
+        except ValueError:
+            # 写了一半的行：id 是第一个字段，取出已写入的部分，保持清单有序
+            match = TORN_ID_PATTERN.search(line)
+            return match.group(1).decode("ascii") if match else ""
+
+    def _bisect(self, f, pred: Callable[[str], bool]) -> int:
+        """返回第一条满足 pred(id) 的记录的字节偏移（不存在时为文件末尾）
+
+        清单按 id 单调追加，pred 在记录序列上单调（先 False 后 True）。
+        """
+        size = f.seek(0, os.SEEK_END)
+        lo, hi = 0, size  # lo 始终为行首，hi 为行首或文件末尾
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid - 1 if mid else 0)
+            if mid:
+                f.readline()  # 对齐到 >= mid 的第一个行首
+            start = f.tell()
+            if start >= hi:
+                # [mid, hi) 内没有行首，从 lo 逐行前进
+                f.seek(lo)
+                line = f.readline()
+                if pred(self._key(line)):
+                    return lo
+                lo += len(line)
+                continue
+            line = f.readline()
+            if pred(self._key(line)):
+                hi = start
+            else:
+                lo = start + len(line)
+        return lo
+
+    @staticmethod
+    def _iter_backward(f, offset: int, chunk: int = 1 << 16) -> Iterator[Dict]:
+        """从 offset 处向前逐条读取记录"""
+        buf = b""
+        pos = offset
+        while pos > 0:
+            step = min(chunk, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+            lines = buf.split(b"\n")
+            buf = lines[0]  # 可能不完整，留到下一轮
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        if buf.strip():
+            try:
+                yield json.loads(buf)
+            except ValueError:
+                pass
+
+    def find(self, backup_id: str) -> Optional[Dict]:
+        """按 id 查找备份记录（id 前缀也可，取最早匹配的一条）"""
+        # 清单只按时间戳有序（同一秒内的记录哈希部分无序），二分只比较时间戳部分
+        stamp = backup_id[:14]
+        with self._locked():
+            self._ensure_manifest()
+            with open(self.manifest, "rb") as f:
+                f.seek(self._bisect(f, lambda key: key[: len(stamp)] >= stamp))
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # 跳过写了一半的行
+                    if entry["id"][: len(stamp)] > stamp:
+                        break
+                    if entry["id"].startswith(backup_id):
+                        return entry
+        return None
+
+    def at(self, timestamp: str, source: Optional[str] = None) -> Optional[Dict]:
+        """查找时间点 timestamp（YYYYmmddHHMMSS）及之前最近的一次备份"""
+        with self._locked():
+            self._ensure_manifest()
+            with open(self.manifest, "rb") as f:
+                # id 形如 <时间戳>-<哈希>，时间戳相同的记录都算在该时间点之前
+                offset = self._bisect(f, lambda key: key[:14] > timestamp)
+                for entry in self._iter_backward(f, offset):
+                    if source is None or entry.get("source") == str(source):
+                        return entry
+        return None
+
+    def _store_blob(self, file_path: Path, sha: str) -> Path:
+        """内容不存在时写入 blob（先写临时文件再 rename）"""
+        blob = self.blob_path(sha)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_name(f".{sha}.tmp")
+            shutil.copy2(file_path, tmp)
+            os.replace(tmp, blob)
+        return blob
+
+    def _link(self, blob: Path, target: Path) -> None:
+        """把备份文件名硬链接到 blob（跨文件系统时退化为复制）"""
+        if target.exists() or target.is_symlink():
+            target.unlink()
+        try:
+            os.link(blob, target)
+        except OSError:
+            shutil.copy2(blob, target)
+
+    def backup(
+        self, file_path: Path, prefix: str = "", latest: bool = True
+    ) -> Tuple[Optional[Path], bool]:
+        """备份文件，返回 (备份文件路径, 是否产生了新的备份文件)
+
+        与同一来源的上一次备份内容相同时复用已有备份文件，只追加清单记录。
+        """
+        file_path = Path(file_path)
+        if not file_path.exists():
+            return None, False
+
+        sha = sha256_file(file_path)
+        size = file_path.stat().st_size
+        source = str(file_path.expanduser().absolute())
+
+        with self._locked():
+            # 在锁内取时间戳，保证清单按时间顺序追加
+            timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+            self._ensure_manifest()
+            previous = None
+            if self.manifest.exists():
+                # 从清单末尾向前找同一来源的上一次备份（通常只需读最后几行）
+                with open(self.manifest, "rb") as f:
+                    end = f.seek(0, os.SEEK_END)
+                    for entry in self._iter_backward(f, end):
+                        if (
+                            entry.get("source") == source
+                            and entry.get("prefix") == prefix
+                        ):
+                            previous = entry
+                            break
+
+            reuse = (
+                previous is not None
+                and previous.get("sha256") == sha
+                and (self.root / previous["file"]).exists()
+            )
+            if reuse:
+                backup_name = previous["file"]
+            else:
+                backup_name = f"{prefix}{file_path.name}.{timestamp}"
+                # 同一秒内的多次备份追加序号，避免覆盖已记录的备份文件
+                seq = 1
+                while (self.root / backup_name).exists():
+                    backup_name = f"{prefix}{file_path.name}.{timestamp}-{seq}"
+                    seq += 1
+                self._link(self._store_blob(file_path, sha), self.root / backup_name)
+
+            self._append(
+                self._entry(timestamp, Path(source), prefix, backup_name, size, sha)
+            )
+
+            if latest:
+                # 使用相对路径，避免目录移动后失效
+                latest_link = self.root / f"{prefix}{file_path.name}.latest"
+                if latest_link.exists() or latest_link.is_symlink():
+                    latest_link.unlink()
+                latest_link.symlink_to(backup_name)
+
+        return self.root / backup_name, not reuse
+
+    def gc(self, keep_last: int = 10, keep_days: float = 30) -> Tuple[int, int, int]:
+        """按保留策略清理备份，返回 (删除的记录数, 删除的 blob 数, 释放字节数)
+
+        同一来源+前缀至少保留最近 keep_last 次备份，且保留 keep_days 天内的全部备份；
+        .latest 指向的备份始终保留。无人引用的 blob 随之删除。
+        """
+        cutoff = time.time() - keep_days * 86400
+        with self._locked():
+            entries = self.entries()
+            # setup-macos.sh 的 .latest 使用绝对路径，Python 脚本使用相对路径，统一取文件名
+            pinned = {
+                Path(os.readlink(p)).name
+                for p in self.root.glob("*.latest")
+                if p.is_symlink()
+            }
+
+            keep: List[Dict] = []
+            seen: Dict[Tuple[str, str], int] = {}
+            for entry in reversed(entries):
+                key = (entry.get("source", ""), entry.get("prefix", ""))
+                seen[key] = seen.get(key, 0) + 1
+                try:
+                    when = datetime.strptime(
+                        entry["time"], TIMESTAMP_FORMAT
+                    ).timestamp()
+                except (KeyError, ValueError):
+                    when = time.time()
+                if seen[key] <= keep_last or when >= cutoff or entry["file"] in pinned:
+                    keep.append(entry)
+            keep.reverse()
+
+            kept_files = {e["file"] for e in keep}
+            kept_blobs = {e["sha256"] for e in keep}
+            removed_entries = len(entries) - len(keep)
+
+            # 多条记录可能共用同一个备份文件（内容未变化时复用）
+            for name in {e["file"] for e in entries} - kept_files:
+                path = self.root / name
+                if path.exists() and not path.is_symlink():
+                    path.unlink()
+
+            removed_blobs = 0
+            freed = 0
+            if self.objects.is_dir():
+                for blob in self.objects.glob("*/*"):
+                    if blob.name.startswith(".") or blob.name in kept_blobs:
+                        continue
+                    freed += blob.stat().st_size
+                    blob.unlink()
+                    removed_blobs += 1
+
+            tmp = self.manifest.with_name(MANIFEST_NAME + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for entry in keep:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.manifest)
+
+        return removed_entries, removed_blobs, freed
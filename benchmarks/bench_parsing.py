@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+配置解析热点路径的微基准测试
+
+覆盖:
+- mac-setup.py: ZshConfig (load/has_omz/get_plugins/update_plugins/update_theme)、
+  parse_brew_packages、merge_plugins、ensure_line_in_file
+- rollback.py: disable_auto_blocks、remove_auto_blocks
+
+输入全部在临时目录中合成（100 ~ 100k 行的 .zshrc，数千条的软件包清单），
+HOME 指向临时目录，不依赖 brew，可在 Linux 上运行。
+
+示例:
+  python3 benchmarks/bench_parsing.py
+  python3 benchmarks/bench_parsing.py --save baseline.json
+  python3 benchmarks/bench_parsing.py --compare baseline.json --threshold 1.25
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+ZSHRC_SIZES = [100, 1_000, 10_000, 100_000]
+PACKAGE_SIZES = [100, 1_000, 5_000]
+BLOCK_EVERY = 25  # 每隔多少行插入一个标记块
+
+
+# ================= Fixtures =================
+
+
+def load_script(name: str, path: Path):
+    """按路径加载脚本模块（mac-setup.py 文件名含连字符，无法直接 import）"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # 基准测试中不输出日志
+    module.log = lambda *args, **kwargs: None
+    return module
+
+
+def make_zshrc(lines: int) -> str:
+    """生成带有大量标记块的 .zshrc（两种标记格式交替出现）"""
+    out = [
+        'export ZSH="$HOME/.oh-my-zsh"',
+        'ZSH_THEME="robbyrussell"',
+        "plugins=(git docker autojump)",
+        "source $ZSH/oh-my-zsh.sh",
+    ]
+    n = 0
+    while len(out) < lines:
+        if len(out) % BLOCK_EVERY == 0:
+            n += 1
+            if n % 2:
+                out += [
+                    f"### AUTO-BENCH-{n} START ###",
+                    f'export PATH="$HOME/bench/{n}:$PATH"',
+                    "plugins=(inside block)",
+                    f"### AUTO-BENCH-{n} END ###",
+                ]
+            else:
+                out += [f"### AUTO-LEGACY-{n}", f"alias b{n}='echo {n}'"]
+                out += [f"### END AUTO-LEGACY-{n}"]
+        else:
+            out.append(f"alias a{len(out)}='echo {len(out)}'")
+    return "\n".join(out[:lines]) + "\n"
+
+
+def make_packages(count: int) -> str:
+    half = count // 2
+    out = ["# ===== Formulae (CLI 工具) ====="]
+    out += [f"formula-{i}  # comment {i}" for i in range(half)]
+    out += ["", "# ===== Casks (GUI 应用) ====="]
+    out += [f"cask-{i}" for i in range(count - half)]
+    return "\n".join(out) + "\n"
+
+
+# ================= Runner =================
+
+
+def measure(func, setup=None, min_time=0.2, max_repeat=50):
+    """重复运行直到累计耗时 >= min_time，返回 (中位数, 最小值, 峰值内存)"""
+    # 预热一次（模块级缓存、正则编译、文件系统缓存）
+    if setup:
+        setup()
+    func()
+
+    times = []
+    total = 0.0
+    while (total < min_time or len(times) < 3) and len(times) < max_repeat:
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t0
+        times.append(elapsed)
+        total += elapsed
+
+    # 单独运行一次统计峰值内存（tracemalloc 会拖慢执行，不计入耗时）
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), min(times), peak
+
+
+def build_cases(ms, rb, workdir: Path, quick: bool):
+    """生成 (名称, 函数, 准备函数) 列表"""
+    cases = []
+    zshrc_sizes = ZSHRC_SIZES[:2] if quick else ZSHRC_SIZES
+    package_sizes = PACKAGE_SIZES[:2] if quick else PACKAGE_SIZES
+
+    for size in zshrc_sizes:
+        content = make_zshrc(size)
+        path = workdir / f"zshrc-{size}"
+
+        def reset(path=path, content=content):
+            path.write_text(content)
+
+        reset()
+        loaded = ms.ZshConfig(path)
+        cases += [
+            (f"ZshConfig.load[{size}]", lambda p=path: ms.ZshConfig(p), None),
+            (f"ZshConfig.has_omz[{size}]", lambda c=loaded: c.has_omz(), None),
+            (f"ZshConfig.get_plugins[{size}]", lambda c=loaded: c.get_plugins(), None),
+            (
+                f"ZshConfig.update_plugins[{size}]",
+                lambda p=path: ms.ZshConfig(p).update_plugins(["git", "fzf", "sudo"]),
+                reset,
+            ),
+            (
+                f"ZshConfig.update_theme[{size}]",
+                lambda p=path: ms.ZshConfig(p).update_theme(""),
+                reset,
+            ),
+            (
+                f"ensure_line_in_file.append[{size}]",
+                lambda p=path: ms.ensure_line_in_file(
+                    p, "echo new", marker="BENCH-NEW"
+                ),
+                reset,
+            ),
+            (
+                f"ensure_line_in_file.prepend[{size}]",
+                lambda p=path: ms.ensure_line_in_file(
+                    p, "echo new", marker="BENCH-NEW", prepend=True
+                ),
+                reset,
+            ),
+            (
+                f"ensure_line_in_file.present[{size}]",
+                lambda p=path: ms.ensure_line_in_file(p, "x", marker="AUTO-BENCH-1"),
+                reset,
+            ),
+            (
+                f"rollback.disable_auto_blocks[{size}]",
+                lambda p=path: rb.disable_auto_blocks(p),
+                reset,
+            ),
+            (
+                f"rollback.remove_auto_blocks[{size}]",
+                lambda p=path: rb.remove_auto_blocks(p),
+                reset,
+            ),
+        ]
+
+    for count in package_sizes:
+        pkg_path = workdir / f"packages-{count}.txt"
+        pkg_path.write_text(make_packages(count))
+
+        def parse(p=pkg_path):
+            ms.PACKAGES_FILE = p
+            return ms.parse_brew_packages()
+
+        existing = [f"plugin-{i}" for i in range(count)]
+        new = [f"plugin-{i}" for i in range(count // 2, count + count // 2)]
+        cases += [
+            (f"parse_brew_packages[{count}]", parse, None),
+            (
+                f"merge_plugins[{count}]",
+                lambda e=existing, n=new: ms.merge_plugins(e, n),
+                None,
+            ),
+        ]
+    return cases
+
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="mac-setup-bench-"))
+    os.environ["HOME"] = str(workdir)  # 模块级路径常量在加载时读取 HOME
+    sys.path.insert(0, str(REPO_DIR))
+    try:
+        ms = load_script("mac_setup", REPO_DIR / "mac-setup.py")
+        rb = load_script("rollback", REPO_DIR / "rollback.py")
+        results = {}
+        for name, func, setup in build_cases(ms, rb, workdir, args.quick):
+            if args.filter and args.filter not in name:
+                continue
+            median, best, peak = measure(func, setup, min_time=args.min_time)
+            results[name] = {"median": median, "min": best, "peak_bytes": peak}
+            print(
+                f"{name:<42} {median * 1e3:10.3f} ms  "
+                f"(min {best * 1e3:9.3f} ms)  peak {peak / 1024:10.1f} KiB"
+            )
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> int:
+    """与基线对比，返回退化数量
+
+    使用最小耗时比较（受调度和 I/O 抖动影响最小），
+    当前最小耗时超过 基线 × threshold 视为退化。
+    """
+    regressions = 0
+    print("")
+    print(f"{'benchmark':<42} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, current in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        ratio = current["min"] / base["min"] if base["min"] else 0.0
+        flag = ""
+        if ratio > threshold:
+            regressions += 1
+            flag = "  ⚠️ 退化"
+        print(
+            f"{name:<42} {base['min'] * 1e3:9.3f} ms "
+            f"{current['min'] * 1e3:9.3f} ms {ratio:6.2f}x{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="配置解析热点路径微基准测试")
+    parser.add_argument("--save", type=Path, help="保存结果为基线 JSON")
+    parser.add_argument("--compare", type=Path, help="与基线 JSON 对比")
+    parser.add_argument(
+        "--threshold", type=float, default=1.25, help="退化判定阈值（默认 1.25x）"
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="每项最少累计耗时（秒）"
+    )
+    parser.add_argument(
+        "--filter", type=str, default="", help="只运行名称包含该字符串的项"
+    )
+    parser.add_argument("--quick", action="store_true", help="只运行较小规模的输入")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.save:
+        payload = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        args.save.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+        print(f"\n基线已保存: {args.save}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {regressions} 项性能退化（阈值 {args.threshold}x）")
+            sys.exit(1)
+        print("\n✅ 未发现性能退化")
+
+
+if __name__ == "__main__":
+    main()
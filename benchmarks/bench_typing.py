@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+zsh 输入延迟基准测试（逐键重绘延迟）
+
+在伪终端（pty）中启动交互式 zsh，按脚本逐个字符输入命令行（不执行），
+记录每次按键后终端的响应时间:
+- echo: 按键到终端收到第一个字节（字符回显）
+- settle: 按键到输出静止（语法高亮、自动建议等重绘全部完成）
+
+.zshrc 复制到临时 ZDOTDIR 中运行，可以用 --profile 把其中的 AUTO-TYPING 块
+替换为 mac-setup.py 的各个调优档位（见 TYPING_PROFILES）进行对比，不修改真实配置。
+
+示例:
+  python3 benchmarks/bench_typing.py
+  python3 benchmarks/bench_typing.py --profile off --profile balanced --profile fast
+  python3 benchmarks/bench_typing.py --cwd /usr/share --text 'ls -la ./man/man1 | grep zsh'
+  python3 benchmarks/bench_typing.py --save typing.json
+"""
+
+import argparse
+import fcntl
+import importlib.util
+import json
+import os
+import platform
+import pty
+import select
+import shutil
+import signal
+import statistics
+import struct
+import sys
+import tempfile
+import termios
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# 默认输入脚本：较长的命令行（触发高亮与建议的长度上限）和含大量路径的命令行
+DEFAULT_SESSION = [
+    "git log --oneline --graph --decorate --all | grep -i 'fix' | head -n 20",
+    "ls -la ~/Library/Application\\ Support ~/.config /usr/local/share | wc -l",
+]
+CLEAR_LINE = b"\x15"  # Ctrl-U：清空当前行，不执行
+TERM_SIZE = (50, 200)  # 行, 列
+
+
+# ================= Fixtures =================
+
+
+def load_script(name: str, path: Path):
+    """按路径加载脚本模块（mac-setup.py 文件名含连字符，无法直接 import）"""
+    sys.path.insert(0, str(REPO_DIR))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.log = lambda *args, **kwargs: None
+    return module
+
+
+def prepare_zdotdir(ms, zdotdir: Path, profile: str) -> None:
+    """复制 .zshrc（及 .zshenv）到 zdotdir，按需替换 AUTO-TYPING 块"""
+    shutil.copy2(ms.ZSHRC_PATH, zdotdir / ".zshrc")
+    zshenv = Path(os.environ.get("ZDOTDIR") or Path.home()) / ".zshenv"
+    if zshenv.is_file():
+        shutil.copy2(zshenv, zdotdir / ".zshenv")
+    if profile != "current":
+        ms.configure_typing_tuning(profile, zdotdir / ".zshrc")
+
+
+# ================= Runner =================
+
+
+def spawn_shell(zsh: str, zdotdir: Path, cwd: Path):
+    """在 pty 中启动交互式 zsh，返回 (pid, master fd)"""
+    pid, fd = pty.fork()
+    if pid == 0:
+        # 子进程：先设置终端尺寸，再启动 shell
+        rows, cols = TERM_SIZE
+        fcntl.ioctl(0, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+        env = dict(
+            os.environ,
+            ZDOTDIR=str(zdotdir),
+            TERM=os.environ.get("TERM", "xterm-256color"),
+            DISABLE_AUTO_UPDATE="true",  # 避免 Oh My Zsh 更新提示阻塞输入
+        )
+        os.chdir(cwd)
+        os.execve(zsh, [zsh, "-i"], env)
+    return pid, fd
+
+
+def drain(fd: int, quiet: float, timeout: float):
+    """读取输出直到静止 quiet 秒，返回 (首字节时间, 末字节时间, 字节数)
+
+    timeout 秒内没有任何输出时返回 (None, None, 0)。
+    """
+    first = last = None
+    received = 0
+    while True:
+        ready, _, _ = select.select([fd], [], [], quiet if last else timeout)
+        if not ready:
+            break
+        try:
+            data = os.read(fd, 65536)
+        except OSError:  # shell 已退出
+            break
+        if not data:
+            break
+        now = time.perf_counter()
+        first = first or now
+        last = now
+        received += len(data)
+    return first, last, received
+
+
+def replay(zsh: str, zdotdir: Path, cwd: Path, session, args) -> list:
+    """启动 shell，等待首个提示符（及延迟加载的插件），逐键输入并计时"""
+    pid, fd = spawn_shell(zsh, zdotdir, cwd)
+    samples = []
+    try:
+        first, _, _ = drain(fd, quiet=args.startup_quiet, timeout=args.timeout)
+        if first is None:
+            raise RuntimeError("等待提示符超时")
+        for line in session:
+            for char in line:
+                t0 = time.perf_counter()
+                os.write(fd, char.encode())
+                first, last, received = drain(fd, args.settle, args.timeout)
+                samples.append(
+                    {
+                        "key": char,
+                        "echo": (first - t0) * 1e3 if first else None,
+                        "settle": (last - t0) * 1e3 if last else None,
+                        "bytes": received,
+                    }
+                )
+            os.write(fd, CLEAR_LINE)
+            drain(fd, args.settle, args.timeout)
+    finally:
+        os.write(fd, CLEAR_LINE + b"exit\r")
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                break
+            drain(fd, 0.05, 0.05)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        os.close(fd)
+    return samples
+
+
+def summarize(values) -> dict:
+    """平均值、p95（最近秩法）、最大值（毫秒）"""
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {"mean": None, "p95": None, "max": None}
+    p95 = values[max(0, -(-len(values) * 95 // 100) - 1)]
+    return {"mean": statistics.fmean(values), "p95": p95, "max": values[-1]}
+
+
+# ================= Report =================
+
+
+def fmt(value) -> str:
+    return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def print_report(results: dict) -> None:
+    """逐键输出各档位的 settle 延迟，最后输出汇总"""
+    profiles = list(results)
+    header = "".join(f"{p:>10}" for p in profiles)
+    print(f"\n{'#':>4}  {'key':<5}{header}   (settle ms)")
+    for i, sample in enumerate(results[profiles[0]]["samples"]):
+        cells = "".join(
+            f"  {fmt(results[p]['samples'][i]['settle'])}" for p in profiles
+        )
+        print(f"{i + 1:>4}  {sample['key']!r:<5}{cells}")
+
+    print(
+        f"\n{'profile':<12}{'echo mean':>10}{'echo p95':>10}"
+        f"{'settle mean':>13}{'settle p95':>12}{'settle max':>12}"
+    )
+    for profile, result in results.items():
+        echo, settle = result["echo"], result["settle"]
+        print(
+            f"{profile:<12}{fmt(echo['mean']):>10}{fmt(echo['p95']):>10}"
+            f"{fmt(settle['mean']):>13}{fmt(settle['p95']):>12}{fmt(settle['max']):>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="zsh 逐键输入延迟基准测试")
+    parser.add_argument(
+        "--profile",
+        action="append",
+        default=[],
+        help="AUTO-TYPING 档位（current 表示 .zshrc 原样，可重复指定以对比）",
+    )
+    parser.add_argument(
+        "--text", action="append", default=[], help="要输入的命令行（可重复指定）"
+    )
+    parser.add_argument(
+        "--cwd", type=Path, default=Path.home(), help="shell 的工作目录"
+    )
+    parser.add_argument(
+        "--settle", type=float, default=0.05, help="输出静止多久（秒）视为重绘完成"
+    )
+    parser.add_argument(
+        "--startup-quiet",
+        type=float,
+        default=0.5,
+        help="启动后输出静止多久（秒）视为提示符就绪（含延迟加载的插件）",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=10.0, help="等待输出的最长时间（秒）"
+    )
+    parser.add_argument("--save", type=Path, help="保存结果 JSON")
+    args = parser.parse_args()
+
+    zsh = shutil.which("zsh")
+    if not zsh:
+        print("❌ 未找到 zsh")
+        sys.exit(1)
+
+    ms = load_script("mac_setup", REPO_DIR / "mac-setup.py")
+    if not ms.ZSHRC_PATH.exists():
+        print(f"❌ {ms.ZSHRC_PATH} 不存在")
+        sys.exit(1)
+    choices = ["current", *ms.TYPING_PROFILES]
+    profiles = args.profile or ["current"]
+    for profile in profiles:
+        if profile not in choices:
+            parser.error(f"未知档位: {profile}（可选: {', '.join(choices)}）")
+    session = args.text or DEFAULT_SESSION
+
+    results = {}
+    for profile in profiles:
+        with tempfile.TemporaryDirectory(prefix="mac-setup-typing-") as tmp:
+            zdotdir = Path(tmp)
+            prepare_zdotdir(ms, zdotdir, profile)
+            print(f"▶ {profile}: 输入 {sum(map(len, session))} 个字符...")
+            samples = replay(zsh, zdotdir, args.cwd.expanduser(), session, args)
+        results[profile] = {
+            "samples": samples,
+            "echo": summarize(s["echo"] for s in samples),
+            "settle": summarize(s["settle"] for s in samples),
+        }
+
+    print_report(results)
+
+    if args.save:
+        payload = {
+            "zsh": zsh,
+            "machine": platform.machine(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "session": session,
+            "results": results,
+        }
+        args.save.write_text(json.dumps(payload, indent=2, ensure_ascii=False))
+        print(f"\n结果已保存: {args.save}")
+
+
+if __name__ == "__main__":
+    main()
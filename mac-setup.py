@@ -7,18 +7,45 @@ macOS 全自动化环境配置脚本 (Powered by Python & Mise)
 - 配置 Oh My Zsh 和插件
 - 使用 Mise 统一管理编程语言版本
 - 智能配置合并与备份
+- 基于依赖图的并行步骤调度
 """
 
 import argparse
+import atexit
+import difflib
+import fcntl
+import hashlib
+import io
+import json
+import math
 import os
 import platform
+import queue
 import re
 import shutil
+import signal
+import statistics
 import subprocess
 import sys
+import tarfile
+import tempfile
+import textwrap
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from backup_store import BackupStore
+from zshrc_blocks import ZshrcIndex
 
 # ================= Configuration =================
 # Mise 管理的语言版本（Python/Node/Java 多版本需求高）
@@ -28,6 +55,22 @@ MISE_VERSIONS = {
     "java": "temurin-21",  # 推荐使用 Temurin (Adoptium) 发行版（mise ls-remote java 查看可用版本）
 }
 
+# 并发安装的 Mise 语言数（各语言互不依赖）
+MISE_INSTALL_JOBS = len(MISE_VERSIONS)
+
+# 优先使用预编译发行版（Python: python-build-standalone），没有可用版本时才从源码编译
+MISE_PREBUILT_ENV = {
+    "python": {"MISE_PYTHON_COMPILE": "0"},
+    "node": {"MISE_NODE_COMPILE": "0"},
+}
+MISE_COMPILE_ENV = {
+    "python": {"MISE_PYTHON_COMPILE": "1"},
+    "node": {"MISE_NODE_COMPILE": "1"},
+}
+# 预编译安装失败时，只有输出匹配"该版本/平台没有预编译包"才改为源码编译
+# （python: no precompiled python found；node: 二进制包下载 404），网络等其他错误直接报告
+MISE_NO_PREBUILT = re.compile(r"no precompiled|404 Not Found", re.IGNORECASE)
+
 # Go 和 Rust 使用官方推荐的工具管理
 # - Go: Homebrew 直接安装（单版本足够）
 # - Rust: rustup 官方工具（生态深度绑定）
@@ -92,26 +135,227 @@ OMZ_PLUGINS = [
     "zsh-autosuggestions",
 ]
 
+# Oh My Zsh 插件加载策略（未列出的插件为 eager）
+# - eager: 保留在 plugins=() 中，由 Oh My Zsh 在首个提示符之前加载
+# - deferred: 首个提示符显示后、等待输入的空闲时加载
+# - lazy: 首次执行 OMZ_LAZY_COMMANDS 中的命令时加载
+OMZ_PLUGIN_LOAD = {
+    "sudo": "deferred",
+    "zsh-syntax-highlighting": "deferred",
+    "zsh-autosuggestions": "deferred",
+    "extract": "lazy",
+    "colored-man-pages": "lazy",
+}
+OMZ_LAZY_COMMANDS = {
+    "extract": ["extract", "x"],
+    "colored-man-pages": ["man"],
+}
+
+# zsh-autosuggestions / zsh-syntax-highlighting 输入延迟调优档位（--typing-profile）
+# - fast: 异步建议、手动重绑 widget、只用 main 高亮器，缓冲区/高亮长度上限更低
+# - balanced: 异步建议，保留括号高亮
+# - off: 插件默认设置
+TYPING_PROFILES = {
+    "fast": {
+        "ZSH_AUTOSUGGEST_USE_ASYNC": "1",
+        "ZSH_AUTOSUGGEST_MANUAL_REBIND": "1",
+        "ZSH_AUTOSUGGEST_BUFFER_MAX_SIZE": "20",
+        "ZSH_AUTOSUGGEST_STRATEGY": ["history"],
+        "ZSH_HIGHLIGHT_MAXLENGTH": "200",
+        "ZSH_HIGHLIGHT_HIGHLIGHTERS": ["main"],
+        "ZSH_HIGHLIGHT_DIRS_BLACKLIST": ["/Volumes"],
+    },
+    "balanced": {
+        "ZSH_AUTOSUGGEST_USE_ASYNC": "1",
+        "ZSH_AUTOSUGGEST_BUFFER_MAX_SIZE": "40",
+        "ZSH_AUTOSUGGEST_STRATEGY": ["history"],
+        "ZSH_HIGHLIGHT_MAXLENGTH": "512",
+        "ZSH_HIGHLIGHT_HIGHLIGHTERS": ["main", "brackets"],
+        "ZSH_HIGHLIGHT_DIRS_BLACKLIST": ["/Volumes"],
+    },
+    "off": {},
+}
+DEFAULT_TYPING_PROFILE = "balanced"
+
+# Oh My Zsh 第三方插件（安装到 $ZSH/custom/plugins）
+OMZ_CUSTOM_PLUGINS = {
+    "zsh-syntax-highlighting": "https://github.com/zsh-users/zsh-syntax-highlighting.git",
+    "zsh-autosuggestions": "https://github.com/zsh-users/zsh-autosuggestions.git",
+}
+
+# 已安装插件超过该时间（秒）未更新时执行浅 fetch
+OMZ_PLUGIN_UPDATE_TTL = 7 * 24 * 3600
+
+# brew update 的默认新鲜度窗口（秒），窗口内重复运行不再更新
+BREW_UPDATE_TTL = 6 * 3600
+
+# 命令失败时用于错误报告的 stderr 末尾行数
+STDERR_TAIL_LINES = 200
+# 流式转发输出的命令（stream=True）为调用方保留的 stdout 末尾行数
+STDOUT_TAIL_LINES = 200
+
 # 路径
 ZSHRC_PATH = Path.home() / ".zshrc"
 BACKUP_DIR = Path.home() / ".mac-setup-backup"
 SCRIPT_DIR = Path(__file__).parent.resolve()
 PACKAGES_FILE = SCRIPT_DIR / "brew-packages.txt"
+# Mise 语言精确版本锁文件（把 MISE_VERSIONS 中的模糊版本固定下来）。
+# 首次运行时在本机解析生成，仓库不附带；多台机器需要一致时把该文件复制过去或提交到自己的仓库
+MISE_LOCK_FILE = SCRIPT_DIR / "mise-versions.lock.json"
+# Mise 全局配置 [tools] 段中的一行，如 python = "3.12" 或 node = ["22"]
+MISE_CONFIG_TOOL = re.compile(r'^"?([\w.-]+)"?\s*=\s*\[?\s*"([^"]+)"')
+# 步骤检查点日志（--resume 时跳过已完成且输入未变化的步骤）
+JOURNAL_FILE = BACKUP_DIR / "setup-journal.json"
+
+# 工具初始化脚本缓存（brew shellenv、mise activate 等的输出，.zshrc 直接 source）
+INIT_CACHE_DIR = Path.home() / ".cache" / "mac-setup"
+
+# 安装时预生成的 zsh 补全（加入 fpath，命令不存在时跳过）: 文件名 -> 生成命令
+COMPLETIONS_DIR = INIT_CACHE_DIR / "completions"
+ZSH_COMPLETIONS = {
+    "_mise": ["mise", "completion", "zsh"],
+    "_rustup": ["rustup", "completions", "zsh"],
+    "_cargo": ["rustup", "completions", "zsh", "cargo"],
+    "_starship": ["starship", "completions", "zsh"],
+}
 
 # ================= Helpers =================
 
 # 日志文件路径
 LOG_FILE = BACKUP_DIR / f"setup-{datetime.now().strftime('%Y%m%d%H%M%S')}.log"
-_log_file_handle = None
 
+# 日志保留策略：历史 setup-*.log 最多保留的数量和总大小，单个日志超过上限时轮转
+LOG_RETENTION_COUNT = 20
+LOG_RETENTION_BYTES = 100 * 1024 * 1024
+LOG_MAX_BYTES = 20 * 1024 * 1024
+
+
+class LogWriter:
+    """后台批量写日志
+
+    log() 只把格式化好的行放入队列，由后台线程批量写入并 flush，
+    多个步骤并发写日志时不会互相阻塞或交错。进程退出（包括异常退出）时
+    通过 atexit 写完队列中剩余的内容。
+    """
+
+    BATCH_SIZE = 256
+    FLUSH_INTERVAL = 0.2
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.prune = False  # 由 enable_pruning() 开启（--dry-run 和被导入时不清理）
+        self.enabled = True  # 由 disable() 关闭（--dry-run 不创建日志文件）
+        self._queue: queue.Queue = queue.Queue()
+        self._size = 0
+        self._file = None
+        self._thread = threading.Thread(
+            target=self._run, name="log-writer", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, line: str) -> None:
+        if self.enabled:
+            self._queue.put(line)
+
+    def disable(self) -> None:
+        """只输出到控制台，不再写日志文件"""
+        self.enabled = False
+
+    def enable_pruning(self) -> None:
+        """按保留策略清理旧日志，之后每次轮转时也清理（只在实际执行安装时调用）"""
+        self.prune = True
+        if self.path.parent.is_dir():
+            prune_logs(self.path.parent, keep=self.path)
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def _rotate(self) -> None:
+        """当前日志超过 LOG_MAX_BYTES 时依次改名为 .1、.2 …并重新开始"""
+        self._file.close()
+        seq = 1
+        while self.path.with_name(f"{self.path.name}.{seq}").exists():
+            seq += 1
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.{seq}"))
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = 0
+        if self.prune:
+            prune_logs(self.path.parent, keep=self.path)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            try:
+                batch = [self._queue.get(timeout=self.FLUSH_INTERVAL)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = [line for line in batch if line is not None]
+                if not batch:
+                    break
+            try:
+                if self._file is None:
+                    self._open()
+                data = "".join(batch)
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data.encode("utf-8"))  # 中文每个字符占 3 字节
+                if self._size > LOG_MAX_BYTES:
+                    self._rotate()
+            except Exception:
+                pass  # 日志文件写入失败不影响主流程
+        if self._file is not None:
+            self._file.close()
+
+    def close(self) -> None:
+        """写完队列中剩余的日志并停止后台线程"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+def prune_logs(log_dir: Path, keep: Optional[Path] = None) -> None:
+    """按数量和总大小清理旧的 setup-*.log（从最旧的开始删除）"""
+    logs = []
+    for entry in os.scandir(log_dir):
+        if entry.name.startswith("setup-") and ".log" in entry.name:
+            if keep is not None and entry.name == keep.name:
+                continue
+            st = entry.stat()
+            logs.append((st.st_mtime, st.st_size, entry.path))
+    logs.sort(reverse=True)  # 最新的在前
+
+    total = 0
+    for index, (_, size, path) in enumerate(logs):
+        total += size
+        if index >= LOG_RETENTION_COUNT or total > LOG_RETENTION_BYTES:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+_log_writer: Optional[LogWriter] = None
+_log_writer_guard = threading.Lock()
+_console_lock = threading.Lock()
 
-def _init_log_file():
-    """初始化日志文件"""
-    global _log_file_handle
-    if _log_file_handle is None:
-        BACKUP_DIR.mkdir(parents=True, exist_ok=True)
-        _log_file_handle = open(LOG_FILE, "a", encoding="utf-8")
-    return _log_file_handle
+
+def _init_log_file() -> LogWriter:
+    """初始化日志写入器（首次写日志时启动后台线程）"""
+    global _log_writer
+    with _log_writer_guard:
+        if _log_writer is None:
+            _log_writer = LogWriter(LOG_FILE)
+        return _log_writer
 
 
 def log(msg, level="INFO"):
@@ -125,36 +369,134 @@ def log(msg, level="INFO"):
     }
     icons = {"INFO": "ℹ️", "SUCCESS": "✅", "WARN": "⚠️", "ERROR": "❌"}
 
-    # 控制台输出（带颜色）
-    print(f"{colors.get(level, '')}{icons.get(level, '')} {msg}{colors['RESET']}")
+    # 控制台输出（带颜色），加锁避免并发步骤的输出交错
+    with _console_lock:
+        print(f"{colors.get(level, '')}{icons.get(level, '')} {msg}{colors['RESET']}")
 
     # 写入日志文件（无颜色）
-    try:
-        f = _init_log_file()
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        f.write(f"[{timestamp}] [{level}] {msg}\n")
-        f.flush()
-    except Exception:
-        pass  # 日志文件写入失败不影响主流程
+    _write_log_line(msg, level)
+
+
+def _write_log_line(msg, level):
+    """写入一行日志文件（放入后台写入队列）"""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    _init_log_file().write(f"[{timestamp}] [{level}] {msg}\n")
+
+
+# 当前工作线程正在执行的步骤（StepScheduler 设置），用于标注转发的子进程输出
+_step_context = threading.local()
+
+
+def log_output(line, label=None):
+    """实时转发子进程输出：控制台灰色缩进显示，同时写入日志文件
+
+    并行步骤的输出会交错，每行以 [label]（步骤或命令名）开头以便区分。
+    """
+    # 进度条用 \r 刷新同一行，只保留最后一段
+    line = line.rstrip("\n").rsplit("\r", 1)[-1]
+    if label:
+        line = f"[{label}] {line}"
+    with _console_lock:
+        print(f"\033[90m  │ {line}\033[0m")
+    _write_log_line(line, "OUT")
+
+
+def _execute(cmd, shell, env, capture=False, stream=False, label=None):
+    """启动子进程并流式读取输出，返回 (CompletedProcess, 子进程 rusage, 输出字节数)
+
+    - stdout: capture 时完整保留（供调用方解析），否则逐行转发到控制台和日志，不保留；
+      capture 且 stream 时同样逐行转发，只保留最后 STDOUT_TAIL_LINES 行
+    - stderr: 只在环形缓冲区中保留最后 STDERR_TAIL_LINES 行用于错误报告，
+      转发 stdout 时同样实时转发
+    除 capture 且不 stream 外，无论子进程输出多少，内存占用都是恒定的。
+    转发的每行以 label 标注，默认为当前步骤名，不在步骤中时为命令名。
+
+    使用 os.wait4 回收子进程，精确获得该子进程自身的 CPU 时间
+    （并行步骤下 RUSAGE_CHILDREN 的差值会混入其他子进程）。
+    """
+    proc = subprocess.Popen(
+        cmd,
+        shell=shell,
+        executable="/bin/zsh" if shell else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,  # 始终捕获以便显示错误
+        env=env,
+    )
+    echo = stream or not capture
+    if echo and not label:
+        program = cmd.split(None, 1)[0] if isinstance(cmd, str) else cmd[0]
+        label = getattr(_step_context, "name", None) or os.path.basename(program)
+    if not capture:
+        stdout_lines = deque(maxlen=0)
+    elif stream:
+        stdout_lines = deque(maxlen=STDOUT_TAIL_LINES)
+    else:
+        stdout_lines = []
+    stderr_tail: deque = deque(maxlen=STDERR_TAIL_LINES)
+    sizes = {"stdout": 0, "stderr": 0}
+
+    def pump(name, raw, keep, echo):
+        # 只按 \n 分行，\r 留给 log_output 处理进度条
+        text = io.TextIOWrapper(raw, encoding="utf-8", errors="replace", newline="\n")
+        for line in text:
+            sizes[name] += len(line)
+            keep.append(line)
+            if echo:
+                log_output(line, label)
+        text.close()
+
+    readers = [
+        threading.Thread(
+            target=pump,
+            args=("stdout", proc.stdout, stdout_lines, echo),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=pump,
+            args=("stderr", proc.stderr, stderr_tail, echo),
+            daemon=True,
+        ),
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    result = subprocess.CompletedProcess(
+        cmd, proc.returncode, "".join(stdout_lines), "".join(stderr_tail)
+    )
+    return result, rusage, sizes["stdout"] + sizes["stderr"]
 
 
-def run_cmd(cmd, shell=False, check=True, capture=False, env=None):
-    """运行系统命令，增强错误信息显示"""
+def run_cmd(
+    cmd, shell=False, check=True, capture=False, env=None, stream=False, label=None
+):
+    """运行系统命令，增强错误信息显示
+
+    耗时较长的命令传入 stream=True：capture 时仍实时转发输出，
+    result.stdout 只包含末尾若干行（适合只关心退出码或最后几行的调用方）。
+    """
     try:
         merged_env = {**os.environ, **(env or {})}
-        if shell:
-            result = subprocess.run(
-                cmd,
-                shell=True,
-                check=check,
-                executable="/bin/zsh",
-                capture_output=True,  # 始终捕获以便显示错误
-                text=True,
-                env=merged_env,
+        started = time.monotonic()
+        result, rusage, output_bytes = _execute(
+            cmd, shell, merged_env, capture, stream, label
+        )
+        if _tracer is not None:
+            _tracer.record(
+                "cmd",
+                cmd if isinstance(cmd, str) else " ".join(cmd),
+                started,
+                time.monotonic(),
+                exit_code=result.returncode,
+                cpu_user=rusage.ru_utime,
+                cpu_sys=rusage.ru_stime,
+                output_bytes=output_bytes,
             )
-        else:
-            result = subprocess.run(
-                cmd, check=check, capture_output=True, text=True, env=merged_env
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(
+                result.returncode, cmd, result.stdout, result.stderr
             )
         return result if capture else None
     except subprocess.CalledProcessError as e:
@@ -162,12 +504,150 @@ def run_cmd(cmd, shell=False, check=True, capture=False, env=None):
         cmd_str = cmd if isinstance(cmd, str) else " ".join(cmd)
         log(f"命令执行失败: {cmd_str}", "ERROR")
         if e.stderr:
-            # 只显示前 500 字符避免刷屏
-            stderr_preview = e.stderr.strip()[:500]
+            # stderr 只保留了最后若干行，再截取末尾 500 字符避免刷屏
+            stderr_preview = e.stderr.strip()[-500:]
             log(f"  错误详情: {stderr_preview}", "ERROR")
         if check:
             sys.exit(1)
         return None
+    except FileNotFoundError as e:
+        # 命令不在 PATH 中，按执行失败处理
+        cmd_str = cmd if isinstance(cmd, str) else " ".join(cmd)
+        log(f"命令执行失败: {cmd_str}（未找到 {e.filename or '命令'}）", "ERROR")
+        if check:
+            sys.exit(1)
+        return None
+
+
+# ================= Tracing =================
+
+
+class Tracer:
+    """执行跟踪（--trace）
+
+    记录每个步骤和每条命令的墙钟时间、子进程 CPU 时间、退出码和输出大小，
+    实时追加到 JSON Lines 文件，结束时另存为 Chrome trace-event 文件
+    （可在 chrome://tracing 或 Perfetto 中打开）。
+    """
+
+    def __init__(self, out_dir: Path):
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        self.jsonl_path = out_dir / f"trace-{stamp}.jsonl"
+        self.chrome_path = out_dir / f"trace-{stamp}.trace.json"
+        self.events: List[Dict] = []
+        self._lock = threading.Lock()
+        self._threads: Dict[int, Tuple[int, str]] = {}
+        self._t0 = time.monotonic()
+        self._jsonl = open(self.jsonl_path, "a", encoding="utf-8")
+
+    def _thread_id(self) -> int:
+        """把线程标识映射为从 1 开始的小整数，便于在时间线中查看"""
+        ident = threading.get_ident()
+        if ident not in self._threads:
+            self._threads[ident] = (
+                len(self._threads) + 1,
+                threading.current_thread().name,
+            )
+        return self._threads[ident][0]
+
+    def record(self, kind: str, name: str, start: float, end: float, **fields) -> None:
+        """记录一个事件（start/end 为 time.monotonic() 时间）"""
+        event = {
+            "kind": kind,
+            "name": name,
+            "start": round(start - self._t0, 6),
+            "wall": round(end - start, 6),
+            **fields,
+        }
+        with self._lock:
+            event["tid"] = self._thread_id()
+            self.events.append(event)
+            self._jsonl.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self._jsonl.flush()
+
+    def close(self) -> None:
+        """关闭 JSON Lines 文件并写出 Chrome trace-event 文件"""
+        with self._lock:
+            self._jsonl.close()
+            pid = os.getpid()
+            trace = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self._threads.values()
+            ]
+            for event in self.events:
+                args = {
+                    k: v
+                    for k, v in event.items()
+                    if k not in ("kind", "name", "start", "wall", "tid")
+                }
+                trace.append(
+                    {
+                        "name": event["name"],
+                        "cat": event["kind"],
+                        "ph": "X",
+                        "ts": int(event["start"] * 1e6),
+                        "dur": int(event["wall"] * 1e6),
+                        "pid": pid,
+                        "tid": event["tid"],
+                        "args": args,
+                    }
+                )
+            with open(self.chrome_path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": trace}, f, ensure_ascii=False)
+
+    def summary(self, top_n: int = 10) -> None:
+        """输出最慢的 top_n 条命令"""
+        commands = sorted(
+            (e for e in self.events if e["kind"] == "cmd"),
+            key=lambda e: e["wall"],
+            reverse=True,
+        )[:top_n]
+        log(f"最慢的 {len(commands)} 条命令:")
+        log("      墙钟      CPU 退出码      输出  命令")
+        for e in commands:
+            cpu = e.get("cpu_user", 0.0) + e.get("cpu_sys", 0.0)
+            name = e["name"] if len(e["name"]) <= 60 else e["name"][:57] + "..."
+            log(
+                f"  {e['wall']:7.1f}s {cpu:7.1f}s {e.get('exit_code', ''):>6} "
+                f"{e.get('output_bytes', 0):>8}B  {name}"
+            )
+        log(f"跟踪文件: {self.jsonl_path}")
+        log(f"Chrome trace: {self.chrome_path}")
+
+
+# 当前运行的跟踪器（--trace 时启用）
+_tracer: Optional[Tracer] = None
+
+
+# 资源并发上限（未列出的资源默认为 1，即独占）
+RESOURCE_LIMITS = {
+    "network": 4,  # 并发下载/克隆数
+    "brew": 1,  # Homebrew 全局锁，brew 进程之间不能并发
+    "zshrc": 1,  # ~/.zshrc 编辑
+}
+
+_resource_locks = {}
+_resource_locks_guard = threading.Lock()
+
+
+def resource_lock(name):
+    """获取资源对应的锁（独占资源为可重入锁，共享资源为计数信号量）"""
+    with _resource_locks_guard:
+        lock = _resource_locks.get(name)
+        if lock is None:
+            limit = RESOURCE_LIMITS.get(name, 1)
+            lock = (
+                threading.RLock() if limit <= 1 else threading.BoundedSemaphore(limit)
+            )
+            _resource_locks[name] = lock
+        return lock
 
 
 def check_environment():
@@ -220,25 +700,51 @@ def ensure_backup_dir():
     return BACKUP_DIR
 
 
-def backup_file(file_path, prefix=""):
-    """备份文件"""
-    if not file_path.exists():
-        return None
+@contextmanager
+def file_lock(lock_path):
+    """跨进程文件锁（flock），用于避免多个 mac-setup.py 同时执行同一操作"""
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
 
-    backup_dir = ensure_backup_dir()
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    backup_name = f"{prefix}{file_path.name}.{timestamp}"
-    backup_path = backup_dir / backup_name
 
-    shutil.copy2(file_path, backup_path)
-    log(f"  备份创建: {backup_path}")
+def parse_duration(value) -> float:
+    """解析时长字符串（如 90s / 30m / 6h / 1d），纯数字按秒计算"""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    text = str(value).strip().lower()
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([smhd]?)", text)
+    if not match:
+        raise argparse.ArgumentTypeError(f"无效的时长: {value}（示例: 30m, 6h, 1d）")
+    return float(match.group(1)) * units[match.group(2) or "s"]
+
+
+def file_sha256(file_path) -> str:
+    """计算文件内容的 SHA-256（文件不存在时返回空字符串）"""
+    file_path = Path(file_path)
+    if not file_path.exists():
+        return ""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
-    # 创建 latest 符号链接（使用相对路径，避免目录移动后失效）
-    latest_link = backup_dir / f"{prefix}{file_path.name}.latest"
-    if latest_link.exists() or latest_link.is_symlink():
-        latest_link.unlink()
-    latest_link.symlink_to(backup_name)
+def backup_file(file_path, prefix=""):
+    """备份文件（内容寻址存储，内容未变化时只追加一条清单记录）"""
+    if not file_path.exists():
+        return None
 
+    backup_path, created = BackupStore(ensure_backup_dir()).backup(file_path, prefix)
+    if created:
+        log(f"  备份创建: {backup_path}")
+    else:
+        log(f"  内容未变化，复用备份: {backup_path}")
     return backup_path
 
 
@@ -300,7 +806,7 @@ def parse_brew_packages():
     return formulae, casks
 
 
-def ensure_line_in_file(file_path, line, marker=None, prepend=False):
+def ensure_line_in_file(file_path, line, marker=None, prepend=False, update=False):
     """确保文件中包含某行内容，支持幂等操作
 
     Args:
@@ -308,38 +814,19 @@ def ensure_line_in_file(file_path, line, marker=None, prepend=False):
         line: 要添加的内容
         marker: 标记名称（用于创建 ### marker START/END ### 块）
         prepend: 是否插入到文件开头（默认追加到末尾）
+        update: 标记块已存在但内容不同时原地替换（用于升级旧版本生成的块）
     """
     file_path = Path(file_path)
-    if not file_path.exists():
-        file_path.touch()
-
-    content = read_file_content(file_path)
-
-    # 如果有标记块，检查标记块
-    if marker:
-        start_marker = f"### {marker} START ###"
-        end_marker = f"### {marker} END ###"
-        if start_marker in content:
-            return  # 已经存在，不再重复添加
-
-        full_block = f"{start_marker}\n{line}\n{end_marker}\n"
-
-        if prepend:
-            # 插入到文件开头
-            new_content = full_block + "\n" + content
-            write_file_content(file_path, new_content)
+    # 并行步骤可能同时编辑 .zshrc，读-改-写过程必须串行
+    with resource_lock("zshrc"):
+        txn = _zshrc_txn
+        if txn is not None and txn.path == file_path:
+            # 事务进行中：只修改内存中的内容，由 commit_zshrc_transaction 统一写入
+            txn.ensure_line(line, marker=marker, prepend=prepend, update=update)
         else:
-            # 追加到文件末尾
-            with open(file_path, "a") as f:
-                f.write(f"\n{full_block}")
-    else:
-        if line.strip() not in content:
-            if prepend:
-                new_content = line + "\n" + content
-                write_file_content(file_path, new_content)
-            else:
-                with open(file_path, "a") as f:
-                    f.write(f"\n{line}\n")
+            txn = ZshrcTransaction(file_path)
+            txn.ensure_line(line, marker=marker, prepend=prepend, update=update)
+            txn.commit()
 
 
 # ================= Oh My Zsh Logic (Object Oriented) =================
@@ -351,19 +838,25 @@ class ZshConfig:
     功能:
     - 检测 Oh My Zsh 配置
     - 提取/更新 plugins 和 theme
-    - 自动排除脚本生成的 AUTO 块
+    - 自动排除脚本生成的标记块（解析见 zshrc_blocks）
     """
 
-    # AUTO 块的标记模式
-    AUTO_BLOCK_PATTERN = re.compile(
-        r"(### AUTO-[^\n]*\n)(.*?)(### END AUTO-[^\n]*\n)", re.DOTALL
-    )
+    PLUGINS_PATTERN = re.compile(r"^\s*plugins=\([^)]*\)", re.MULTILINE | re.DOTALL)
+    THEME_PATTERN = re.compile(r'^\s*ZSH_THEME="[^"]*"', re.MULTILINE)
 
     def __init__(self, path: Path):
         self.path = path
         self._content: str = ""
+        self._index: Optional[ZshrcIndex] = None
         self._load()
 
+    @property
+    def index(self) -> ZshrcIndex:
+        """当前内容的解析结果（内容变化后重新解析一次）"""
+        if self._index is None or self._index.text is not self._content:
+            self._index = ZshrcIndex(self._content)
+        return self._index
+
     def _load(self) -> None:
         """加载文件内容"""
         if not self.path.exists():
@@ -394,8 +887,8 @@ class ZshConfig:
         backup_file(self.path, "original-")
 
     def _get_clean_content(self) -> str:
-        """获取移除 AUTO 块后的纯净内容（用于检测用户原有配置）"""
-        return self.AUTO_BLOCK_PATTERN.sub("", self._content)
+        """获取移除标记块后的纯净内容（用于检测用户原有配置）"""
+        return self.index.user_text
 
     def has_omz(self) -> bool:
         """检测是否安装了 Oh My Zsh（排除 AUTO 块）"""
@@ -438,20 +931,12 @@ class ZshConfig:
 
         # 策略：找到第一个不在 AUTO 块内的 plugins=() 并替换
         content = self._content
+        index = self.index
 
-        # 获取所有 AUTO 块的位置范围
-        auto_spans = [
-            (m.start(), m.end()) for m in self.AUTO_BLOCK_PATTERN.finditer(content)
-        ]
-
-        # 查找所有 plugins=() 的位置
-        plugins_pattern = re.compile(r"^\s*plugins=\([^)]*\)", re.MULTILINE | re.DOTALL)
-
-        for match in plugins_pattern.finditer(content):
+        for match in self.PLUGINS_PATTERN.finditer(content):
             start, end = match.start(), match.end()
-            # 检查是否在 AUTO 块内
-            in_auto = any(span[0] <= start < span[1] for span in auto_spans)
-            if not in_auto:
+            # 检查是否在 AUTO 块内（区间索引二分查找）
+            if not index.in_block(start):
                 # 替换这个匹配
                 new_content = (
                     content[:start] + f"plugins=({plugins_str})" + content[end:]
@@ -464,20 +949,12 @@ class ZshConfig:
     def update_theme(self, theme: str) -> None:
         """更新主题（只修改非 AUTO 块中的定义）"""
         content = self._content
+        index = self.index
 
-        # 获取所有 AUTO 块的位置范围
-        auto_spans = [
-            (m.start(), m.end()) for m in self.AUTO_BLOCK_PATTERN.finditer(content)
-        ]
-
-        # 查找所有 ZSH_THEME="" 的位置
-        theme_pattern = re.compile(r'^\s*ZSH_THEME="[^"]*"', re.MULTILINE)
-
-        for match in theme_pattern.finditer(content):
+        for match in self.THEME_PATTERN.finditer(content):
             start, end = match.start(), match.end()
-            # 检查是否在 AUTO 块内
-            in_auto = any(span[0] <= start < span[1] for span in auto_spans)
-            if not in_auto:
+            # 检查是否在 AUTO 块内（区间索引二分查找）
+            if not index.in_block(start):
                 # 保留原有缩进
                 indent = ""
                 indent_match = re.match(r"^(\s*)", match.group())
@@ -491,6 +968,144 @@ class ZshConfig:
                 return
 
 
+class ZshrcTransaction(ZshConfig):
+    """.zshrc 编辑事务
+
+    在 ZshConfig 的基础上，把所有标记块插入和 plugins/theme 修改都累积在内存中，
+    commit() 时通过临时文件 + rename 原子写入一次。按字节读写
+    （surrogateescape，保留原有换行符），结果与逐次写文件完全一致。
+    """
+
+    def __init__(self, path: Path):
+        self._existed = False
+        self._dirty = False
+        super().__init__(path)
+
+    def _load(self) -> None:
+        self._existed = self.path.exists()
+        if not self._existed:
+            self._content = ""
+            return
+        with open(
+            self.path, "r", encoding="utf-8", errors="surrogateescape", newline=""
+        ) as f:
+            self._content = f.read()
+
+    def _save(self, content: str) -> None:
+        """只更新内存内容，等待 commit"""
+        if content != self._content:
+            self._content = content
+            self._dirty = True
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty or not self._existed
+
+    def ensure_line(self, line: str, marker=None, prepend=False, update=False) -> None:
+        """确保内容中包含某行/标记块（语义同 ensure_line_in_file）"""
+        content = self._content
+        if not self._existed:
+            self._dirty = True  # 与 ensure_line_in_file 一致：文件不存在时创建
+
+        if marker:
+            start_marker = f"### {marker} START ###"
+            end_marker = f"### {marker} END ###"
+            full_block = f"{start_marker}\n{line}\n{end_marker}\n"
+            if self.index.has_block(marker):
+                if update:
+                    self._replace_block(marker, full_block)
+                return  # 已经存在，不再重复添加
+            if prepend:
+                self._save(full_block + "\n" + content)
+            else:
+                self._save(content + f"\n{full_block}")
+        elif line.strip() not in content:
+            if prepend:
+                self._save(line + "\n" + content)
+            else:
+                self._save(content + f"\n{line}\n")
+
+    def _replace_block(self, marker: str, block_text: str) -> None:
+        """把第一个同名标记块替换为 block_text（setup-macos.sh 的旧格式块不处理）"""
+        parts = []
+        replaced = False
+        for seg in self.index.segments:
+            if not replaced and seg.is_block and seg.name == marker and not seg.legacy:
+                parts.append(block_text)
+                replaced = True
+            else:
+                parts.append(seg.text)
+        self._save("".join(parts))
+
+    def digest(self) -> str:
+        """当前内容的 SHA-256（与提交后文件的 file_sha256 一致）"""
+        if not self._existed and not self._dirty:
+            return ""
+        data = self._content.encode("utf-8", errors="surrogateescape")
+        return hashlib.sha256(data).hexdigest()
+
+    def commit(self) -> bool:
+        """原子写入文件，无修改时不写。返回是否发生写入"""
+        if not self.dirty:
+            return False
+        # .zshrc 可能是 dotfiles 仓库的符号链接，写入链接指向的实际文件
+        target = self.path.resolve() if self.path.is_symlink() else self.path
+        tmp_path = target.with_name(f".{target.name}.mac-setup.tmp")
+        with open(
+            tmp_path, "w", encoding="utf-8", errors="surrogateescape", newline=""
+        ) as f:
+            f.write(self._content)
+        if target.exists():
+            shutil.copymode(target, tmp_path)
+        os.replace(tmp_path, target)
+        self._existed = True
+        self._dirty = False
+        # zsh 在 .zshrc 旁查找 .zshrc.zwc，已编译过时同步更新
+        recompile_if_compiled(self.path)
+        return True
+
+
+# 当前运行中的 .zshrc 事务（见 begin_zshrc_transaction）
+_zshrc_txn: Optional[ZshrcTransaction] = None
+
+
+def begin_zshrc_transaction() -> ZshrcTransaction:
+    """开始 .zshrc 事务，之后对 ZSHRC_PATH 的修改都只发生在内存中"""
+    global _zshrc_txn
+    with resource_lock("zshrc"):
+        if _zshrc_txn is None:
+            _zshrc_txn = ZshrcTransaction(ZSHRC_PATH)
+        return _zshrc_txn
+
+
+def flush_zshrc_transaction() -> None:
+    """把事务中已累积的修改写入磁盘（事务保持打开）
+
+    仅在外部程序需要读取 .zshrc 时使用（如 Oh My Zsh 安装器判断是否保留 .zshrc）。
+    """
+    with resource_lock("zshrc"):
+        if _zshrc_txn is not None:
+            _zshrc_txn.commit()
+
+
+def commit_zshrc_transaction() -> None:
+    """提交并结束 .zshrc 事务"""
+    global _zshrc_txn
+    with resource_lock("zshrc"):
+        if _zshrc_txn is not None:
+            if _zshrc_txn.commit():
+                log(f"已写入 {_zshrc_txn.path}")
+            _zshrc_txn = None
+
+
+def zshrc_digest() -> str:
+    """.zshrc 当前内容的哈希（事务进行中时使用内存内容）"""
+    with resource_lock("zshrc"):
+        if _zshrc_txn is not None:
+            return _zshrc_txn.digest()
+    return file_sha256(ZSHRC_PATH)
+
+
 def merge_plugins(existing: List[str], new_plugins: List[str]) -> List[str]:
     """合并插件列表（去重并保持顺序）"""
     seen = set()
@@ -508,66 +1123,500 @@ def merge_plugins(existing: List[str], new_plugins: List[str]) -> List[str]:
     return result
 
 
+# ================= Homebrew State =================
+
+
+def detect_brew_prefix() -> Optional[Path]:
+    """不启动 brew 进程，推断 Homebrew 安装前缀"""
+    candidates = []
+    if os.environ.get("HOMEBREW_PREFIX"):
+        candidates.append(Path(os.environ["HOMEBREW_PREFIX"]))
+    if platform.machine() == "arm64":
+        candidates.append(Path("/opt/homebrew"))
+    candidates.append(Path("/usr/local"))
+    for prefix in candidates:
+        if (prefix / "Cellar").is_dir() or (prefix / "bin" / "brew").exists():
+            return prefix
+    return None
+
+
+def detect_brew_cache() -> Path:
+    """Homebrew 下载缓存目录（HOMEBREW_CACHE 或默认位置）"""
+    if os.environ.get("HOMEBREW_CACHE"):
+        return Path(os.environ["HOMEBREW_CACHE"])
+    return Path.home() / "Library" / "Caches" / "Homebrew"
+
+
+class BrewState:
+    """Homebrew 已安装状态快照
+
+    直接读取 <prefix>/Cellar 和 <prefix>/Caskroom 目录，不启动 brew（Ruby）进程。
+    如果本地存在 Homebrew API 缓存（formula.jws.json / cask.jws.json），
+    同时用它判断已安装的包是否过期。
+    """
+
+    def __init__(self, prefix: Path, api_cache: Optional[Path] = None):
+        self.prefix = Path(prefix)
+        self.api_cache = api_cache
+        self.formulae = self._scan(self.prefix / "Cellar")
+        self.casks = self._scan(self.prefix / "Caskroom")
+        self._latest: Dict[str, Dict[str, str]] = {}
+
+    @staticmethod
+    def _scan(root: Path) -> Dict[str, List[str]]:
+        """读取 <root>/<name>/<version> 两级目录"""
+        installed: Dict[str, List[str]] = {}
+        if not root.is_dir():
+            return installed
+        for entry in os.scandir(root):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            versions = [
+                v.name
+                for v in os.scandir(entry.path)
+                if v.is_dir() and not v.name.startswith(".")
+            ]
+            if versions:
+                installed[entry.name] = versions
+        return installed
+
+    def _load_latest(self, kind: str) -> Dict[str, str]:
+        """从 API 缓存读取最新版本（缓存不存在时返回空字典）"""
+        if kind in self._latest:
+            return self._latest[kind]
+        latest: Dict[str, str] = {}
+        api_file = self.api_cache / f"{kind}.jws.json" if self.api_cache else None
+        if api_file and api_file.exists():
+            try:
+                with open(api_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and "payload" in data:
+                    data = json.loads(data["payload"])
+                for item in data:
+                    if kind == "formula":
+                        version = item.get("versions", {}).get("stable") or ""
+                        if version and item.get("revision"):
+                            version = f"{version}_{item['revision']}"
+                        latest[item["name"]] = version
+                        for alias in item.get("aliases", []):
+                            latest[alias] = version
+                    else:
+                        latest[item["token"]] = str(item.get("version") or "")
+            except (OSError, ValueError, KeyError, TypeError):
+                latest = {}
+        self._latest[kind] = latest
+        return latest
+
+    def has_formula(self, name: str) -> bool:
+        short = name.rsplit("/", 1)[-1]
+        # 别名（如 sqlite3 -> sqlite）通过 opt/ 下的链接识别
+        return short in self.formulae or (self.prefix / "opt" / short).exists()
+
+    def has_cask(self, token: str) -> bool:
+        return token.rsplit("/", 1)[-1] in self.casks
+
+    def is_outdated(self, kind: str, name: str) -> bool:
+        short = name.rsplit("/", 1)[-1]
+        latest = self._load_latest(kind).get(short)
+        if not latest or latest == "latest":
+            return False
+        if kind == "formula":
+            opt = self.prefix / "opt" / short
+            installed = self.formulae.get(short) or (
+                [opt.resolve().name] if opt.exists() else []
+            )
+        else:
+            installed = self.casks.get(short, [])
+        if any(v.startswith("HEAD") for v in installed):
+            return False
+        return latest not in installed
+
+    def pending(
+        self, formulae: List[str], casks: List[str]
+    ) -> Tuple[List[str], List[str]]:
+        """返回缺失或过期、需要交给 brew 处理的 formulae 和 casks"""
+        todo_formulae = [
+            f
+            for f in formulae
+            if not self.has_formula(f) or self.is_outdated("formula", f)
+        ]
+        todo_casks = [
+            c for c in casks if not self.has_cask(c) or self.is_outdated("cask", c)
+        ]
+        return todo_formulae, todo_casks
+
+
+def load_brew_state() -> Optional[BrewState]:
+    """读取当前机器的 Homebrew 状态（未找到前缀时返回 None）"""
+    prefix = detect_brew_prefix()
+    if prefix is None:
+        return None
+    return BrewState(prefix, api_cache=detect_brew_cache() / "api")
+
+
+# ================= Zsh Compilation =================
+
+
+def zwc_path(source: Path) -> Path:
+    """source 对应的 zsh 字节码文件（<source>.zwc）"""
+    return source.with_name(source.name + ".zwc")
+
+
+def zwc_is_stale(source: Path) -> bool:
+    """.zwc 不存在或早于源文件（zsh 只加载不早于源文件的 .zwc）"""
+    try:
+        return zwc_path(source).stat().st_mtime < source.stat().st_mtime
+    except FileNotFoundError:
+        return True
+
+
+def zcompile(sources: List[Path]) -> int:
+    """在一个 zsh 进程中把 sources 编译为 .zwc，返回成功编译的文件数
+
+    没有 zsh 时不编译（返回 0）。
+    """
+    zsh = shutil.which("zsh")
+    if not zsh or not sources:
+        return 0
+    script = 'for f in "$@"; do zcompile "$f" || print -r -- "$f"; done'
+    result = run_cmd(
+        [zsh, "-fc", script, "zsh"] + [str(p) for p in sources],
+        check=False,
+        capture=True,
+    )
+    failed = result.stdout.split("\n") if result is not None else []
+    failed = [line for line in failed if line]
+    for path in failed:
+        log(f"  zcompile 失败: {path}", "WARN")
+    return len(sources) - len(failed) if result is not None else 0
+
+
+def recompile_if_compiled(source: Path) -> None:
+    """源文件被改写后重新编译已有的 .zwc（没有 .zwc 时不主动创建）"""
+    if zwc_path(source).exists() and zwc_is_stale(source):
+        zcompile([source])
+
+
+def zsh_startup_sources() -> List[Path]:
+    """shell 启动时加载的脚本：.zshrc、初始化脚本缓存、Oh My Zsh 核心及启用的插件"""
+    omz_path = Path.home() / ".oh-my-zsh"
+    sources = [ZSHRC_PATH, *sorted(INIT_CACHE_DIR.glob("*.zsh"))]
+    sources += [omz_path / "oh-my-zsh.sh", *sorted((omz_path / "lib").glob("*.zsh"))]
+    for name in OMZ_PLUGINS:
+        for base in (omz_path / "custom" / "plugins", omz_path / "plugins"):
+            plugin_dir = base / name
+            if not plugin_dir.is_dir():
+                continue
+            # 跳过插件仓库中的测试数据（如 zsh-syntax-highlighting 的 test-data）
+            sources += [
+                path
+                for path in sorted(plugin_dir.rglob("*.zsh"))
+                if not any(
+                    part.startswith((".", "test"))
+                    for part in path.relative_to(plugin_dir).parts
+                )
+            ]
+            break
+    return [path for path in sources if path.is_file()]
+
+
+def generate_completions() -> int:
+    """把 ZSH_COMPLETIONS 中命令的补全脚本写入 COMPLETIONS_DIR，返回更新的文件数"""
+    updated = 0
+    for file_name, cmd in ZSH_COMPLETIONS.items():
+        if not shutil.which(cmd[0]):
+            continue
+        result = run_cmd(cmd, check=False, capture=True)
+        if result is None or result.returncode != 0 or not result.stdout.strip():
+            log(f"  生成补全失败: {' '.join(cmd)}", "WARN")
+            continue
+        target = COMPLETIONS_DIR / file_name
+        if read_file_content(target) == result.stdout:
+            continue
+        COMPLETIONS_DIR.mkdir(parents=True, exist_ok=True)
+        write_file_content(target, result.stdout)
+        updated += 1
+    return updated
+
+
+# ================= Init Script Cache =================
+
+
+# 缓存文件首行：生成时的二进制路径和 mtime，shell 启动时据此判断缓存是否失效
+INIT_CACHE_STAMP = "# mac-setup init-cache: {binary} {mtime}"
+# 生成缓存时使用的 PATH（系统默认），保证输出完整的 PATH 设置
+INIT_CACHE_PATH = "/usr/bin:/bin:/usr/sbin:/sbin"
+
+# 替代 eval "$(tool args)" 的 zsh 片段：zstat 是内建命令，缓存命中时不创建子进程
+# 与 refresh_init_cache 一样使用系统默认 PATH 生成（如新版 brew shellenv 在 PATH
+# 已包含 Homebrew 时不输出任何内容）；没有输出时保留原缓存
+INIT_CACHE_SNIPPET = """_ms_bin={binary} _ms_cache="$HOME/.cache/mac-setup/{name}.zsh" _ms_head= _ms_mtime=
+zmodload -F zsh/stat b:zstat 2>/dev/null && zstat -A _ms_mtime +mtime "$_ms_bin" 2>/dev/null
+_ms_stamp="# mac-setup init-cache: $_ms_bin $_ms_mtime"
+[[ -r "$_ms_cache" ]] && read -r _ms_head < "$_ms_cache"
+if [[ "$_ms_head" != "$_ms_stamp" ]]; then
+  mkdir -p "${{_ms_cache:h}}"
+  _ms_out="$(PATH={clean_path} "$_ms_bin" {args})" && [[ -n "$_ms_out" ]] \\
+    && print -r -- "$_ms_stamp"$'\\n'"$_ms_out" >| "$_ms_cache.$$" \\
+    && mv -f -- "$_ms_cache.$$" "$_ms_cache" || rm -f -- "$_ms_cache.$$"
+fi
+[[ -r "$_ms_cache" ]] && source "$_ms_cache"
+unset _ms_bin _ms_cache _ms_head _ms_mtime _ms_stamp _ms_out"""
+
+
+def cached_init_snippet(name: str, binary: str, args: str) -> str:
+    """生成 source 初始化脚本缓存的 zsh 片段
+
+    Args:
+        name: 缓存名称（INIT_CACHE_DIR/<name>.zsh）
+        binary: 二进制路径的 zsh 表达式（如 /opt/homebrew/bin/brew、${commands[mise]}）
+        args: 生成初始化脚本的参数（如 activate zsh）
+    """
+    return INIT_CACHE_SNIPPET.format(
+        name=name, binary=binary, args=args, clean_path=INIT_CACHE_PATH
+    )
+
+
+def refresh_init_cache(
+    name: str, binary: Optional[str], args: List[str], env=None
+) -> None:
+    """执行 binary args，把输出写入初始化脚本缓存
+
+    安装或升级工具后调用，下次启动 shell 时直接命中缓存；内容未变化时不重写。
+    生成失败不影响安装，启动 shell 时片段会自动重新生成。
+    """
+    if not binary or not os.access(binary, os.X_OK):
+        return
+    env = env or {"PATH": INIT_CACHE_PATH}
+    result = run_cmd([binary] + args, check=False, capture=True, env=env)
+    if result is None or result.returncode != 0 or not result.stdout.strip():
+        log(f"生成 {name} 初始化脚本缓存失败，将在启动 shell 时重试", "WARN")
+        return
+    stamp = INIT_CACHE_STAMP.format(binary=binary, mtime=int(os.stat(binary).st_mtime))
+    content = f"{stamp}\n{result.stdout}"
+    cache_path = INIT_CACHE_DIR / f"{name}.zsh"
+    if read_file_content(cache_path) == content:
+        return
+    INIT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    write_file_content(tmp_path, content)
+    os.replace(tmp_path, cache_path)
+    recompile_if_compiled(cache_path)
+    log(f"已缓存 {name} 初始化脚本: {cache_path}")
+
+
 # ================= Installation Steps =================
 
 
-def install_homebrew(arch):
+def brew_update(ttl=BREW_UPDATE_TTL, force=False):
+    """执行 brew update，距上次成功更新不足 ttl 秒时跳过
+
+    上次成功更新的时间记录在 BACKUP_DIR/brew-update.stamp，
+    并用文件锁保证多个进程同时运行时只有一个执行更新。
+    """
+    stamp = BACKUP_DIR / "brew-update.stamp"
+    with file_lock(BACKUP_DIR / "brew-update.lock"):
+        if not force and stamp.exists():
+            age = time.time() - stamp.stat().st_mtime
+            if 0 <= age < ttl:
+                log(
+                    f"brew update 已于 {age / 60:.0f} 分钟前执行，跳过（--force-update 强制更新）"
+                )
+                return
+        log("执行 brew update...")
+        result = run_cmd(["brew", "update"], check=False, capture=True, stream=True)
+        if result is not None and result.returncode == 0:
+            stamp.touch()
+
+
+def install_homebrew(arch, update_ttl=BREW_UPDATE_TTL, force_update=False):
     """安装或更新 Homebrew"""
     log("检查 Homebrew...")
     if shutil.which("brew"):
         log("Homebrew 已安装")
-        run_cmd(["brew", "update"], check=False)
+        brew_update(ttl=update_ttl, force=force_update)
     else:
         log("正在安装 Homebrew...")
         cmd = '/bin/bash -c "$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install.sh)"'
         run_cmd(cmd, shell=True)
 
-    # Apple Silicon 芯片路径适配
-    if arch == "arm64" and Path("/opt/homebrew/bin/brew").exists():
-        # 添加到当前进程 PATH
-        os.environ["PATH"] = (
-            f"/opt/homebrew/bin:/opt/homebrew/sbin:{os.environ.get('PATH', '')}"
-        )
+    brew_bin = homebrew_bin(arch)
+    if Path(brew_bin).exists():
+        add_homebrew_to_path(arch)
+        configure_homebrew_path(arch)
+        refresh_init_cache("brew", brew_bin, ["shellenv"])
 
-        # 写入 .zshrc（确保 Homebrew 工具优先于系统工具）
-        homebrew_path_config = '''# Homebrew (Apple Silicon)
-eval "$(/opt/homebrew/bin/brew shellenv)"'''
-        ensure_line_in_file(
-            ZSHRC_PATH, homebrew_path_config, marker="HOMEBREW-PATH", prepend=True
-        )
-    elif arch != "arm64" and Path("/usr/local/bin/brew").exists():
-        # Intel Mac
-        homebrew_path_config = '''# Homebrew (Intel)
-eval "$(/usr/local/bin/brew shellenv)"'''
-        ensure_line_in_file(
-            ZSHRC_PATH, homebrew_path_config, marker="HOMEBREW-PATH", prepend=True
+
+def add_homebrew_to_path(arch):
+    """Apple Silicon 芯片路径适配：把 Homebrew 添加到当前进程 PATH
+
+    homebrew 步骤可能被 --resume 跳过，因此 main() 在执行步骤前也会调用。
+    """
+    if arch != "arm64" or not Path(homebrew_bin(arch)).exists():
+        return
+    paths = os.environ.get("PATH", "").split(os.pathsep)
+    if "/opt/homebrew/bin" not in paths:
+        os.environ["PATH"] = os.pathsep.join(
+            ["/opt/homebrew/bin", "/opt/homebrew/sbin", *paths]
         )
 
 
+def homebrew_bin(arch) -> str:
+    """Homebrew 默认安装位置的 brew 路径"""
+    return "/opt/homebrew/bin/brew" if arch == "arm64" else "/usr/local/bin/brew"
+
+
+def configure_homebrew_path(arch):
+    """写入 .zshrc（确保 Homebrew 工具优先于系统工具）"""
+    brew_bin = homebrew_bin(arch)
+    label = "Apple Silicon" if arch == "arm64" else "Intel"
+    snippet = textwrap.indent(cached_init_snippet("brew", brew_bin, "shellenv"), "  ")
+    homebrew_path_config = f"""# Homebrew ({label})
+if [[ -x {brew_bin} ]]; then
+{snippet}
+fi"""
+    ensure_line_in_file(
+        ZSHRC_PATH,
+        homebrew_path_config,
+        marker="HOMEBREW-PATH",
+        prepend=True,
+        update=True,
+    )
+
+
 def install_brew_packages():
     """安装 Homebrew 软件包"""
     log("安装/更新 Homebrew 软件包...")
+    install_brew_base()
+    install_brew_bundle()
+
 
-    # 1. 安装基础编译依赖
+def install_brew_base():
+    """安装基础编译依赖（Mise/Rust/Go 步骤的前置条件）"""
     log("安装编译依赖 (OpenSSL, Readline等)...")
-    run_cmd(["brew", "install"] + BASE_BREW_PACKAGES, check=False)
+    state = load_brew_state()
+    packages = BASE_BREW_PACKAGES
+    if state is not None:
+        packages, _ = state.pending(BASE_BREW_PACKAGES, [])
+    if not packages:
+        log("编译依赖均已安装且为最新，跳过")
+        return
+    outdated = [p for p in packages if state is not None and state.has_formula(p)]
+    missing = [p for p in packages if p not in outdated]
+    if missing:
+        run_cmd(["brew", "install"] + missing, check=False)
+    if outdated:
+        run_cmd(["brew", "upgrade"] + outdated, check=False)
+
 
-    # 2. 解析外部配置文件
+def install_brew_bundle():
+    """按 brew-packages.txt 安装用户软件包"""
+    # 1. 解析外部配置文件
     formulae, casks = parse_brew_packages()
 
-    # 3. 生成临时 Brewfile 并安装
-    brewfile_content = ""
-    for pkg in formulae:
-        brewfile_content += f'brew "{pkg}"\n'
-    for cask in casks:
-        brewfile_content += f'cask "{cask}"\n'
+    # 2. 与磁盘上的 Cellar/Caskroom 对比，只处理缺失或过期的包
+    state = load_brew_state()
+    if state is not None:
+        total = len(formulae) + len(casks)
+        formulae, casks = state.pending(formulae, casks)
+        log(f"待安装/升级: {len(formulae) + len(casks)} / {total}")
+        if not formulae and not casks:
+            log("所有软件包均已安装且为最新，跳过安装")
+            return
+
+    # 3. 并发预下载，下载完成的包依次安装（已安装的过期包执行升级）
+    prefetch_and_install(formulae, casks, state=state)
+
+
+def brew_formula_deps(formulae: List[str]) -> List[str]:
+    """formulae 的全部（递归）依赖，只启动一次 brew 进程，失败时返回空列表"""
+    if not formulae:
+        return []
+    result = run_cmd(
+        ["brew", "deps", "--union", "--formula"] + formulae,
+        check=False,
+        capture=True,
+    )
+    if result is None or result.returncode != 0:
+        return []
+    return [d for d in result.stdout.split() if d not in formulae]
+
 
-    brewfile_path = Path("/tmp/Brewfile_setup_temp")
-    write_file_content(brewfile_path, brewfile_content)
+def _brew_fetch(kind: str, name: str) -> Tuple[str, str, float, bool]:
+    """下载单个 formula 或 cask（不含依赖），返回 (类型, 名称, 耗时, 是否成功)"""
+    t0 = time.monotonic()
+    cmd = ["brew", "fetch", "--cask" if kind == "cask" else "--formula", name]
+    result = run_cmd(cmd, check=False, capture=True, stream=True, label=name)
+    ok = result is not None and result.returncode == 0
+    return kind, name, time.monotonic() - t0, ok
 
-    log("执行 Brew Bundle...")
-    run_cmd(["brew", "bundle", "--file", str(brewfile_path)], check=False)
-    brewfile_path.unlink(missing_ok=True)
+
+def _brew_install(kind: str, name: str, state: Optional[BrewState]) -> bool:
+    """安装单个软件包（state 中已安装即过期的包改为升级），返回是否成功"""
+    installed = state is not None and (
+        state.has_cask(name) if kind == "cask" else state.has_formula(name)
+    )
+    action, verb = ("upgrade", "升级") if installed else ("install", "安装")
+    cmd = ["brew", action] + (["--cask"] if kind == "cask" else []) + [name]
+    t0 = time.monotonic()
+    result = run_cmd(cmd, check=False, capture=True, stream=True, label=name)
+    if result is not None and result.returncode == 0:
+        log(f"  {verb} {name:<24} {time.monotonic() - t0:6.1f}s")
+        return True
+    log(f"  {verb} {name} 失败", "WARN")
+    return False
+
+
+def prefetch_and_install(
+    formulae: List[str],
+    casks: List[str],
+    jobs=None,
+    state: Optional[BrewState] = None,
+) -> None:
+    """下载与安装流水线
+
+    生产者：线程池并发执行 brew fetch，把 bottle/cask 下载到 HOMEBREW_CACHE；
+    消费者：按下载完成的先后顺序逐个 brew install（安装过程串行，避免 brew 冲突），
+    安装时直接使用本地缓存，下载与安装相互重叠。
+    依赖只解析一次，每个 formula 只下载一次（不用 fetch --deps，避免并发下载同一
+    依赖时争用 Homebrew 的下载锁），state 中已安装的依赖不再下载。
+    state 中已安装的包（即过期的包）改为 brew upgrade，brew install 对已安装的
+    cask 只会提示 already installed 而不升级。
+    安装可能与尚未完成的依赖下载冲突，失败的包在全部下载结束后重试一次。
+    """
+    jobs = jobs or RESOURCE_LIMITS["network"]
+    targets = [("formula", f) for f in formulae] + [("cask", c) for c in casks]
+    if not targets:
+        return
+    deps = [
+        d
+        for d in brew_formula_deps(formulae)
+        if state is None or not state.has_formula(d)
+    ]
+
+    log(
+        f"预下载 {len(targets)} 个软件包及 {len(deps)} 个缺失的依赖（并发 {jobs}），"
+        "下载完成后依次安装..."
+    )
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(_brew_fetch, kind, name) for kind, name in targets]
+        futures += [pool.submit(_brew_fetch, "formula", d) for d in deps]
+        for future in as_completed(futures):
+            kind, name, elapsed, ok = future.result()
+            if ok:
+                log(f"  下载 {name:<24} {elapsed:6.1f}s")
+            else:
+                # 下载失败仍尝试安装，由 brew install 自行重试下载
+                log(f"  下载 {name} 失败 ({elapsed:.1f}s)，安装时重试", "WARN")
+            if (kind, name) in targets and not _brew_install(kind, name, state):
+                failed.append((kind, name))
+
+    if failed:
+        log(f"重试安装失败的软件包: {', '.join(name for _, name in failed)}")
+        failed = [(k, n) for k, n in failed if not _brew_install(k, n, state)]
+    if failed:
+        log(f"以下软件包安装失败: {', '.join(name for _, name in failed)}", "WARN")
 
 
 def install_oh_my_zsh():
@@ -579,64 +1628,342 @@ def install_oh_my_zsh():
         log("Oh My Zsh 已安装")
     else:
         log("安装 Oh My Zsh...")
+        # 安装器根据 .zshrc 是否存在决定是否写入模板，先落盘已累积的修改
+        flush_zshrc_transaction()
         # 使用完整的环境变量控制，避免覆盖现有 .zshrc
         cmd = 'sh -c "$(curl -fsSL https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh)"'
         env = {"RUNZSH": "no", "CHSH": "no", "KEEP_ZSHRC": "yes"}
         run_cmd(cmd, shell=True, env=env)
 
-    # 安装插件
-    custom_plugins_dir = omz_path / "custom" / "plugins"
-    plugins = {
-        "zsh-syntax-highlighting": "https://github.com/zsh-users/zsh-syntax-highlighting.git",
-        "zsh-autosuggestions": "https://github.com/zsh-users/zsh-autosuggestions.git",
-    }
-
-    for name, url in plugins.items():
-        p_path = custom_plugins_dir / name
-        if not p_path.exists():
-            log(f"Cloning {name}...")
-            run_cmd(["git", "clone", url, str(p_path)])
+    # 同步第三方插件
+    sync_omz_plugins(omz_path / "custom" / "plugins")
+
+
+def _plugin_is_stale(p_path: Path, ttl: float) -> bool:
+    """插件最近一次 fetch（或 clone）距今是否超过 ttl 秒"""
+    git_dir = p_path / ".git"
+    for marker in ("FETCH_HEAD", "HEAD"):
+        marker_path = git_dir / marker
+        if marker_path.exists():
+            return time.time() - marker_path.stat().st_mtime > ttl
+    return False  # 非 git 目录（用户手动放置），不做更新
+
+
+def _sync_plugin(
+    name: str, url: str, p_path: Path, ttl: float
+) -> Tuple[str, str, float, bool]:
+    """克隆缺失插件或浅更新过期插件，返回 (名称, 动作, 耗时, 是否成功)"""
+    t0 = time.monotonic()
+    if not p_path.exists():
+        action = "clone"
+        result = run_cmd(
+            ["git", "clone", "--depth", "1", "--single-branch", url, str(p_path)],
+            check=False,
+            capture=True,
+        )
+        ok = result is not None and result.returncode == 0
+    elif _plugin_is_stale(p_path, ttl):
+        action = "update"
+        status = run_cmd(
+            # 忽略未跟踪文件（如 zcompile 生成的 .zwc），只看已跟踪文件的修改
+            ["git", "-C", str(p_path), "status", "--porcelain", "--untracked-files=no"],
+            check=False,
+            capture=True,
+        )
+        if status is None or status.returncode != 0 or status.stdout.strip():
+            # 有本地修改或不是有效仓库，保持原样
+            return name, "skip", time.monotonic() - t0, True
+        fetch = run_cmd(
+            ["git", "-C", str(p_path), "fetch", "--depth", "1", "origin", "HEAD"],
+            check=False,
+            capture=True,
+        )
+        ok = fetch is not None and fetch.returncode == 0
+        if ok:
+            reset = run_cmd(
+                ["git", "-C", str(p_path), "reset", "--hard", "--quiet", "FETCH_HEAD"],
+                check=False,
+                capture=True,
+            )
+            ok = reset is not None and reset.returncode == 0
+    else:
+        action = "fresh"
+        ok = True
+    return name, action, time.monotonic() - t0, ok
 
 
-def setup_mise(skip_langs=None):
-    """安装和配置 Mise (管理 Python/Node/Java)
+def sync_omz_plugins(
+    custom_plugins_dir: Path, plugins=None, jobs=None, ttl=None
+) -> None:
+    """并发同步 Oh My Zsh 第三方插件
 
-    Args:
-        skip_langs: 要跳过的语言集合
+    缺失的插件使用浅克隆（--depth 1），已存在但超过 OMZ_PLUGIN_UPDATE_TTL
+    未更新的插件执行浅 fetch，总耗时取决于最慢的插件而非插件数量。
     """
-    skip_langs = skip_langs or set()
+    plugins = OMZ_CUSTOM_PLUGINS if plugins is None else plugins
+    jobs = jobs or RESOURCE_LIMITS["network"]
+    ttl = OMZ_PLUGIN_UPDATE_TTL if ttl is None else ttl
+    if not plugins:
+        return
 
-    log("安装 Mise (版本管理器)...")
-    if not shutil.which("mise"):
-        run_cmd(["brew", "install", "mise"])
+    custom_plugins_dir.mkdir(parents=True, exist_ok=True)
+    log(f"同步 {len(plugins)} 个 Oh My Zsh 插件（并发 {jobs}）...")
 
-    # 激活 Mise 到 Zsh
-    log("配置 Mise Shell 激活...")
-    ensure_line_in_file(
-        ZSHRC_PATH, 'eval "$(mise activate zsh)"', marker="MISE-ACTIVATE"
-    )
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [
+            pool.submit(_sync_plugin, name, url, custom_plugins_dir / name, ttl)
+            for name, url in plugins.items()
+        ]
+        for future in futures:
+            name, action, elapsed, ok = future.result()
+            if ok:
+                log(f"  {name:<24} {action:<6} {elapsed:6.2f}s")
+            else:
+                log(f"  {name:<24} {action:<6} 失败 ({elapsed:.2f}s)", "ERROR")
+                if action == "clone":
+                    failed.append(name)
 
-    # 全局设置语言版本 (仅 Python/Node/Java，排除跳过的)
-    tools_to_install = []
-    descriptions = []
+    if failed:
+        log(f"插件克隆失败: {', '.join(failed)}", "ERROR")
+        sys.exit(1)
+
+
+def mise_installed_state() -> Dict[str, list]:
+    """一次性读取 Mise 的已安装状态（mise ls --json），失败时返回空字典"""
+    result = run_cmd(["mise", "ls", "--json"], check=False, capture=True)
+    if result is None or result.returncode != 0:
+        return {}
+    try:
+        return json.loads(result.stdout or "{}")
+    except ValueError:
+        return {}
+
+
+def _mise_version_matches(version: str, spec: str) -> bool:
+    """模糊版本匹配：3.12 匹配 3.12.7，temurin-21 匹配 temurin-21.0.5+11.0.LTS"""
+    return version == spec or version.startswith((spec + ".", spec + "+"))
+
+
+def plan_mise_tools(
+    tools: Dict[str, str], state: Dict[str, list]
+) -> Tuple[List[str], List[str]]:
+    """对比已安装状态，返回 (需要安装的工具, 需要写入全局配置的工具)
+
+    已安装且已在配置中请求的版本直接跳过；已安装但未设为全局版本的只需 mise use。
+    """
+    to_install = []
+    to_use = []
+    for lang, spec in tools.items():
+        entries = state.get(lang, [])
+        installed = any(
+            e.get("installed") and _mise_version_matches(e.get("version", ""), spec)
+            for e in entries
+        )
+        requested = any(
+            e.get("installed") and e.get("requested_version") == spec for e in entries
+        )
+        if not installed:
+            to_install.append(f"{lang}@{spec}")
+        if not requested:
+            to_use.append(f"{lang}@{spec}")
+    return to_install, to_use
+
+
+def load_mise_lock() -> Dict[str, dict]:
+    """读取锁文件（不存在或损坏时返回空字典）"""
+    try:
+        with open(MISE_LOCK_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get("tools", {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_mise_lock(lock: Dict[str, dict]) -> None:
+    """写入锁文件（键排序、无时间戳，相同解析结果产生相同的文件内容）"""
+    tmp = MISE_LOCK_FILE.with_name(MISE_LOCK_FILE.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "tools": lock}, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp, MISE_LOCK_FILE)
+
+
+def _mise_resolve(lang: str, spec: str) -> Tuple[str, str, float]:
+    """解析模糊版本对应的最新精确版本，返回 (语言, 精确版本, 耗时)，失败时版本为空"""
+    t0 = time.monotonic()
+    result = run_cmd(["mise", "latest", f"{lang}@{spec}"], check=False, capture=True)
+    version = ""
+    if result is not None and result.returncode == 0 and result.stdout.strip():
+        version = result.stdout.strip().splitlines()[-1].strip()
+    return lang, version, time.monotonic() - t0
+
+
+def resolve_mise_versions(
+    tools: Dict[str, str], update=False, jobs=None
+) -> Dict[str, str]:
+    """把模糊版本固定为锁文件中的精确版本
+
+    锁文件中已有且 spec 未变化的语言直接使用锁定版本（不访问网络）；
+    其余语言并发执行 mise latest 解析后写回锁文件。--update-lock 时全部重新解析。
+    解析失败的语言退回使用模糊版本，且不写入锁文件。
+    """
+    lock = load_mise_lock()
+    pinned = {}
+    pending = {}
+    for lang, spec in tools.items():
+        entry = lock.get(lang) or {}
+        if not update and entry.get("spec") == spec and entry.get("version"):
+            pinned[lang] = entry["version"]
+        else:
+            pending[lang] = spec
+
+    resolved = {}
+    if pending:
+        log(f"解析 Mise 版本: {', '.join(f'{k}@{v}' for k, v in pending.items())}")
+        with ThreadPoolExecutor(max_workers=max(1, jobs or len(pending))) as pool:
+            futures = [
+                pool.submit(_mise_resolve, lang, spec) for lang, spec in pending.items()
+            ]
+            for future in futures:
+                lang, version, elapsed = future.result()
+                spec = pending[lang]
+                if version:
+                    log(f"  {lang + '@' + spec:<24} → {version:<24} {elapsed:6.2f}s")
+                    resolved[lang] = {"spec": spec, "version": version}
+                    pinned[lang] = version
+                else:
+                    log(f"  {lang}@{spec} 解析失败，使用模糊版本", "WARN")
+                    pinned[lang] = spec
+        if any(lock.get(lang) != entry for lang, entry in resolved.items()):
+            lock.update(resolved)
+            save_mise_lock(lock)
+            log(f"已更新锁文件: {MISE_LOCK_FILE}")
+
+    return {lang: pinned[lang] for lang in tools}
+
+
+def compiler_cache_env() -> Dict[str, str]:
+    """源码编译时使用 ccache（未安装时通过 Homebrew 安装）"""
+    if not shutil.which("ccache"):
+        with resource_lock("brew"):
+            run_cmd(["brew", "install", "ccache"], check=False)
+    if not shutil.which("ccache"):
+        log("  ccache 不可用，直接编译", "WARN")
+        return {}
+    return {"CC": "ccache clang", "CXX": "ccache clang++"}
+
+
+def _mise_install(tool: str) -> Tuple[str, float, str, str]:
+    """安装单个语言版本，返回 (工具, 耗时, 构建方式, 失败时的错误输出)
+
+    先安装预编译版本；该版本/平台没有预编译包且该语言支持源码编译时，改用 ccache 编译。
+    """
+    t0 = time.monotonic()
+    lang = tool.split("@", 1)[0]
+    build = "prebuilt"
+    # 并发安装时各自的输出会交错，每行以工具名标注
+    result = run_cmd(
+        ["mise", "install", tool],
+        check=False,
+        capture=True,
+        env=MISE_PREBUILT_ENV.get(lang),
+        stream=True,
+        label=tool,
+    )
+    if (
+        result is not None
+        and result.returncode != 0
+        and lang in MISE_COMPILE_ENV
+        and MISE_NO_PREBUILT.search(result.stderr + result.stdout)
+    ):
+        log(f"  {tool} 没有可用的预编译版本，改为源码编译（ccache）...", "WARN")
+        build = "compiled"
+        result = run_cmd(
+            ["mise", "install", tool],
+            check=False,
+            capture=True,
+            env={**MISE_COMPILE_ENV[lang], **compiler_cache_env()},
+            stream=True,
+            label=tool,
+        )
+    if result is not None and result.returncode == 0:
+        error = ""
+    else:
+        error = (result.stderr.strip()[-500:] if result else "") or "未知错误"
+    return tool, time.monotonic() - t0, build, error
+
+
+def configure_mise_activate():
+    """激活 Mise 到 Zsh"""
+    snippet = cached_init_snippet("mise", "${commands[mise]}", "activate zsh")
+    mise_config = f"""if (( $+commands[mise] )); then
+{textwrap.indent(snippet, "  ")}
+fi"""
+    ensure_line_in_file(ZSHRC_PATH, mise_config, marker="MISE-ACTIVATE", update=True)
+
+
+def setup_mise(skip_langs=None, jobs=None, update_lock=False):
+    """安装和配置 Mise (管理 Python/Node/Java)
+
+    Args:
+        skip_langs: 要跳过的语言集合
+        jobs: 并发安装的语言数（默认 MISE_INSTALL_JOBS）
+        update_lock: 忽略锁文件，重新解析精确版本
+    """
+    skip_langs = skip_langs or set()
+    jobs = jobs or MISE_INSTALL_JOBS
+
+    log("安装 Mise (版本管理器)...")
+    if not shutil.which("mise"):
+        # 与 brew-bundle 等步骤并行时，brew 调用需要互斥
+        with resource_lock("brew"):
+            run_cmd(["brew", "install", "mise"])
+
+    # 激活 Mise 到 Zsh
+    log("配置 Mise Shell 激活...")
+    configure_mise_activate()
+    refresh_init_cache("mise", shutil.which("mise"), ["activate", "zsh"])
 
+    # 全局设置语言版本 (仅 Python/Node/Java，排除跳过的)
+    tools = {}
     for lang, ver in MISE_VERSIONS.items():
         if lang.lower() in skip_langs:
             log(f"  跳过 {lang}（--skip-langs {lang}）", "WARN")
             continue
-        tools_to_install.append(f"{lang}@{ver}")
-        descriptions.append(f"{lang} {ver}")
+        tools[lang] = ver
 
-    if not tools_to_install:
+    if not tools:
         log("所有 Mise 语言均被跳过，无需安装", "WARN")
         return
 
-    log(f"使用 Mise 安装编程语言环境: {', '.join(descriptions)}...")
-    log(f"Mise: 正在安装 {', '.join(descriptions)} (这可能需要几分钟编译)...")
+    tools = resolve_mise_versions(tools, update=update_lock, jobs=jobs)
+    to_install, to_use = plan_mise_tools(tools, mise_installed_state())
+    if not to_install and not to_use:
+        log(f"Mise 语言环境已就绪: {', '.join(f'{k} {v}' for k, v in tools.items())}")
+        return
+
+    # 各语言互不依赖，并发安装；全局配置最后统一写入，避免并发修改 config.toml
+    if to_install:
+        log(
+            f"Mise: 正在安装 {', '.join(to_install)}（并发 {jobs}，优先使用预编译版本）..."
+        )
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = [pool.submit(_mise_install, tool) for tool in to_install]
+            for future in as_completed(futures):
+                tool, elapsed, build, error = future.result()
+                if not error:
+                    log(f"  安装 {tool:<24} {elapsed:6.1f}s  {build}")
+                else:
+                    failed.append(tool)
+                    log(f"  安装 {tool} 失败 ({elapsed:.1f}s)", "ERROR")
+                    log(f"  错误详情: {error}", "ERROR")
+        if failed:
+            log(f"Mise 语言安装失败: {', '.join(failed)}", "ERROR")
+            sys.exit(1)
 
-    # 批量安装
-    cmd = f"mise use --global {' '.join(tools_to_install)}"
-    run_cmd(cmd, shell=True)
+    log(f"设置全局版本: {', '.join(to_use)}")
+    run_cmd(["mise", "use", "--global"] + to_use)
 
 
 def setup_rust():
@@ -652,7 +1979,11 @@ def setup_rust():
         # 更新到最新 stable
         run_cmd("rustup update stable", shell=True, check=False)
 
-    # 添加 Rust 到 PATH
+    configure_rust_path()
+
+
+def configure_rust_path():
+    """添加 Rust 到 PATH"""
     rust_config = '''export PATH="$HOME/.cargo/bin:$PATH"'''
     ensure_line_in_file(ZSHRC_PATH, rust_config, marker="AUTO-RUST")
 
@@ -662,24 +1993,168 @@ def setup_go():
     log("配置 Go 环境变量...")
 
     # Go 已通过 Homebrew 安装，只需配置 GOPATH
+    configure_go_path()
+
+
+def configure_go_path():
+    """写入 GOPATH 配置"""
     go_config = '''export GOPATH="$HOME/go"
 export PATH="$GOPATH/bin:$PATH"'''
     ensure_line_in_file(ZSHRC_PATH, go_config, marker="AUTO-GO")
 
 
-def configure_zsh_final(skip_starship_ask=False, force_no_starship=False):
+def plan_plugin_loading(
+    plugins: List[str], eager_only=False
+) -> Tuple[List[str], List[str], Dict[str, List[str]]]:
+    """按 OMZ_PLUGIN_LOAD 把插件分为 (eager, deferred, lazy{插件: 触发命令})"""
+    eager, deferred, lazy = [], [], {}
+    for name in plugins:
+        policy = "eager" if eager_only else OMZ_PLUGIN_LOAD.get(name, "eager")
+        if policy == "deferred":
+            deferred.append(name)
+        elif policy == "lazy" and OMZ_LAZY_COMMANDS.get(name):
+            lazy[name] = OMZ_LAZY_COMMANDS[name]
+        else:
+            eager.append(name)
+    return eager, deferred, lazy
+
+
+# 加载单个 Oh My Zsh 插件（同时注册插件目录中的补全函数）
+PLUGIN_LOADER_FUNCTION = """_ms_load_plugin() {
+  local dir f line
+  for dir in "$ZSH_CUSTOM/plugins/$1" "$ZSH/plugins/$1"; do
+    [[ -r "$dir/$1.plugin.zsh" ]] || continue
+    fpath=("$dir" $fpath)
+    for f in "$dir"/_*(N); do
+      read -r line < "$f"
+      [[ $line == "#compdef "* ]] && (( $+functions[compdef] )) \\
+        && autoload -Uz "${f:t}" && compdef "${f:t}" ${=line#\\#compdef }
+    done
+    source "$dir/$1.plugin.zsh"
+    return
+  done
+}"""
+
+# deferred：zle -F 监听 /dev/null（总是可读），回调在首个提示符绘制完成、
+# zle 等待输入时执行；没有 zle（如 zsh -i -c）时不显示提示符，也不加载
+DEFERRED_LOADER = """_ms_deferred_plugins=({plugins})
+_ms_load_deferred() {{
+  local fd=$1 p
+  zle -F $fd
+  exec {{fd}}<&-
+  for p in $_ms_deferred_plugins; do _ms_load_plugin $p; done
+  unset _ms_deferred_plugins
+  # 插件在 precmd 中完成的初始化已错过首个提示符，这里补上
+  (( $+functions[_zsh_autosuggest_start] )) && _zsh_autosuggest_start
+  zle -R
+}}
+if [[ -o zle ]]; then
+  zle -N _ms_load_deferred
+  exec {{_ms_fd}}</dev/null
+  zle -F -w $_ms_fd _ms_load_deferred
+  unset _ms_fd
+fi"""
+
+
+def plugin_loader_snippet(deferred: List[str], lazy: Dict[str, List[str]]) -> str:
+    """生成 deferred/lazy 插件的加载代码（放在 source oh-my-zsh.sh 之后）"""
+    if not deferred and not lazy:
+        return ""
+    parts = [
+        "# 插件加载策略（见 mac-setup.py OMZ_PLUGIN_LOAD）",
+        PLUGIN_LOADER_FUNCTION,
+    ]
+    if deferred:
+        parts.append(DEFERRED_LOADER.format(plugins=" ".join(deferred)))
+    for name, commands in lazy.items():
+        # function 关键字避免命令名已被定义为 alias 时展开；eval 让插件定义的 alias 生效
+        names = " ".join(commands)
+        parts.append(
+            f'function {names} {{ unfunction {names}; _ms_load_plugin {name}; eval "$0 \\"\\$@\\""; }}'
+        )
+    return "\n".join(parts)
+
+
+def typing_tuning_block(profile: str) -> str:
+    """生成输入延迟调优配置（TYPING_PROFILES 中的变量，需在插件加载之前设置）"""
+    settings = TYPING_PROFILES[profile]
+    if not settings:
+        return f"# 使用插件默认设置（--typing-profile {profile}）"
+    lines = [f"# 输入延迟调优（--typing-profile {profile}）"]
+    for name, value in settings.items():
+        if isinstance(value, list):
+            value = f"({' '.join(value)})"
+        lines.append(f"{name}={value}")
+    return "\n".join(lines)
+
+
+def configure_typing_tuning(profile=DEFAULT_TYPING_PROFILE, zshrc_path=ZSHRC_PATH):
+    """写入 AUTO-TYPING 块（置于文件开头，先于 Oh My Zsh 和延迟加载的插件生效）"""
+    ensure_line_in_file(
+        zshrc_path,
+        typing_tuning_block(profile),
+        marker="AUTO-TYPING",
+        prepend=True,
+        update=True,
+    )
+
+
+def log_plugin_loading(deferred: List[str], lazy: Dict[str, List[str]]) -> None:
+    if deferred:
+        log(f"  首个提示符后加载: {' '.join(deferred)}")
+    for name, commands in lazy.items():
+        log(f"  按需加载: {name}（首次执行 {', '.join(commands)} 时）")
+
+
+def configure_zsh_final(
+    skip_starship_ask=False,
+    force_no_starship=False,
+    dry_run=False,
+    eager_plugins=False,
+    typing_profile=DEFAULT_TYPING_PROFILE,
+):
     """最终配置 .zshrc
 
     Args:
         skip_starship_ask: 跳过询问，默认使用 starship
         force_no_starship: 强制不使用 starship（优先级高于 skip_starship_ask）
+        dry_run: 规划模式，不创建备份、不询问（按默认选择使用 starship）
+        eager_plugins: 忽略 OMZ_PLUGIN_LOAD，所有插件在首个提示符之前加载
+        typing_profile: 输入延迟调优档位（见 TYPING_PROFILES）
     """
     log("最终配置 .zshrc...")
 
-    zsh_config = ZshConfig(ZSHRC_PATH)
+    # 初始化脚本缓存（starship 的 init zsh 只输出再次调用自身的引导代码，直接缓存完整脚本）
+    snippet = cached_init_snippet(
+        "starship", "${commands[starship]}", "init zsh --print-full-init"
+    )
+    starship_block = f"""if (( $+commands[starship] )); then
+{textwrap.indent(snippet, "  ")}
+fi"""
+
+    # 事务进行中时直接在事务内容上修改，最终统一写入
+    zsh_config = _zshrc_txn or ZshConfig(ZSHRC_PATH)
+
+    # 补全（必须在 Oh My Zsh 执行 compinit 之前）：预生成的补全加入 fpath；
+    # 补全缓存超过一天时删除、由 compinit 完整重建（含安全检查），否则跳过 compaudit。
+    # fpath 变化时 Oh My Zsh 与 compinit 会自行重建缓存
+    completion_block = """fpath=("$HOME/.cache/mac-setup/completions" $fpath)
+ZSH_COMPDUMP="$HOME/.cache/mac-setup/zcompdump-$ZSH_VERSION"
+_ms_dump=($ZSH_COMPDUMP(N.mh+24))
+if (( $#_ms_dump )) || [[ ! -s "$ZSH_COMPDUMP" ]]; then
+  rm -f -- "$ZSH_COMPDUMP" "$ZSH_COMPDUMP.zwc"
+else
+  ZSH_DISABLE_COMPFIX=true
+fi
+unset _ms_dump"""
+    ensure_line_in_file(
+        ZSHRC_PATH, completion_block, marker="AUTO-COMPLETION", prepend=True
+    )
+    configure_typing_tuning(typing_profile)
 
     # 备份原始配置 (如果文件存在)
-    zsh_config.backup()
+    if not dry_run:
+        zsh_config.backup()
 
     if zsh_config.has_omz():
         log("检测到现有 Oh My Zsh 配置，执行智能合并")
@@ -691,15 +2166,20 @@ def configure_zsh_final(skip_starship_ask=False, force_no_starship=False):
         log(f"  现有插件: {' '.join(existing_plugins) if existing_plugins else '无'}")
         log(f"  现有主题: {existing_theme or '无'}")
 
-        # 合并插件
+        # 合并插件，只对脚本新增的插件应用加载策略（deferred/lazy 插件由 AUTO-SETUP-CORE
+        # 加载）；用户原有的插件保留在 plugins=() 中，回滚禁用该块后仍然可用
         merged_plugins = merge_plugins(existing_plugins, OMZ_PLUGINS)
         log(f"  合并后插件: {' '.join(merged_plugins)}")
+        added = [p for p in merged_plugins if p not in existing_plugins]
+        added_eager, deferred, lazy = plan_plugin_loading(added, eager_plugins)
+        eager = [p for p in merged_plugins if p in existing_plugins or p in added_eager]
+        log_plugin_loading(deferred, lazy)
 
         # 决定是否使用 Starship
         if force_no_starship:
             use_starship = False
             log("  参数 --no-starship 已启用，保留原有主题")
-        elif skip_starship_ask:
+        elif skip_starship_ask or dry_run:
             use_starship = True
         elif existing_theme and existing_theme != '""':
             log("")
@@ -716,38 +2196,48 @@ def configure_zsh_final(skip_starship_ask=False, force_no_starship=False):
             use_starship = True
 
         # 更新插件列表
-        zsh_config.update_plugins(merged_plugins)
+        zsh_config.update_plugins(eager)
 
         # 如果使用 starship，清空主题
         if use_starship:
             zsh_config.update_theme("")
 
-        # 添加 starship 配置块
+        # 添加插件加载代码和 starship 配置块
+        sections = [plugin_loader_snippet(deferred, lazy)]
         if use_starship:
-            starship_block = """if command -v starship > /dev/null 2>&1; then
-  eval "$(starship init zsh)"
-fi"""
-            ensure_line_in_file(ZSHRC_PATH, starship_block, marker="AUTO-SETUP-CORE")
+            sections.append(starship_block)
+        core_config = "\n\n".join(part for part in sections if part)
+        # 已有的块需要覆盖，避免旧的加载代码与 plugins=() 重复加载插件
+        if core_config or zsh_config.index.has_block("AUTO-SETUP-CORE"):
+            ensure_line_in_file(
+                ZSHRC_PATH,
+                core_config or "# 插件均由 plugins=() 加载",
+                marker="AUTO-SETUP-CORE",
+                update=True,
+            )
     else:
         # 无现有配置，使用完整配置块
         log("未检测到 Oh My Zsh 配置，添加完整配置块")
 
-        plugins_str = " ".join(OMZ_PLUGINS)
-        full_config = f"""export ZSH="$HOME/.oh-my-zsh"
+        eager, deferred, lazy = plan_plugin_loading(OMZ_PLUGINS, eager_plugins)
+        log_plugin_loading(deferred, lazy)
+        plugins_str = " ".join(eager)
+        omz_config = f"""export ZSH="$HOME/.oh-my-zsh"
 ZSH_THEME=""
 plugins=({plugins_str})
-source $ZSH/oh-my-zsh.sh
-
-if command -v starship > /dev/null 2>&1; then
-  eval "$(starship init zsh)"
-fi"""
-        ensure_line_in_file(ZSHRC_PATH, full_config, marker="AUTO-SETUP-CORE")
+source $ZSH/oh-my-zsh.sh"""
+        sections = [omz_config, plugin_loader_snippet(deferred, lazy), starship_block]
+        full_config = "\n\n".join(part for part in sections if part)
+        ensure_line_in_file(
+            ZSHRC_PATH, full_config, marker="AUTO-SETUP-CORE", update=True
+        )
 
     # Zoxide 配置（运行时检测）
-    zoxide_block = """if command -v zoxide >/dev/null 2>&1; then
-  eval "$(zoxide init zsh)"
+    snippet = cached_init_snippet("zoxide", "${commands[zoxide]}", "init zsh")
+    zoxide_block = f"""if (( $+commands[zoxide] )); then
+{textwrap.indent(snippet, "  ")}
 fi"""
-    ensure_line_in_file(ZSHRC_PATH, zoxide_block, marker="AUTO-ZOXIDE")
+    ensure_line_in_file(ZSHRC_PATH, zoxide_block, marker="AUTO-ZOXIDE", update=True)
 
     # 现代化 CLI 工具别名（运行时检测，避免覆盖用户习惯）
     aliases_block = """# 现代化 CLI 工具别名
@@ -758,6 +2248,13 @@ command -v htop >/dev/null && alias top='htop'
 command -v eza >/dev/null && alias ls='eza' && alias ll='eza -lah'"""
     ensure_line_in_file(ZSHRC_PATH, aliases_block, marker="AUTO-ALIASES")
 
+    # 预先生成初始化脚本缓存，首次启动 shell 即可命中
+    if not dry_run:
+        refresh_init_cache(
+            "starship", shutil.which("starship"), ["init", "zsh", "--print-full-init"]
+        )
+        refresh_init_cache("zoxide", shutil.which("zoxide"), ["init", "zsh"])
+
 
 def configure_fzf():
     """配置 fzf 补全和快捷键"""
@@ -786,12 +2283,993 @@ def configure_fzf():
         )
 
 
+def compile_zsh_startup():
+    """预生成补全，并把启动时加载的脚本编译为 .zwc（只编译缺失或过期的）"""
+    log("预生成补全并编译 zsh 启动脚本...")
+    if not shutil.which("zsh"):
+        log("未找到 zsh，跳过", "WARN")
+        return
+
+    updated = generate_completions()
+    if updated:
+        log(f"已更新 {updated} 个补全脚本: {COMPLETIONS_DIR}")
+
+    # 写入 .zshrc 的步骤均已完成，先落盘再编译
+    flush_zshrc_transaction()
+    sources = [path for path in zsh_startup_sources() if zwc_is_stale(path)]
+    if not sources:
+        log(".zwc 均为最新，跳过编译")
+        return
+    log(f"已编译 {zcompile(sources)} / {len(sources)} 个脚本")
+
+
+# ================= Offline Bundle =================
+
+# 离线包文件中的清单
+BUNDLE_MANIFEST = "bundle.json"
+
+
+def detect_mise_dirs() -> Dict[str, Path]:
+    """Mise 的下载缓存、已安装工具链和缓存目录（支持 MISE_DATA_DIR/MISE_CACHE_DIR）"""
+    data_dir = Path(
+        os.environ.get("MISE_DATA_DIR") or Path.home() / ".local" / "share" / "mise"
+    )
+    if os.environ.get("MISE_CACHE_DIR"):
+        cache_dir = Path(os.environ["MISE_CACHE_DIR"])
+    elif platform.system() == "Darwin":
+        cache_dir = Path.home() / "Library" / "Caches" / "mise"
+    else:
+        cache_dir = (
+            Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "mise"
+        )
+    return {
+        "downloads": data_dir / "downloads",
+        "installs": data_dir / "installs",
+        "cache": cache_dir,
+    }
+
+
+def bundle_sections() -> Dict[str, Path]:
+    """离线包中各部分的归档前缀与本机目录的对应关系"""
+    sections = {"homebrew": detect_brew_cache()}
+    for name, path in detect_mise_dirs().items():
+        sections[f"mise/{name}"] = path
+    sections["oh-my-zsh"] = Path.home() / ".oh-my-zsh"
+    return sections
+
+
+def brew_cache_files(formulae: List[str], casks: List[str]) -> List[Path]:
+    """软件包（含依赖）在 HOMEBREW_CACHE 中的下载文件
+
+    依赖和缓存路径均由 brew 给出（brew deps --union / brew --cache），
+    每类只启动一次 brew 进程；尚未下载的包直接跳过。
+    """
+    names = list(formulae) + brew_formula_deps(formulae)
+
+    paths = []
+    for kind, items in (("--formula", names), ("--cask", casks)):
+        if not items:
+            continue
+        result = run_cmd(["brew", "--cache", kind] + items, check=False, capture=True)
+        if result is None:
+            continue
+        for line in result.stdout.splitlines():
+            path = Path(line.strip())
+            if line.strip() and path.exists():
+                paths.append(path)
+    return paths
+
+
+def export_bundle(out_path: Path) -> None:
+    """导出离线包：Homebrew 下载缓存、Mise 下载缓存和工具链、Oh My Zsh 及插件
+
+    bottle/cask 本身已经压缩，归档不再压缩（tar）。
+    """
+    formulae, casks = parse_brew_packages()
+    formulae = list(dict.fromkeys(BASE_BREW_PACKAGES + formulae))
+    sections = bundle_sections()
+    manifest = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": platform.machine(),
+        "formulae": formulae,
+        "casks": casks,
+        "sections": {},
+    }
+
+    log(f"导出离线包: {out_path}")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(out_path, "w") as tar:
+
+        def add(path: Path, arcname: str, section: str) -> None:
+            stats = manifest["sections"].setdefault(section, {"files": 0, "bytes": 0})
+
+            def count(info: tarfile.TarInfo) -> tarfile.TarInfo:
+                if info.isfile():
+                    stats["files"] += 1
+                    stats["bytes"] += info.size
+                return info
+
+            tar.add(path, arcname=arcname, filter=count)
+
+        # Homebrew：只导出清单中软件包的下载文件，以及离线解析所需的 API 缓存
+        brew_cache = sections.pop("homebrew")
+        if shutil.which("brew"):
+            files = brew_cache_files(formulae, casks)
+            api_dir = brew_cache / "api"
+            if api_dir.is_dir():
+                files.append(api_dir)
+            for path in files:
+                real = path.resolve()
+                try:
+                    rel = real.relative_to(brew_cache.resolve())
+                except ValueError:
+                    continue
+                add(real, f"homebrew/{rel}", "homebrew")
+        else:
+            log("  未找到 brew，跳过 Homebrew 缓存", "WARN")
+
+        for section, path in sections.items():
+            if path.is_dir():
+                add(path, section, section)
+            else:
+                log(f"  {path} 不存在，跳过", "WARN")
+
+        data = json.dumps(manifest, indent=2, ensure_ascii=False).encode("utf-8")
+        info = tarfile.TarInfo(BUNDLE_MANIFEST)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+
+    for section, stats in manifest["sections"].items():
+        log(
+            f"  {section:<16} {stats['files']:>8} 个文件 "
+            f"{stats['bytes'] / 1024 / 1024:10.1f} MB"
+        )
+    log(f"离线包已导出: {out_path} ({out_path.stat().st_size / 1024 / 1024:.1f} MB)")
+
+
+def _bundle_target(name: str, sections: Dict[str, Path]) -> Optional[Tuple[Path, str]]:
+    """把归档成员名映射为 (目标根目录, 相对路径)，不安全或未知的成员返回 None"""
+    parts = Path(name).parts
+    if not parts or Path(name).is_absolute() or ".." in parts:
+        return None
+    # 最长前缀匹配（mise/downloads 优先于 mise）
+    for prefix in sorted(sections, key=len, reverse=True):
+        prefix_parts = tuple(prefix.split("/"))
+        if parts[: len(prefix_parts)] == prefix_parts:
+            return sections[prefix], "/".join(parts[len(prefix_parts) :])
+    return None
+
+
+def _is_within(root: Path, path: str) -> bool:
+    """path（解析符号链接后）是否位于 root 之内"""
+    real_root = os.path.realpath(root)
+    return os.path.commonpath([real_root, os.path.realpath(path)]) == real_root
+
+
+def import_bundle(bundle_path: Path) -> None:
+    """导入离线包，预置 Homebrew/Mise 缓存和 Oh My Zsh
+
+    已存在的文件保持不变，之后的安装直接使用本地缓存。
+    """
+    sections = bundle_sections()
+    extract_kwargs = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    counts: Dict[str, int] = {}
+    skipped = 0
+
+    log(f"导入离线包: {bundle_path}")
+    with tarfile.open(bundle_path, "r") as tar:
+        for member in tar:
+            if member.name == BUNDLE_MANIFEST:
+                continue
+            target = _bundle_target(member.name, sections)
+            if target is None:
+                log(f"  跳过不安全或未知的条目: {member.name}", "WARN")
+                continue
+            root, rel = target
+            if not rel:
+                root.mkdir(parents=True, exist_ok=True)
+                continue
+            dest = root / rel
+            # 旧版 Python 没有 tarfile 解压过滤器，自行检查：父目录（可能经过此前解压的
+            # 符号链接）和符号链接指向的位置都必须留在该部分的根目录内
+            if not _is_within(root, str(dest.parent)):
+                log(f"  跳过不安全的条目: {member.name}", "WARN")
+                continue
+            if member.issym() and (
+                os.path.isabs(member.linkname)
+                or not _is_within(root, os.path.join(dest.parent, member.linkname))
+            ):
+                log(f"  跳过指向目录外的符号链接: {member.name}", "WARN")
+                continue
+            if not member.isdir() and (dest.exists() or dest.is_symlink()):
+                skipped += 1
+                continue
+            if member.islnk():
+                link = _bundle_target(member.linkname, sections)
+                if link is None or link[0] != root:
+                    continue
+                member.linkname = link[1]
+            member.name = rel
+            tar.extract(member, root, **extract_kwargs)
+            if not member.isdir():
+                section = next(k for k, v in sections.items() if v == root)
+                counts[section] = counts.get(section, 0) + 1
+
+    for section, count in counts.items():
+        log(f"  {section:<16} {count:>8} 个文件 → {sections[section]}")
+    if skipped:
+        log(f"  {skipped} 个文件已存在，保持不变")
+    log("离线包导入完成，之后的安装将直接使用本地缓存", "SUCCESS")
+
+
+# ================= Step Scheduler =================
+
+
+class Step:
+    """安装步骤（依赖图中的一个节点）
+
+    Attributes:
+        name: 步骤名称
+        func: 无参可调用对象
+        requires: 前置步骤名称（不在图中的依赖视为已满足）
+        resources: 运行期间占用的资源（并发上限见 RESOURCE_LIMITS）
+        inputs: 返回步骤输入（可 JSON 序列化）的可调用对象，用于检查点指纹
+        uses_zshrc: 步骤是否读写 .zshrc（.zshrc 变化时需要重新执行）
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], None],
+        requires: Iterable[str] = (),
+        resources: Iterable[str] = (),
+        inputs: Optional[Callable[[], object]] = None,
+        uses_zshrc: bool = False,
+    ):
+        self.name = name
+        self.func = func
+        self.requires = list(requires)
+        self.resources = sorted(set(resources))  # 固定加锁顺序，避免死锁
+        self.inputs = inputs or (lambda: None)
+        self.uses_zshrc = uses_zshrc
+        self.started = 0.0
+        self.finished = 0.0
+        self.skipped = False
+
+    def fingerprint(self) -> str:
+        """步骤输入的指纹"""
+        payload = json.dumps(self.inputs(), sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @property
+    def duration(self) -> float:
+        return max(0.0, self.finished - self.started)
+
+
+class StepJournal:
+    """步骤检查点日志（BACKUP_DIR/setup-journal.json）
+
+    记录每个已完成步骤的输入指纹，以及最近一次记录时 .zshrc 的哈希。
+    重新运行时，指纹未变化、前置步骤未重新执行、且（对读写 .zshrc 的步骤）
+    .zshrc 自上次运行后未被修改的步骤可以跳过。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data: Dict = {"zshrc": "", "steps": {}}
+        if path.exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, dict) and isinstance(loaded.get("steps"), dict):
+                    self.data = loaded
+            except (OSError, ValueError):
+                pass  # 日志损坏时视为空日志
+        # .zshrc 在本次运行开始前是否被外部修改过
+        self.zshrc_dirty = self.data.get("zshrc") != file_sha256(ZSHRC_PATH)
+
+    def is_done(self, step: Step) -> bool:
+        entry = self.data["steps"].get(step.name)
+        if not entry or entry.get("fingerprint") != step.fingerprint():
+            return False
+        return not (step.uses_zshrc and self.zshrc_dirty)
+
+    def record(self, step: Step) -> None:
+        self.data["steps"][step.name] = {
+            "fingerprint": step.fingerprint(),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "duration": round(step.duration, 3),
+        }
+        self.data["zshrc"] = zshrc_digest()
+        self.save()
+
+    def invalidate(self, names: Iterable[str]) -> None:
+        """删除步骤的检查点（步骤开始重新执行时调用）"""
+        steps = self.data["steps"]
+        if any(steps.pop(name, None) is not None for name in list(names)):
+            self.save()
+
+    def clear(self) -> None:
+        self.data = {"zshrc": "", "steps": {}}
+        self.save()
+
+    def save(self) -> None:
+        """原子写入（临时文件 + rename），中途失败不会留下损坏的日志"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class StepScheduler:
+    """按依赖关系和资源约束并行执行步骤
+
+    - 前置步骤全部完成且资源空闲的步骤才会被调度
+    - 同时就绪时按声明顺序调度（jobs=1 时与串行执行顺序一致）
+    - 任一步骤失败后不再调度新步骤，等待运行中的步骤结束后抛出异常
+    - 提供 journal 时记录每个完成的步骤；resume 时检查点未失效的步骤直接跳过，
+      force 中的步骤（及依赖它们的步骤）总是执行
+    """
+
+    def __init__(
+        self,
+        steps: List[Step],
+        jobs: int = 1,
+        journal: Optional[StepJournal] = None,
+        resume: bool = False,
+        force: Iterable[str] = (),
+    ):
+        self.steps: Dict[str, Step] = {s.name: s for s in steps}
+        self.jobs = max(1, jobs)
+        self.journal = journal
+        self.resume = resume
+        self.force = set(force)
+        for step in steps:
+            step.requires = [r for r in step.requires if r in self.steps]
+        self.order = self._topological_order()
+        self.wall_time = 0.0
+
+    def _dependents(self, name: str) -> List[str]:
+        """直接或间接依赖该步骤的所有步骤（含自身）"""
+        found = [name]
+        for other in self.order:
+            if any(r in found for r in self.steps[other].requires):
+                found.append(other)
+        return found
+
+    def _topological_order(self) -> List[str]:
+        """拓扑排序（同层保持声明顺序），检测循环依赖"""
+        order: List[str] = []
+        remaining = list(self.steps)
+        while remaining:
+            ready = [
+                n for n in remaining if all(r in order for r in self.steps[n].requires)
+            ]
+            if not ready:
+                raise ValueError(f"步骤存在循环依赖: {', '.join(remaining)}")
+            order.append(ready[0])
+            remaining.remove(ready[0])
+        return order
+
+    def _run_step(self, step: Step) -> None:
+        """在工作线程中持有资源锁执行步骤"""
+        locks = [resource_lock(r) for r in step.resources]
+        for lock in locks:
+            lock.acquire()
+        ok = False
+        _step_context.name = step.name
+        try:
+            step.started = time.monotonic()
+            step.func()
+            ok = True
+        finally:
+            _step_context.name = None
+            step.finished = time.monotonic()
+            for lock in reversed(locks):
+                lock.release()
+            if _tracer is not None:
+                _tracer.record(
+                    "step",
+                    step.name,
+                    step.started,
+                    step.finished,
+                    ok=ok,
+                    resources=step.resources,
+                )
+
+    def run(self) -> None:
+        pending = [self.steps[n] for n in self.order]
+        done = set()
+        ran = set()
+        in_use: Dict[str, int] = {}
+        running = {}
+        error = None
+        t0 = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                if error is None:
+                    for step in list(pending):
+                        if len(running) >= self.jobs:
+                            break
+                        if not all(r in done for r in step.requires):
+                            continue
+                        if self._can_skip(step, ran):
+                            step.skipped = True
+                            pending.remove(step)
+                            done.add(step.name)
+                            continue
+                        if any(
+                            in_use.get(r, 0) >= RESOURCE_LIMITS.get(r, 1)
+                            for r in step.resources
+                        ):
+                            continue
+                        for r in step.resources:
+                            in_use[r] = in_use.get(r, 0) + 1
+                        # 重新执行的步骤使后续步骤的检查点失效，中途失败时不会误跳过
+                        if self.journal is not None:
+                            self.journal.invalidate(self._dependents(step.name))
+                        pending.remove(step)
+                        running[pool.submit(self._run_step, step)] = step
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    for r in step.resources:
+                        in_use[r] -= 1
+                    exc = future.exception()
+                    if exc is None:
+                        done.add(step.name)
+                        ran.add(step.name)
+                        if self.journal is not None:
+                            self.journal.record(step)
+                    elif error is None:
+                        error = exc
+                        if not isinstance(exc, SystemExit):
+                            log(f"步骤 {step.name} 失败: {exc}", "ERROR")
+
+        self.wall_time = time.monotonic() - t0
+        if error is not None:
+            raise error
+
+    def _can_skip(self, step: Step, ran: set) -> bool:
+        """检查点有效且前置步骤本次均未重新执行时跳过"""
+        if not self.resume or self.journal is None or step.name in self.force:
+            return False
+        if any(r in ran for r in step.requires):
+            return False
+        return self.journal.is_done(step)
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """按实际耗时计算关键路径（最长依赖链）"""
+        best: Dict[str, Tuple[float, List[str]]] = {}
+        for name in self.order:
+            step = self.steps[name]
+            prev = max(
+                (best[r] for r in step.requires if r in best),
+                key=lambda item: item[0],
+                default=(0.0, []),
+            )
+            best[name] = (prev[0] + step.duration, prev[1] + [name])
+        if not best:
+            return [], 0.0
+        length, path = max(best.values(), key=lambda item: item[0])
+        return path, length
+
+    def report(self) -> None:
+        """输出每个步骤的耗时和关键路径"""
+        log(f"步骤耗时（并行度 {self.jobs}）:")
+        for name in self.order:
+            step = self.steps[name]
+            if step.skipped:
+                log(f"  {name:<14} 已跳过（检查点未变化）")
+            elif step.finished:
+                log(f"  {name:<14} {step.duration:7.1f}s")
+        path, length = self.critical_path()
+        serial = sum(s.duration for s in self.steps.values())
+        log(f"  关键路径 ({length:.1f}s): {' → '.join(path)}")
+        log(f"  总耗时 {self.wall_time:.1f}s（串行累计 {serial:.1f}s）")
+
+
+def build_steps(arch, args, skip_langs) -> List[Step]:
+    """构建安装步骤依赖图
+
+    inputs 描述每个步骤的输入，用于检查点指纹（见 StepJournal）。
+    """
+    omz_path = Path.home() / ".oh-my-zsh"
+    steps = [
+        Step(
+            "homebrew",
+            lambda: install_homebrew(
+                arch, update_ttl=args.update_ttl, force_update=args.force_update
+            ),
+            resources=["brew", "network"],
+            inputs=lambda: {"arch": arch},
+            uses_zshrc=True,
+        ),
+        Step(
+            "brew-base",
+            install_brew_base,
+            requires=["homebrew"],
+            resources=["brew", "network"],
+            inputs=lambda: BASE_BREW_PACKAGES,
+        ),
+        Step(
+            "brew-bundle",
+            install_brew_bundle,
+            requires=["brew-base"],
+            resources=["brew", "network"],
+            inputs=lambda: file_sha256(PACKAGES_FILE)
+            or [DEFAULT_BREW_FORMULAE, DEFAULT_BREW_CASKS],
+        ),
+        # 依赖 homebrew：保证 OMZ 安装器看到的 .zshrc 与串行执行时一致
+        Step(
+            "oh-my-zsh",
+            install_oh_my_zsh,
+            requires=["homebrew"],
+            resources=["network"],
+            inputs=lambda: {
+                "plugins": OMZ_CUSTOM_PLUGINS,
+                "installed": omz_path.exists(),
+            },
+        ),
+    ]
+
+    # 语言环境 (Mise - Python/Node/Java)，编译依赖来自 brew-base
+    mise_langs = set(MISE_VERSIONS.keys())
+    if not mise_langs.issubset(skip_langs):
+        steps.append(
+            Step(
+                "mise",
+                lambda: setup_mise(skip_langs, args.mise_jobs, args.update_lock),
+                requires=["brew-base"],
+                resources=["network"],
+                inputs=lambda: {
+                    "versions": MISE_VERSIONS,
+                    "skip": sorted(skip_langs),
+                    "lock": file_sha256(MISE_LOCK_FILE),
+                },
+                uses_zshrc=True,
+            )
+        )
+    else:
+        log("跳过 Mise 语言安装（所有语言均在 --skip-langs 中）", "WARN")
+
+    # Rust (rustup)
+    if "rust" not in skip_langs:
+        steps.append(
+            Step(
+                "rust",
+                setup_rust,
+                requires=["brew-base"],
+                resources=["network"],
+                uses_zshrc=True,
+            )
+        )
+    else:
+        log("跳过 Rust 安装（--skip-langs rust）", "WARN")
+
+    # Go (环境变量配置)
+    if "go" not in skip_langs:
+        steps.append(
+            Step(
+                "go",
+                setup_go,
+                requires=["brew-base"],
+                resources=["zshrc"],
+                uses_zshrc=True,
+            )
+        )
+    else:
+        log("跳过 Go 配置（--skip-langs go）", "WARN")
+
+    # 收尾配置必须在所有写入 .zshrc 的步骤之后
+    steps.append(
+        Step(
+            "zsh-final",
+            lambda: configure_zsh_final(
+                skip_starship_ask=args.yes,
+                force_no_starship=args.no_starship,
+                eager_plugins=args.eager_plugins,
+                typing_profile=args.typing_profile,
+            ),
+            requires=["homebrew", "oh-my-zsh", "mise", "rust", "go"],
+            resources=["zshrc"],
+            inputs=lambda: {
+                "plugins": OMZ_PLUGINS,
+                "no_starship": args.no_starship,
+                "load": {} if args.eager_plugins else OMZ_PLUGIN_LOAD,
+                "lazy": OMZ_LAZY_COMMANDS,
+                "typing": TYPING_PROFILES[args.typing_profile],
+            },
+            uses_zshrc=True,
+        )
+    )
+    steps.append(
+        Step(
+            "zcompile",
+            compile_zsh_startup,
+            requires=["zsh-final"],
+            resources=["zshrc"],
+            inputs=lambda: {"plugins": OMZ_PLUGINS, "completions": ZSH_COMPLETIONS},
+            uses_zshrc=True,
+        )
+    )
+    steps.append(Step("fzf", configure_fzf, requires=["brew-bundle"]))
+    return steps
+
+
+# ================= Dry-Run Planner =================
+
+
+def read_mise_state() -> Dict[str, list]:
+    """不启动 mise，直接读取 installs/ 目录和全局配置
+
+    返回与 mise ls --json 相同结构的状态，供 plan_mise_tools 使用。
+    """
+    state: Dict[str, list] = {}
+    installs = detect_mise_dirs()["installs"]
+    if installs.is_dir():
+        for lang_dir in os.scandir(installs):
+            if not lang_dir.is_dir():
+                continue
+            # 跳过 22 -> 22.11.0 这类别名链接
+            state[lang_dir.name] = [
+                {"version": v.name, "installed": True}
+                for v in os.scandir(lang_dir.path)
+                if v.is_dir(follow_symlinks=False) and not v.name.startswith(".")
+            ]
+
+    config = Path(
+        os.environ.get("MISE_GLOBAL_CONFIG_FILE")
+        or Path.home() / ".config" / "mise" / "config.toml"
+    )
+    in_tools = False
+    for line in read_file_content(config).splitlines():
+        stripped = line.strip()
+        if stripped.startswith("["):
+            in_tools = stripped == "[tools]"
+            continue
+        match = MISE_CONFIG_TOOL.match(stripped) if in_tools else None
+        if not match:
+            continue
+        lang, spec = match.groups()
+        for entry in state.get(lang, []):
+            if _mise_version_matches(entry["version"], spec):
+                entry["requested_version"] = spec
+    return state
+
+
+def brew_update_age() -> Optional[float]:
+    """距上次成功 brew update 的秒数（从未执行过时返回 None）"""
+    stamp = BACKUP_DIR / "brew-update.stamp"
+    if not stamp.exists():
+        return None
+    return time.time() - stamp.stat().st_mtime
+
+
+def simulate_zshrc(arch, args, step_names: set) -> Tuple[str, str]:
+    """在内存事务中重放各步骤对 .zshrc 的修改，返回 (修改前, 修改后) 内容
+
+    与实际运行使用相同的 ensure_line_in_file/ZshConfig 逻辑，不写入磁盘。
+    """
+    global _zshrc_txn
+    txn = ZshrcTransaction(ZSHRC_PATH)
+    original = txn._content
+    previous, _zshrc_txn = _zshrc_txn, txn
+    try:
+        # Homebrew 已安装在默认前缀，或本次将会安装
+        if Path(homebrew_bin(arch)).exists() or not shutil.which("brew"):
+            configure_homebrew_path(arch)
+        if "mise" in step_names:
+            configure_mise_activate()
+        if "rust" in step_names:
+            configure_rust_path()
+        if "go" in step_names:
+            configure_go_path()
+        configure_zsh_final(
+            skip_starship_ask=args.yes,
+            force_no_starship=args.no_starship,
+            dry_run=True,
+            eager_plugins=args.eager_plugins,
+            typing_profile=args.typing_profile,
+        )
+    finally:
+        _zshrc_txn = previous
+    return original, txn._content
+
+
+def build_plan(arch, args, skip_langs) -> Dict:
+    """计算完整的执行计划，不做任何修改
+
+    只使用只读探测：Cellar/Caskroom 目录和 API 缓存（不启动 brew）、
+    Mise installs 目录和锁文件（不启动 mise、不访问网络）、插件目录的 git 元数据。
+    """
+    started = time.monotonic()
+    steps = build_steps(arch, args, skip_langs)
+    step_names = {step.name for step in steps}
+    journal = StepJournal(JOURNAL_FILE) if args.resume else None
+    plan: Dict = {
+        "arch": arch,
+        "steps": [
+            {
+                "name": step.name,
+                "requires": step.requires,
+                "resume_skip": bool(journal and journal.is_done(step)),
+            }
+            for step in steps
+        ],
+    }
+
+    # Homebrew 与软件包
+    state = load_brew_state()
+    age = brew_update_age()
+    plan["homebrew"] = {
+        "installed": state is not None,
+        "prefix": str(state.prefix) if state else None,
+        "update": args.force_update or age is None or not 0 <= age < args.update_ttl,
+    }
+    formulae, casks = parse_brew_packages()
+
+    def classify(items: List[str], kind: str) -> Dict[str, List[str]]:
+        if state is None:
+            return {"install": list(items), "upgrade": []}
+        has = state.has_formula if kind == "formula" else state.has_cask
+        return {
+            "install": [i for i in items if not has(i)],
+            "upgrade": [i for i in items if has(i) and state.is_outdated(kind, i)],
+        }
+
+    plan["packages"] = {
+        "base": classify(BASE_BREW_PACKAGES, "formula"),
+        "formulae": classify(formulae, "formula"),
+        "casks": classify(casks, "cask"),
+    }
+
+    # Oh My Zsh 与插件
+    omz_path = Path.home() / ".oh-my-zsh"
+    plugins_dir = omz_path / "custom" / "plugins"
+    plan["oh_my_zsh"] = {
+        "installed": omz_path.exists(),
+        "clone": [n for n in OMZ_CUSTOM_PLUGINS if not (plugins_dir / n).exists()],
+        "update": [
+            n
+            for n in OMZ_CUSTOM_PLUGINS
+            if (plugins_dir / n).exists()
+            and _plugin_is_stale(plugins_dir / n, OMZ_PLUGIN_UPDATE_TTL)
+        ],
+    }
+
+    # Mise：锁文件中的版本（未锁定的语言运行时才会解析）
+    if "mise" in step_names:
+        lock = {} if args.update_lock else load_mise_lock()
+        tools = {}
+        resolve = []
+        for lang, spec in MISE_VERSIONS.items():
+            if lang in skip_langs:
+                continue
+            entry = lock.get(lang) or {}
+            if entry.get("spec") == spec and entry.get("version"):
+                tools[lang] = entry["version"]
+            else:
+                tools[lang] = spec
+                resolve.append(f"{lang}@{spec}")
+        to_install, to_use = plan_mise_tools(tools, read_mise_state())
+        plan["mise"] = {
+            "installed": shutil.which("mise") is not None,
+            "resolve": resolve,
+            "install": to_install,
+            "use": to_use,
+        }
+
+    if "rust" in step_names:
+        plan["rust"] = {"init": shutil.which("rustc") is None}
+
+    # .zshrc 差异
+    before, after = simulate_zshrc(arch, args, step_names)
+    plan["zshrc"] = {
+        "path": str(ZSHRC_PATH),
+        "changed": before != after,
+        "diff": "".join(
+            difflib.unified_diff(
+                before.splitlines(keepends=True),
+                after.splitlines(keepends=True),
+                fromfile="a/.zshrc",
+                tofile="b/.zshrc",
+            )
+        ),
+    }
+
+    plan["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return plan
+
+
+# ================= Shell Startup Benchmark =================
+
+
+SHELL_BENCH_RUNS = 20
+SHELL_BENCH_TIMEOUT = 30
+SHELL_BENCH_FILE = BACKUP_DIR / "shell-bench.json"
+
+
+def time_zsh_startup(zsh: str, zdotdir: Path, rc_text: str, runs: int) -> List[float]:
+    """把 rc_text 写入临时 ZDOTDIR，计时 runs 次 `zsh -i -c exit`（秒）
+
+    先预热一次（生成 .zcompdump、填充文件系统缓存），预热结果不计入。
+    """
+    with open(
+        zdotdir / ".zshrc", "w", encoding="utf-8", errors="surrogateescape", newline=""
+    ) as f:
+        f.write(rc_text)
+    env = dict(os.environ, ZDOTDIR=str(zdotdir))
+    times = []
+    cmd = [zsh, "-i", "-c", "exit"]
+    for i in range(runs + 1):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(
+            cmd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        # wait(timeout=...) 以最长 50ms 的间隔轮询，会把结果量化；
+        # 这里阻塞等待，超时由定时器结束进程
+        timer = threading.Timer(SHELL_BENCH_TIMEOUT, proc.kill)
+        timer.start()
+        try:
+            proc.wait()
+        finally:
+            timer.cancel()
+        elapsed = time.perf_counter() - t0
+        if proc.returncode == -signal.SIGKILL:
+            raise subprocess.TimeoutExpired(cmd, SHELL_BENCH_TIMEOUT)
+        if i:
+            times.append(elapsed)
+    return times
+
+
+def startup_stats(times: List[float]) -> Dict[str, float]:
+    """汇总启动耗时（毫秒）：平均值、p95（最近秩法）、最小值"""
+    ordered = sorted(times)
+    p95 = ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+    return {
+        "mean": round(statistics.fmean(ordered) * 1e3, 2),
+        "p95": round(p95 * 1e3, 2),
+        "min": round(ordered[0] * 1e3, 2),
+    }
+
+
+def measure_shell_startup(runs=SHELL_BENCH_RUNS) -> Dict:
+    """测量 .zshrc 的交互式启动耗时，并把耗时归因到各个标记块
+
+    - before: 移除全部标记块（相当于运行 mac-setup.py 之前的用户配置）
+    - after: 当前 .zshrc
+    - blocks: 每次只移除一个标记块，与 after 的平均耗时之差即该块的开销
+
+    所有变体都在同一个临时 ZDOTDIR 中运行，不修改真实的 .zshrc。
+    """
+    zsh = shutil.which("zsh")
+    if not zsh:
+        log("未找到 zsh，无法测量启动耗时", "ERROR")
+        sys.exit(1)
+    if not ZSHRC_PATH.exists():
+        log(f"{ZSHRC_PATH} 不存在，无需测量", "ERROR")
+        sys.exit(1)
+
+    with open(
+        ZSHRC_PATH, "r", encoding="utf-8", errors="surrogateescape", newline=""
+    ) as f:
+        text = f.read()
+    index = ZshrcIndex(text)
+    blocks = [seg for seg in index.segments if seg.is_block]
+    log(
+        f"测量 zsh 启动耗时: {zsh} -i -c exit（每项 {runs} 次，{len(blocks)} 个标记块）"
+    )
+
+    report: Dict = {
+        "zsh": zsh,
+        "rc": str(ZSHRC_PATH),
+        "runs": runs,
+        "created": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with tempfile.TemporaryDirectory(prefix="mac-setup-zsh-bench-") as tmp:
+        zdotdir = Path(tmp)
+        # 设置 ZDOTDIR 后 zsh 不再读取原来的 .zshenv，复制一份保持环境一致
+        zshenv = Path(os.environ.get("ZDOTDIR") or Path.home()) / ".zshenv"
+        if zshenv.is_file():
+            shutil.copy2(zshenv, zdotdir / ".zshenv")
+
+        def measure(label: str, rc_text: str) -> Dict[str, float]:
+            try:
+                times = time_zsh_startup(zsh, zdotdir, rc_text, runs)
+            except subprocess.TimeoutExpired:
+                log(f"{label}: zsh 启动超过 {SHELL_BENCH_TIMEOUT}s，已中止", "ERROR")
+                sys.exit(1)
+            stats = startup_stats(times)
+            log(f"  {label:<32} {stats['mean']:8.1f} ms  (p95 {stats['p95']:.1f} ms)")
+            return stats
+
+        report["before"] = measure("before", index.user_text)
+        report["after"] = measure("after", text)
+        report["blocks"] = []
+        for seg in blocks:
+            rc_text = "".join(s.text for s in index.segments if s is not seg)
+            stats = measure(f"-{seg.name}", rc_text)
+            report["blocks"].append(
+                {
+                    "name": seg.name,
+                    "cost": round(report["after"]["mean"] - stats["mean"], 2),
+                    "without": stats,
+                }
+            )
+    return report
+
+
+def print_shell_bench(report: Dict, previous: Optional[Dict] = None) -> None:
+    """以表格形式输出启动耗时与各标记块开销"""
+    before, after = report["before"], report["after"]
+    delta = after["mean"] - before["mean"]
+
+    print("")
+    log(f"▶ zsh 启动耗时（{report['runs']} 次）")
+    # 中文字符占两列
+    print(f"  {'':<24} {'平均':>8} {'p95':>10} {'最小':>8}")
+    for label, stats in (
+        ("before（无标记块）", before),
+        ("after（当前 .zshrc）", after),
+    ):
+        pad = 24 - sum(2 if ord(c) > 0x7F else 1 for c in label)
+        print(
+            f"  {label}{'':<{pad}} {stats['mean']:7.1f}ms "
+            f"{stats['p95']:8.1f}ms {stats['min']:7.1f}ms"
+        )
+    print(f"  增量{'':<20} {delta:+7.1f}ms")
+
+    print("")
+    log("▶ 各标记块开销（逐个移除后平均耗时的减少量）")
+    attributed = 0.0
+    for block in sorted(report["blocks"], key=lambda b: b["cost"], reverse=True):
+        attributed += block["cost"]
+        share = f"{block['cost'] / delta * 100:6.1f}%" if delta > 0 else ""
+        print(f"  {block['name']:<24} {block['cost']:+7.1f}ms {share}")
+    if report["blocks"]:
+        print(f"  未归因{'':<18} {delta - attributed:+7.1f}ms")
+
+    if previous and previous.get("rc") == report["rc"]:
+        print("")
+        log(
+            f"上次测量（{previous['created']}）: after {previous['after']['mean']:.1f} ms"
+            f" → 本次 {after['mean']:.1f} ms"
+            f"（{after['mean'] - previous['after']['mean']:+.1f} ms）"
+        )
+
+
+def bench_shell(runs=SHELL_BENCH_RUNS) -> None:
+    """--bench-shell：测量、输出并保存结果（与上次结果对比）"""
+    previous = None
+    if SHELL_BENCH_FILE.exists():
+        try:
+            previous = json.loads(SHELL_BENCH_FILE.read_text())
+        except (OSError, ValueError):
+            previous = None
+    report = measure_shell_startup(runs)
+    print_shell_bench(report, previous)
+    ensure_backup_dir()
+    SHELL_BENCH_FILE.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    log(f"结果已保存: {SHELL_BENCH_FILE}")
+
+
 # ================= Main =================
 
 
 def main():
-    print("🚀 开始 macOS 全自动化环境配置 (Powered by Python & Mise)")
-    print("")
+    global _tracer
 
     # 0. 参数解析
     parser = argparse.ArgumentParser(
@@ -801,20 +3279,144 @@ def main():
     parser.add_argument(
         "--no-starship", action="store_true", help="不使用 Starship 主题"
     )
-    parser.add_argument("--dry-run", action="store_true", help="仅模拟运行 (部分功能)")
+    parser.add_argument(
+        "--eager-plugins",
+        action="store_true",
+        help="所有 Oh My Zsh 插件在首个提示符之前加载（忽略延迟/按需加载策略）",
+    )
+    parser.add_argument(
+        "--typing-profile",
+        choices=list(TYPING_PROFILES),
+        default=DEFAULT_TYPING_PROFILE,
+        help=f"zsh-autosuggestions/zsh-syntax-highlighting 输入延迟调优档位（默认 {DEFAULT_TYPING_PROFILE}）",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="只计算执行计划并以 JSON 输出（日志输出到 stderr），不做任何修改",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="并行执行的最大步骤数（1 表示串行）",
+    )
+    parser.add_argument(
+        "--update-ttl",
+        type=parse_duration,
+        default=BREW_UPDATE_TTL,
+        help="距上次 brew update 不足该时长则跳过（如: 30m, 6h, 1d，默认 6h）",
+    )
+    parser.add_argument(
+        "--force-update",
+        action="store_true",
+        help="忽略 --update-ttl，强制 brew update",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="跳过上次已完成且输入未变化的步骤（检查点见 setup-journal.json）",
+    )
+    parser.add_argument(
+        "--from-step",
+        type=str,
+        default="",
+        help="从指定步骤开始重新执行（该步骤及其后续步骤），其余步骤按检查点跳过",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="清空检查点并重新执行所有步骤"
+    )
+    parser.add_argument(
+        "--trace",
+        nargs="?",
+        const=str(BACKUP_DIR / "traces"),
+        default="",
+        metavar="DIR",
+        help="记录步骤/命令耗时，输出 JSON Lines 和 Chrome trace（默认目录 ~/.mac-setup-backup/traces）",
+    )
+    parser.add_argument(
+        "--trace-top", type=int, default=10, help="--trace 汇总中显示的最慢命令数"
+    )
     parser.add_argument(
         "--skip-langs",
         type=str,
         default="",
         help="跳过指定语言安装，逗号分隔（如: python,rust,go）",
     )
+    parser.add_argument(
+        "--mise-jobs",
+        type=int,
+        default=MISE_INSTALL_JOBS,
+        help=f"并发安装的 Mise 语言数（默认 {MISE_INSTALL_JOBS}）",
+    )
+    parser.add_argument(
+        "--update-lock",
+        action="store_true",
+        help=f"重新解析 Mise 语言的精确版本并更新 {MISE_LOCK_FILE.name}",
+    )
+    parser.add_argument(
+        "--export-bundle",
+        type=Path,
+        metavar="FILE",
+        help="导出离线包（Homebrew/Mise 下载缓存、Oh My Zsh 及插件）后退出",
+    )
+    parser.add_argument(
+        "--import-bundle",
+        type=Path,
+        metavar="FILE",
+        help="导入离线包，预置本机缓存后退出",
+    )
+    parser.add_argument(
+        "--bench-shell",
+        action="store_true",
+        help="测量 zsh 交互式启动耗时（平均值/p95）及各标记块的开销后退出",
+    )
+    parser.add_argument(
+        "--bench-runs",
+        type=int,
+        default=SHELL_BENCH_RUNS,
+        help=f"--bench-shell 每项测量的次数（默认 {SHELL_BENCH_RUNS}）",
+    )
     args = parser.parse_args()
 
+    # --dry-run 不做任何修改：不写日志文件，也不清理旧日志
+    if args.dry_run:
+        _init_log_file().disable()
+    else:
+        _init_log_file().enable_pruning()
+
+    # --dry-run 的 stdout 只输出 JSON 计划，其余输出改到 stderr
+    console = sys.stderr if args.dry_run else sys.stdout
+    print("🚀 开始 macOS 全自动化环境配置 (Powered by Python & Mise)", file=console)
+    print("", file=console)
+
     # 解析跳过的语言
     skip_langs = set(
         lang.strip().lower() for lang in args.skip_langs.split(",") if lang.strip()
     )
 
+    # 离线包导入/导出（只读写缓存目录，不执行安装）
+    if args.export_bundle:
+        export_bundle(args.export_bundle.expanduser())
+        return
+    if args.import_bundle:
+        import_bundle(args.import_bundle.expanduser())
+        return
+
+    # 启动耗时测量只使用 .zshrc 的临时副本
+    if args.bench_shell:
+        bench_shell(max(1, args.bench_runs))
+        return
+
+    # 规划模式只做只读探测，无需确认
+    if args.dry_run:
+        with redirect_stdout(sys.stderr):
+            plan = build_plan(check_environment(), args, skip_langs)
+            log(f"执行计划已生成（{plan['elapsed_ms']:.0f} ms）")
+        print(json.dumps(plan, indent=2, ensure_ascii=False))
+        return
+
     # 1. 环境检测
     arch = check_environment()
 
@@ -824,44 +3426,40 @@ def main():
     else:
         log("参数 --yes 已启用，跳过确认环节", "INFO")
 
-    if args.dry_run:
-        log("DRY-RUN 模式：脚本到此为止，不执行实际更改。", "WARN")
-        return
-
-    # 3. 基础工具
-    install_homebrew(arch)
-
-    # 4. 软件与依赖
-    install_brew_packages()
-
-    # 5. Shell 美化
-    install_oh_my_zsh()
-
-    # 6. 语言环境 (Mise - Python/Node/Java)
-    # 检查是否跳过所有 Mise 管理的语言
-    mise_langs = set(MISE_VERSIONS.keys())
-    if not mise_langs.issubset(skip_langs):
-        setup_mise(skip_langs)
-    else:
-        log("跳过 Mise 语言安装（所有语言均在 --skip-langs 中）", "WARN")
-
-    # 7. Rust (rustup)
-    if "rust" not in skip_langs:
-        setup_rust()
-    else:
-        log("跳过 Rust 安装（--skip-langs rust）", "WARN")
-
-    # 8. Go (环境变量配置)
-    if "go" not in skip_langs:
-        setup_go()
-    else:
-        log("跳过 Go 配置（--skip-langs go）", "WARN")
-
-    # 9. 收尾配置 (处理 Starship 参数)
-    configure_zsh_final(skip_starship_ask=args.yes, force_no_starship=args.no_starship)
-
-    # 10. fzf 配置
-    configure_fzf()
+    # 3. 按依赖图执行安装步骤（--resume/--from-step 时跳过检查点未失效的步骤）
+    steps = build_steps(arch, args, skip_langs)
+    journal = StepJournal(JOURNAL_FILE)
+    force = set()
+    if args.force:
+        journal.clear()
+    if args.from_step:
+        names = [s.name for s in steps]
+        if args.from_step not in names:
+            log(f"未知步骤: {args.from_step}（可选: {', '.join(names)}）", "ERROR")
+            sys.exit(1)
+        force.add(args.from_step)
+    if args.update_lock:
+        force.add("mise")
+    scheduler = StepScheduler(
+        steps,
+        jobs=args.jobs,
+        journal=journal,
+        resume=bool(args.resume or args.from_step) and not args.force,
+        force=force,
+    )
+    if args.trace:
+        _tracer = Tracer(Path(args.trace).expanduser())
+    add_homebrew_to_path(arch)
+    begin_zshrc_transaction()
+    try:
+        scheduler.run()
+    finally:
+        commit_zshrc_transaction()
+        if _tracer is not None:
+            _tracer.close()
+    scheduler.report()
+    if _tracer is not None:
+        _tracer.summary(args.trace_top)
 
     print("")
     log("🎉 所有任务完成！", "SUCCESS")
@@ -9,14 +9,30 @@ macOS 环境回滚脚本 (配合 mac-setup.py 使用)
 """
 
 import argparse
+import json
+import os
 import re
 import shutil
+import stat
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backup_store import BackupStore
+from zshrc_blocks import (
+    DISABLE_PREFIXES,
+    ZshrcIndex,
+    disable_lines,
+    rewrite_file,
+    strip_lines,
+)
 
 # ================= Configuration =================
 
@@ -30,6 +46,7 @@ class RollbackMode(Enum):
 ZSHRC_PATH = Path.home() / ".zshrc"
 BREWFILE_PATH = Path.home() / "Brewfile"
 BACKUP_DIR = Path.home() / ".mac-setup-backup"
+DU_CACHE_FILE = BACKUP_DIR / "du-cache.json"
 
 # Mise 相关目录（Python 脚本使用 Mise 而非 pyenv/fnm/jenv）
 MISE_DIRS = [
@@ -43,8 +60,18 @@ ENV_DIRS = [
     Path.home() / ".cargo",  # Rust
     Path.home() / "go",  # GOPATH
     *MISE_DIRS,  # Mise 数据
+    Path.home() / ".cache" / "mac-setup",  # 初始化脚本缓存
 ]
 
+# 回收区：待删除目录先 rename 到这里（同一文件系统内 rename 是原子的），再后台清理
+TRASH_NAME = ".mac-setup-trash"
+TRASH_DIR = Path.home() / TRASH_NAME
+
+# 并行删除的线程数（删除以文件系统元数据操作为主，I/O 密集）
+DEFAULT_PURGE_JOBS = min(8, (os.cpu_count() or 4) * 2)
+
+BREWFILE_ENTRY = re.compile(r'^\s*(tap|brew|cask|mas)\s+"([^"]+)"')
+
 
 # ================= Helpers =================
 
@@ -78,20 +105,27 @@ def ensure_backup_dir() -> Path:
 
 
 def backup_file(file_path: Path, prefix: str = "") -> Optional[Path]:
-    """备份文件"""
+    """备份文件（内容寻址存储，内容未变化时只追加一条清单记录）"""
     if not file_path.exists():
         return None
 
-    backup_dir = ensure_backup_dir()
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    backup_name = f"{prefix}{file_path.name}.{timestamp}"
-    backup_path = backup_dir / backup_name
-
-    shutil.copy2(file_path, backup_path)
-    log(f"  备份创建: {backup_path}")
+    store = BackupStore(ensure_backup_dir())
+    backup_path, created = store.backup(file_path, prefix, latest=False)
+    if created:
+        log(f"  备份创建: {backup_path}")
+    else:
+        log(f"  内容未变化，复用备份: {backup_path}")
     return backup_path
 
 
+def remove_compiled(path: Path) -> None:
+    """删除 zsh 字节码 <path>.zwc
+
+    恢复备份时 copy2 保留旧的 mtime，.zwc 可能比源文件新，zsh 会继续加载旧的编译结果。
+    """
+    path.with_name(path.name + ".zwc").unlink(missing_ok=True)
+
+
 def read_file(path: Path) -> str:
     """读取文件内容"""
     if not path.exists():
@@ -115,18 +149,9 @@ def disable_auto_blocks(zshrc_path: Path) -> None:
         log("  .zshrc 不存在，跳过", "WARN")
         return
 
-    content = read_file(zshrc_path)
-
-    # 匹配所有脚本生成的配置块标记
+    # 单次流式解析，标记行改为 ### DISABLED-xxx
     # 包括: AUTO-*, HOMEBREW-PATH, MISE-ACTIVATE
-    markers = ["AUTO-", "HOMEBREW-PATH", "MISE-ACTIVATE"]
-
-    for marker in markers:
-        pattern = rf"^### {marker}"
-        replacement = f"### DISABLED-{marker}"
-        content = re.sub(pattern, replacement, content, flags=re.MULTILINE)
-
-    write_file(zshrc_path, content)
+    rewrite_file(zshrc_path, disable_lines)
     log("  已禁用所有脚本配置块")
 
 
@@ -136,17 +161,9 @@ def remove_auto_blocks(zshrc_path: Path) -> None:
         log("  .zshrc 不存在，跳过", "WARN")
         return
 
-    content = read_file(zshrc_path)
-
-    # 移除所有脚本生成的配置块
+    # 移除所有脚本生成的配置块（含多段连字符的标记，如 AUTO-SETUP-CORE）
     # 匹配: ### xxx START ### ... ### xxx END ###
-    new_content = re.sub(
-        r"### [A-Z]+-?[A-Z]* START ###\n.*?### [A-Z]+-?[A-Z]* END ###\n?",
-        "",
-        content,
-        flags=re.DOTALL,
-    )
-    write_file(zshrc_path, new_content)
+    rewrite_file(zshrc_path, strip_lines)
     log("  已移除所有脚本配置块")
 
 
@@ -162,17 +179,203 @@ def restore_original_zshrc_backup(backup_dir: Path, zshrc_path: Path) -> None:
         if actual_backup.exists():
             log(f"  从备份恢复 .zshrc: {actual_backup}")
             shutil.copy2(actual_backup, zshrc_path)
+            remove_compiled(zshrc_path)
             return
 
     log("  未找到 .zshrc 备份文件，跳过恢复", "WARN")
 
 
-def delete_env_dirs(dirs: list) -> None:
-    """删除环境目录"""
+def trash_dir_for(path: Path) -> Path:
+    """返回与 path 位于同一文件系统的回收区"""
+    if path.lstat().st_dev == Path.home().stat().st_dev:
+        return TRASH_DIR
+    return path.parent / TRASH_NAME
+
+
+def trash_roots(dirs: list) -> List[Path]:
+    """可能存在回收区的位置（用于恢复中断的清理）"""
+    roots = [TRASH_DIR]
     for dir_path in dirs:
-        if dir_path.exists():
-            log(f"  删除: {dir_path}")
-            shutil.rmtree(dir_path, ignore_errors=True)
+        root = dir_path.parent / TRASH_NAME
+        if root not in roots:
+            roots.append(root)
+    return roots
+
+
+def move_to_trash(path: Path) -> Optional[Path]:
+    """把目录原子地移入回收区，失败（如跨文件系统、挂载点）时返回 None"""
+    trash = trash_dir_for(path)
+    try:
+        trash.mkdir(mode=0o700, exist_ok=True)
+        # 每个目录一个独立容器，避免同名目录（如两个 mise）冲突
+        container = Path(
+            tempfile.mkdtemp(prefix=f"{path.name.lstrip('.')}-", dir=trash)
+        )
+        os.rename(path, container / path.name)
+        return container
+    except OSError:
+        return None
+
+
+class PurgeProgress:
+    """删除进度（多线程累加，单行刷新输出）"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+
+    def add(self, files: int, freed: int) -> None:
+        with self._lock:
+            self.files += files
+            self.bytes += freed
+            now = time.monotonic()
+            if now - self._last >= 0.2:
+                self._last = now
+                self.show()
+
+    def show(self, end: str = "") -> None:
+        print(
+            f"\r  已删除 {self.files} 个文件，释放 {self.bytes / 1024 / 1024:.1f} MB",
+            end=end,
+            flush=True,
+        )
+
+
+def _purge_entries(path: str, progress: PurgeProgress) -> List[str]:
+    """删除目录下的非目录项，返回子目录列表"""
+    # 只读目录（如 Go module cache）需要先加写权限才能删除其中的文件
+    if not os.access(path, os.W_OK | os.X_OK):
+        try:
+            os.chmod(path, stat.S_IRWXU)
+        except OSError:
+            pass
+
+    subdirs = []
+    files = 0
+    freed = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    st = entry.stat(follow_symlinks=False)
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    continue
+                except OSError:
+                    continue  # 无法删除的文件留给最后的 rmtree 兜底
+                files += 1
+                freed += getattr(st, "st_blocks", 0) * 512 or st.st_size
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    except PermissionError:
+        return []
+    progress.add(files, freed)
+    return subdirs
+
+
+def walk_parallel(root: str, visit: Callable[[str], List[str]], jobs: int) -> List[str]:
+    """并行遍历目录树：每个目录一个任务，visit(path) 处理该目录并返回子目录列表
+
+    返回遍历到的全部目录（子目录总在父目录之后）。
+    """
+    dirs = [root]
+    pool = ThreadPoolExecutor(max_workers=jobs)
+    pending = {pool.submit(visit, root)}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for sub in future.result():
+                    dirs.append(sub)
+                    pending.add(pool.submit(visit, sub))
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        raise
+    finally:
+        pool.shutdown(wait=True)
+    return dirs
+
+
+def purge_tree(root: Path, progress: PurgeProgress, jobs: int) -> None:
+    """并行删除目录树（scandir 遍历，每个目录一个任务）"""
+    if root.is_symlink() or not root.is_dir():
+        root.unlink(missing_ok=True)
+        return
+
+    dirs = walk_parallel(str(root), lambda path: _purge_entries(path, progress), jobs)
+
+    # 子目录总是在父目录之后被发现，倒序删除即可保证先删子目录
+    for dir_path in reversed(dirs):
+        try:
+            os.rmdir(dir_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            break
+    if root.exists():
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def purge_trash(roots: List[Path], jobs: int = DEFAULT_PURGE_JOBS) -> Tuple[int, int]:
+    """清理回收区中的全部内容（包括之前被中断的清理），返回 (文件数, 字节数)"""
+    containers = [
+        item for root in roots if root.is_dir() for item in sorted(root.iterdir())
+    ]
+    progress = PurgeProgress()
+    if not containers:
+        return 0, 0
+
+    for container in containers:
+        purge_tree(container, progress, jobs)
+    progress.show(end="\n")
+    for root in roots:
+        try:
+            root.rmdir()
+        except OSError:
+            pass
+    return progress.files, progress.bytes
+
+
+def delete_env_dirs(dirs: list, jobs: int = DEFAULT_PURGE_JOBS) -> None:
+    """删除环境目录
+
+    先把每个目录 rename 进回收区（立即生效），再并行清理回收区。
+    清理被中断时内容留在回收区，下次运行或执行 --purge-trash 时继续。
+    """
+    in_place = []
+    for dir_path in dirs:
+        if dir_path.is_symlink():
+            log(f"  删除符号链接: {dir_path}")
+            dir_path.unlink()
+        elif dir_path.exists():
+            if move_to_trash(dir_path):
+                log(f"  移除: {dir_path}")
+            else:
+                log(f"  移除: {dir_path}（无法移入回收区，直接删除）")
+                in_place.append(dir_path)
+
+    log("  清理回收区...")
+    try:
+        progress = PurgeProgress()
+        for dir_path in in_place:
+            purge_tree(dir_path, progress, jobs)
+        if in_place:
+            progress.show(end="\n")
+        files, freed = purge_trash(trash_roots(dirs), jobs)
+    except KeyboardInterrupt:
+        print("")
+        log("清理已中断，剩余内容保留在回收区，可执行 --purge-trash 继续", "WARN")
+        raise
+    log(
+        f"  共删除 {files + progress.files} 个文件，"
+        f"释放 {(freed + progress.bytes) / 1024 / 1024:.1f} MB"
+    )
 
 
 def uninstall_brewfile_packages() -> None:
@@ -212,7 +415,7 @@ def rollback_soft() -> None:
     print("  2. 如需完全移除，请使用 --mode env 或 --mode full")
 
 
-def rollback_env() -> None:
+def rollback_env(jobs: int = DEFAULT_PURGE_JOBS) -> None:
     """env 模式：恢复用户环境（推荐）"""
     log("▶ 执行 ENV 回滚（恢复用户环境）")
 
@@ -237,7 +440,7 @@ def rollback_env() -> None:
 
     # 4. 删除环境目录
     log("▶ 删除语言环境目录")
-    delete_env_dirs(ENV_DIRS)
+    delete_env_dirs(ENV_DIRS, jobs)
 
     print("")
     log("env 回滚完成", "SUCCESS")
@@ -247,7 +450,7 @@ def rollback_env() -> None:
     print(f"  2. 备份文件已保存至: {BACKUP_DIR}")
 
 
-def rollback_full() -> None:
+def rollback_full(jobs: int = DEFAULT_PURGE_JOBS) -> None:
     """full 模式：完全回滚（高风险）"""
     log("即将执行 FULL 回滚（危险）", "WARN")
     print("这会卸载 Brewfile 中的软件，并删除用户环境")
@@ -279,7 +482,7 @@ def rollback_full() -> None:
 
     # 4. 删除环境目录
     log("▶ 删除用户环境目录")
-    delete_env_dirs(ENV_DIRS)
+    delete_env_dirs(ENV_DIRS, jobs)
 
     # 5. 询问是否卸载 Homebrew
     print("")
@@ -298,6 +501,239 @@ def rollback_full() -> None:
     print(f"  2. 备份文件已保存至: {BACKUP_DIR}")
 
 
+def parse_timestamp(value: str) -> str:
+    """把 2026-10-17、"2026-10-17 06:32"、20261017063202 等格式统一为 YYYYmmddHHMMSS"""
+    digits = "".join(ch for ch in value if ch.isdigit())
+    if len(digits) < 8 or len(digits) > 14:
+        raise argparse.ArgumentTypeError(
+            f"无效的时间: {value}（示例: 2026-10-17, '2026-10-17 06:32', 20261017063202）"
+        )
+    return digits.ljust(14, "0")
+
+
+def list_backups() -> None:
+    """列出备份清单中的全部备份"""
+    entries = BackupStore(ensure_backup_dir()).entries()
+    if not entries:
+        log("没有备份记录")
+        return
+    # 中文字符占两列，表头手工对齐
+    print("ID".ljust(28) + "时间" + " " * 16 + "文件" + " " * 43 + "大小")
+    for entry in entries:
+        when = datetime.strptime(entry["time"], "%Y%m%d%H%M%S")
+        print(
+            f"{entry['id']:<27} {when:%Y-%m-%d %H:%M:%S} "
+            f"{entry['file']:<40} {entry['size']:>10}"
+        )
+    log(f"共 {len(entries)} 条备份记录（{BACKUP_DIR / 'manifest.jsonl'}）")
+
+
+def restore_backup(entry: Optional[dict]) -> None:
+    """把备份恢复到原位置（恢复前先备份当前文件）"""
+    if entry is None:
+        log("未找到匹配的备份", "ERROR")
+        sys.exit(1)
+
+    backup_path = BACKUP_DIR / entry["file"]
+    if not backup_path.exists():
+        log(f"备份文件已不存在: {backup_path}", "ERROR")
+        sys.exit(1)
+
+    target = Path(entry["source"])
+    log(f"▶ 恢复备份 {entry['id']} → {target}")
+    backup_file(target, "before-restore.")
+    shutil.copy2(backup_path, target)
+    remove_compiled(target)
+    log(f"已恢复: {target}", "SUCCESS")
+
+
+def gc_backups(keep_last: int, keep_days: float) -> None:
+    """清理旧备份（.latest 指向的备份始终保留）"""
+    if not BACKUP_DIR.exists():
+        log("备份目录不存在，无需清理")
+        return
+    entries, blobs, freed = BackupStore(BACKUP_DIR).gc(keep_last, keep_days)
+    log(
+        f"已清理 {entries} 条备份记录、{blobs} 个内容对象，"
+        f"释放 {freed / 1024 / 1024:.1f} MB",
+        "SUCCESS",
+    )
+
+
+# ================= Plan =================
+
+
+class DiskUsage:
+    """并发统计目录树的文件数和占用空间
+
+    按目录缓存其直接包含的文件数、字节数和子目录名，以目录 mtime 作为键：
+    目录中增删/重命名条目会更新 mtime，缓存随之失效；
+    仅修改已有文件内容不会更新目录 mtime，这类变化要等目录本身变化后才会反映。
+    """
+
+    def __init__(self, cache_path: Path, jobs: int = DEFAULT_PURGE_JOBS):
+        self.cache_path = cache_path
+        self.jobs = jobs
+        self.new_cache: Dict[str, list] = {}
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                self.old_cache: Dict[str, list] = json.load(f)
+        except (OSError, ValueError):
+            self.old_cache = {}
+
+    def _visit(self, path: str, totals: list, lock: threading.Lock) -> List[str]:
+        try:
+            mtime = os.lstat(path).st_mtime_ns
+        except OSError:
+            return []
+        cached = self.old_cache.get(path)
+        if cached and cached[0] == mtime:
+            _, files, nbytes, names = cached
+        else:
+            files = nbytes = 0
+            names = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                names.append(entry.name)
+                                continue
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        files += 1
+                        nbytes += getattr(st, "st_blocks", 0) * 512 or st.st_size
+            except OSError:
+                return []
+        self.new_cache[path] = [mtime, files, nbytes, names]
+        with lock:
+            totals[0] += files
+            totals[1] += nbytes
+        return [os.path.join(path, name) for name in names]
+
+    def measure(self, root: Path) -> Dict:
+        """返回 {"files", "dirs", "bytes"}"""
+        totals = [0, 0]
+        lock = threading.Lock()
+        dirs = walk_parallel(
+            str(root), lambda path: self._visit(path, totals, lock), self.jobs
+        )
+        return {"files": totals[0], "dirs": len(dirs), "bytes": totals[1]}
+
+    def save(self) -> None:
+        """只保留本次遍历到的目录（自动淘汰已删除目录的缓存）"""
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.new_cache, f)
+        os.replace(tmp, self.cache_path)
+
+
+def parse_brewfile(path: Path) -> List[Dict]:
+    """解析 Brewfile 中的 tap/brew/cask/mas 条目"""
+    packages = []
+    if not path.exists():
+        return packages
+    for line in read_file(path).splitlines():
+        match = BREWFILE_ENTRY.match(line)
+        if match:
+            packages.append({"type": match.group(1), "name": match.group(2)})
+    return packages
+
+
+def build_plan(mode: RollbackMode, jobs: int = DEFAULT_PURGE_JOBS) -> Dict:
+    """计算回滚计划（不做任何修改）"""
+    plan: Dict = {"mode": mode.value}
+
+    blocks = []
+    if ZSHRC_PATH.exists():
+        index = ZshrcIndex(read_file(ZSHRC_PATH))
+        for seg in index.segments:
+            if not seg.is_block:
+                continue
+            # soft 只禁用特定前缀的块，env/full 移除全部标记块
+            if mode == RollbackMode.SOFT and not seg.name.startswith(DISABLE_PREFIXES):
+                continue
+            blocks.append({"name": seg.name, "lines": len(seg.lines)})
+    plan["zshrc"] = {
+        "path": str(ZSHRC_PATH),
+        "action": "disable" if mode == RollbackMode.SOFT else "remove",
+        "blocks": blocks,
+    }
+
+    directories = []
+    if mode != RollbackMode.SOFT:
+        usage = DiskUsage(DU_CACHE_FILE, jobs)
+        for dir_path in ENV_DIRS:
+            item = {
+                "path": str(dir_path),
+                "category": "mise" if dir_path in MISE_DIRS else "env",
+                "exists": dir_path.exists(),
+                "files": 0,
+                "dirs": 0,
+                "bytes": 0,
+            }
+            if item["exists"] and not dir_path.is_symlink():
+                item.update(usage.measure(dir_path))
+            directories.append(item)
+        usage.save()
+    plan["directories"] = directories
+    plan["total_bytes"] = sum(item["bytes"] for item in directories)
+
+    plan["brewfile"] = {
+        "path": str(BREWFILE_PATH),
+        "packages": parse_brewfile(BREWFILE_PATH) if mode == RollbackMode.FULL else [],
+    }
+    return plan
+
+
+def format_size(nbytes: int) -> str:
+    size = float(nbytes)
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} B" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def print_plan(plan: Dict) -> None:
+    """以表格形式输出回滚计划"""
+    home = str(Path.home())
+
+    def short(path: str) -> str:
+        return "~" + path[len(home) :] if path.startswith(home) else path
+
+    zshrc = plan["zshrc"]
+    action = "禁用" if zshrc["action"] == "disable" else "移除"
+    log(f"▶ .zshrc 配置块（将{action}）: {short(zshrc['path'])}")
+    if not zshrc["blocks"]:
+        print("  （无）")
+    for block in zshrc["blocks"]:
+        print(f"  {block['name']:<40} {block['lines']:>6} 行")
+
+    if plan["mode"] != RollbackMode.SOFT.value:
+        print("")
+        log("▶ 环境目录（将删除）")
+        for item in plan["directories"]:
+            path = short(item["path"])
+            if not item["exists"]:
+                print(f"  {path:<40} {'-':>10} {'-':>12}  不存在")
+                continue
+            print(f"  {path:<40} {item['files']:>10} {format_size(item['bytes']):>12}")
+        # 中文字符占两列
+        print(f"  合计{'':<38} {'':>10} {format_size(plan['total_bytes']):>12}")
+
+    if plan["mode"] == RollbackMode.FULL.value:
+        packages = plan["brewfile"]["packages"]
+        print("")
+        log(f"▶ Brewfile 软件包（将卸载）: {len(packages)} 个")
+        for kind in ("tap", "brew", "cask", "mas"):
+            names = [p["name"] for p in packages if p["type"] == kind]
+            if names:
+                print(f"  {kind}: {', '.join(names)}")
+
+
 # ================= Main =================
 
 
@@ -315,6 +751,13 @@ def main():
   python3 rollback.py --mode soft
   python3 rollback.py --mode env
   python3 rollback.py --mode full
+  python3 rollback.py --gc --keep 5 --keep-days 14
+  python3 rollback.py --plan --mode env
+  python3 rollback.py --plan --format json
+  python3 rollback.py --purge-trash
+  python3 rollback.py --list
+  python3 rollback.py --at "2026-10-17 06:30"
+  python3 rollback.py --backup 20261017063202-3f2a
         """,
     )
     parser.add_argument(
@@ -322,11 +765,90 @@ def main():
         "-m",
         type=str,
         choices=["soft", "env", "full"],
-        required=True,
         help="回滚模式: soft | env | full",
     )
+    parser.add_argument(
+        "--gc", action="store_true", help="按保留策略清理备份目录中的旧备份"
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        default=10,
+        help="--gc: 每个备份来源至少保留的备份次数（默认 10）",
+    )
+    parser.add_argument(
+        "--keep-days",
+        type=float,
+        default=30,
+        help="--gc: 保留最近多少天内的全部备份（默认 30）",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="只显示回滚计划（要删除的目录及大小、配置块、软件包），不做修改",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["table", "json"],
+        default="table",
+        help="--plan 的输出格式（默认 table）",
+    )
+    parser.add_argument(
+        "--purge-trash",
+        action="store_true",
+        help="继续清理回收区（恢复被中断的目录删除）",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=DEFAULT_PURGE_JOBS,
+        help=f"并行删除线程数（默认 {DEFAULT_PURGE_JOBS}）",
+    )
+    parser.add_argument("--list", action="store_true", help="列出所有备份")
+    parser.add_argument(
+        "--at",
+        type=parse_timestamp,
+        metavar="TIME",
+        help="把 .zshrc 恢复为该时间点之前最近一次备份的内容",
+    )
+    parser.add_argument(
+        "--backup", metavar="ID", help="按 ID（或 ID 前缀）恢复指定备份到原位置"
+    )
     args = parser.parse_args()
 
+    if args.plan:
+        plan = build_plan(RollbackMode(args.mode or "full"), args.jobs)
+        if args.format == "json":
+            print(json.dumps(plan, indent=2, ensure_ascii=False))
+        else:
+            print_plan(plan)
+        return
+    if args.purge_trash:
+        files, freed = purge_trash(trash_roots(ENV_DIRS), args.jobs)
+        log(
+            f"回收区清理完成：删除 {files} 个文件，释放 {freed / 1024 / 1024:.1f} MB",
+            "SUCCESS",
+        )
+        return
+    if args.list:
+        list_backups()
+        return
+    if args.at:
+        store = BackupStore(ensure_backup_dir())
+        restore_backup(store.at(args.at, source=ZSHRC_PATH))
+        return
+    if args.backup:
+        restore_backup(BackupStore(ensure_backup_dir()).find(args.backup))
+        return
+    if args.gc:
+        gc_backups(args.keep, args.keep_days)
+        return
+    if not args.mode:
+        parser.error(
+            "需要指定 --mode、--gc、--purge-trash、--list、--at 或 --backup 之一"
+        )
+
     print("🔄 macOS 环境回滚脚本")
     print("")
 
@@ -337,9 +859,9 @@ def main():
     if mode == RollbackMode.SOFT:
         rollback_soft()
     elif mode == RollbackMode.ENV:
-        rollback_env()
+        rollback_env(args.jobs)
     elif mode == RollbackMode.FULL:
-        rollback_full()
+        rollback_full(args.jobs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+#!/usr/bin/env bash
+# 测试内容寻址备份存储（去重、.latest 链接、gc 保留策略、按 id 和时间点查找）
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+
+echo "🧪 测试备份存储"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+python3 - "$SCRIPT_DIR" "$WORK_DIR" <<'EOF'
+import os
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, sys.argv[1])
+import backup_store
+from backup_store import BackupStore
+
+work = Path(sys.argv[2])
+clock = [datetime(2026, 1, 1, 12, 0, 0)]
+
+
+class FakeDatetime(datetime):
+    """备份时间由测试控制"""
+
+    @classmethod
+    def now(cls, tz=None):
+        return clock[0]
+
+
+backup_store.datetime = FakeDatetime
+
+
+def blobs(store):
+    return sorted(p.name for p in store.objects.glob("*/*"))
+
+
+def backup_at(store, path, content, when):
+    clock[0] = when
+    path.write_text(content, encoding="utf-8")
+    return store.backup(path)
+
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 1：相同内容只保存一份")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+store = BackupStore(work / "dedup")
+zshrc = work / ".zshrc"
+t0 = datetime(2026, 1, 1, 12, 0, 0)
+
+first, created = backup_at(store, zshrc, "v1\n", t0)
+assert created and first.name == ".zshrc.20260101120000", (first, created)
+again, created = backup_at(store, zshrc, "v1\n", t0 + timedelta(minutes=1))
+assert not created and again == first, "内容未变化时应复用上一次的备份文件"
+assert len(store.entries()) == 2 and len(blobs(store)) == 1
+assert os.readlink(store.root / ".zshrc.latest") == first.name
+assert first.stat().st_ino == store.blob_path(store.entries()[0]["sha256"]).stat().st_ino
+print("✅ 验证通过：第二次备份只追加清单记录，备份文件硬链接到同一个 blob")
+
+second, created = backup_at(store, zshrc, "v2\n", t0 + timedelta(minutes=2))
+assert created and second != first and len(blobs(store)) == 2
+third, created = backup_at(store, zshrc, "v1\n", t0 + timedelta(minutes=3))
+assert created and third != first, "与上一次备份内容不同时应创建新的备份文件"
+assert len(blobs(store)) == 2, "内容与更早的备份相同时应复用已有 blob"
+assert os.readlink(store.root / ".zshrc.latest") == third.name
+print("✅ 验证通过：内容变回旧版本时创建新备份文件，但复用已有 blob")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 2：同一秒内的多次备份互不覆盖")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+t1 = t0 + timedelta(minutes=10)
+a, _ = backup_at(store, zshrc, "same-second-a\n", t1)
+b, _ = backup_at(store, zshrc, "same-second-b\n", t1)
+assert a.name == ".zshrc.20260101121000" and b.name == ".zshrc.20260101121000-1", (a, b)
+assert a.read_text() == "same-second-a\n" and b.read_text() == "same-second-b\n"
+ids = [e["id"] for e in store.entries()]
+assert len(ids) == len(set(ids)), f"记录 id 重复: {ids}"
+print("✅ 验证通过：第二个备份文件追加序号，记录 id 唯一")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 3：gc 保留策略")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+store = BackupStore(work / "gc")
+brewfile = work / "Brewfile"
+now = datetime.now()
+# .zshrc：60 天前起每 10 天备份一次（内容各不相同），共 7 次
+zshrc_files = [
+    backup_at(store, zshrc, f"zshrc {i}\n", now - timedelta(days=60 - 10 * i))[0]
+    for i in range(7)
+]
+# Brewfile：只有两次很早的备份
+brew_files = [
+    backup_at(store, brewfile, f"brew {i}\n", now - timedelta(days=90 - i))[0]
+    for i in range(2)
+]
+# setup-macos.sh 风格的绝对路径 .latest 指向最早的 .zshrc 备份
+pinned = store.root / "original-.zshrc.latest"
+pinned.symlink_to(zshrc_files[0].absolute())
+
+removed, removed_blobs, freed = store.gc(keep_last=2, keep_days=25)
+kept = {e["file"] for e in store.entries()}
+# 保留：25 天内的第 4~6 次（含最近 2 次）、.latest 指向的第 0 次
+for i in (0, 4, 5, 6):
+    assert zshrc_files[i].name in kept and zshrc_files[i].exists(), f"第 {i} 次备份不应被清理"
+for i in (1, 2, 3):
+    assert zshrc_files[i].name not in kept and not zshrc_files[i].exists(), f"第 {i} 次备份应被清理"
+assert all(p.name in kept and p.exists() for p in brew_files), "每个来源至少保留最近 keep_last 次"
+assert removed_blobs == removed and freed == removed * len("zshrc 0\n"), (removed, removed_blobs, freed)
+assert len(blobs(store)) == len(kept), "被清理记录的 blob 应一并删除"
+for entry in store.entries():
+    assert store.blob_path(entry["sha256"]).exists(), f"保留的记录缺少 blob: {entry['file']}"
+print(f"✅ 验证通过：清理 {removed} 条记录，保留最近备份、保留期内备份和 .latest 指向的备份")
+
+assert store.gc(keep_last=2, keep_days=25) == (0, 0, 0), "再次 gc 不应有可清理的内容"
+print("✅ 验证通过：重复 gc 无副作用")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 4：按 id 和时间点查找（--backup / --at）")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+store = BackupStore(work / "catalog")
+start = datetime(2026, 3, 1, 8, 0, 0)
+# 两个来源交替备份，每小时一次，共 200 条记录（同一秒内另有一条 original- 备份）
+for i in range(100):
+    when = start + timedelta(hours=i)
+    backup_at(store, zshrc, f"zshrc {i}\n", when)
+    clock[0] = when
+    brewfile.write_text(f"brew {i}\n", encoding="utf-8")
+    store.backup(brewfile)
+store.backup(zshrc, prefix="original-")
+entries = store.entries()
+assert len(entries) == 201
+
+for entry in (entries[0], entries[77], entries[-2], entries[-1]):
+    assert store.find(entry["id"]) == entry, f"按 id 未找到: {entry['id']}"
+    assert store.find(entry["id"][:20]) == entry, f"按 id 前缀未找到: {entry['id']}"
+assert store.find("20260301080000") == entries[0], "时间戳前缀应返回该秒内最早的记录"
+assert store.find("20250101000000") is None and store.find("20270101000000") is None
+assert store.find(entries[5]["id"][:15] + "zzz") is None
+print("✅ 验证通过：完整 id、id 前缀和不存在的 id 查找正确")
+
+stamp = (start + timedelta(hours=42, minutes=30)).strftime("%Y%m%d%H%M%S")
+assert store.at(stamp)["file"] == entries[85]["file"], "应返回该时间点之前最近的一次备份"
+assert store.at(stamp, source=zshrc.absolute())["file"] == entries[84]["file"]
+exact = entries[84]["time"]
+assert store.at(exact, source=zshrc.absolute()) == entries[84], "恰好在该时间点的备份也算在内"
+assert store.at("20260301075959") is None, "最早备份之前的时间点应返回 None"
+assert store.at("20270101000000") == entries[-1]
+print("✅ 验证通过：时间点查找返回之前最近的备份，支持按来源过滤")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 5：清单末尾有写了一半的行")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+with open(store.manifest, "ab") as f:
+    f.write(b'{"id": "20260305120000-abc", "time": "2026')
+assert store.find(entries[-1]["id"]) == entries[-1], "残缺行导致最后一条记录查找失败"
+assert store.find(entries[100]["id"]) == entries[100]
+assert store.at("20270101000000") == entries[-1]
+clock[0] = start + timedelta(days=30)
+zshrc.write_text("after torn line\n", encoding="utf-8")
+path, _ = store.backup(zshrc)
+assert store.at("20270101000000")["file"] == path.name, "残缺行之后追加的记录无法查找"
+assert len(store.entries()) == 202, "残缺行之后的记录应另起一行"
+print("✅ 验证通过：跳过残缺行，后续追加的记录可以正常查找")
+EOF
+
+echo ""
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "🎉 测试完成"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
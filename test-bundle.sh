@@ -0,0 +1,110 @@
+#!/usr/bin/env bash
+# 测试离线包导出和导入功能（使用临时目录中的假缓存和 brew 桩，不触碰真实环境）
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+
+echo "🧪 测试离线包导出/导入"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+# 创建假的 HOME、缓存目录和 brew 桩
+echo "▶ 创建测试环境: $WORK_DIR"
+export HOME="$WORK_DIR/home"
+export HOMEBREW_CACHE="$WORK_DIR/brew-cache"
+export MISE_DATA_DIR="$WORK_DIR/mise-data"
+export MISE_CACHE_DIR="$WORK_DIR/mise-cache"
+mkdir -p "$HOME" "$WORK_DIR/bin"
+
+cat >"$WORK_DIR/bin/brew" <<'EOF'
+#!/usr/bin/env bash
+# brew 桩：只实现离线包用到的 deps / --cache
+case "$1" in
+deps) exit 0 ;;
+--cache)
+  shift
+  [ "$1" = "--formula" ] || [ "$1" = "--cask" ] && shift
+  for name in "$@"; do
+    echo "$HOMEBREW_CACHE/downloads/$name--bottle.tar.gz"
+  done
+  ;;
+esac
+EOF
+chmod +x "$WORK_DIR/bin/brew"
+export PATH="$WORK_DIR/bin:$PATH"
+
+mkdir -p "$HOMEBREW_CACHE/downloads" "$HOMEBREW_CACHE/api"
+echo "bottle" >"$HOMEBREW_CACHE/downloads/git--bottle.tar.gz"
+echo "{}" >"$HOMEBREW_CACHE/api/formula.jws.json"
+mkdir -p "$MISE_DATA_DIR/downloads/node" "$MISE_DATA_DIR/installs/node/22.1.0/bin"
+echo "tarball" >"$MISE_DATA_DIR/downloads/node/node-v22.1.0.tar.gz"
+echo "node" >"$MISE_DATA_DIR/installs/node/22.1.0/bin/node"
+ln -s 22.1.0 "$MISE_DATA_DIR/installs/node/22"
+mkdir -p "$MISE_CACHE_DIR/node" "$HOME/.oh-my-zsh/custom/plugins/demo"
+echo "{}" >"$MISE_CACHE_DIR/node/remote_versions.msgpack.z"
+echo "# demo" >"$HOME/.oh-my-zsh/custom/plugins/demo/demo.plugin.zsh"
+
+snapshot() {
+  (cd "$WORK_DIR" && find home/.oh-my-zsh brew-cache mise-data mise-cache \
+    \( -type f -o -type l \) -print | sort)
+}
+snapshot >"$WORK_DIR/before.txt"
+echo "✅ 已创建 $(wc -l <"$WORK_DIR/before.txt" | tr -d ' ') 个缓存文件"
+echo ""
+
+# 测试 1：导出后清空缓存，再导入，文件应完全还原
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "测试 1：导出并重新导入"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+python3 "$SCRIPT_DIR/mac-setup.py" --export-bundle "$WORK_DIR/bundle.tar" >/dev/null
+rm -rf "$HOME/.oh-my-zsh" "$HOMEBREW_CACHE" "$MISE_DATA_DIR" "$MISE_CACHE_DIR"
+python3 "$SCRIPT_DIR/mac-setup.py" --import-bundle "$WORK_DIR/bundle.tar" >/dev/null
+snapshot >"$WORK_DIR/after.txt"
+
+if diff -u "$WORK_DIR/before.txt" "$WORK_DIR/after.txt" &&
+  [ "$(readlink "$MISE_DATA_DIR/installs/node/22")" = "22.1.0" ] &&
+  [ "$(cat "$HOMEBREW_CACHE/downloads/git--bottle.tar.gz")" = "bottle" ]; then
+  echo "✅ 验证通过：缓存已完全还原"
+else
+  echo "❌ 验证失败：导入后的缓存与导出前不一致"
+  exit 1
+fi
+echo ""
+
+# 测试 2：指向目录外的符号链接不能被用来写出缓存根目录
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "测试 2：拒绝指向目录外的符号链接"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+mkdir -p "$WORK_DIR/outside"
+python3 - "$WORK_DIR/evil.tar" "$WORK_DIR/outside" <<'EOF'
+import io, sys, tarfile
+
+with tarfile.open(sys.argv[1], "w") as tar:
+    for name, target in (("oh-my-zsh/x", sys.argv[2]), ("oh-my-zsh/y", "../../outside")):
+        link = tarfile.TarInfo(name)
+        link.type = tarfile.SYMTYPE
+        link.linkname = target
+        tar.addfile(link)
+    for name in ("oh-my-zsh/x/pwned", "oh-my-zsh/y/pwned"):
+        info = tarfile.TarInfo(name)
+        info.size = 5
+        tar.addfile(info, io.BytesIO(b"pwned"))
+EOF
+python3 "$SCRIPT_DIR/mac-setup.py" --import-bundle "$WORK_DIR/evil.tar" >/dev/null
+
+if [ -z "$(ls -A "$WORK_DIR/outside")" ] &&
+  [ ! -L "$HOME/.oh-my-zsh/x" ] && [ ! -L "$HOME/.oh-my-zsh/y" ]; then
+  echo "✅ 验证通过：目录外没有写入任何文件"
+else
+  echo "❌ 验证失败：离线包写出了缓存根目录"
+  exit 1
+fi
+
+echo ""
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "🎉 测试完成"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
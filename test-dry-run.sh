@@ -0,0 +1,76 @@
+#!/usr/bin/env bash
+# 测试 --dry-run 执行计划（JSON 输出结构、.zshrc 差异、不修改任何文件）
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+export HOME="$WORK_DIR/home"
+mkdir -p "$HOME"
+printf 'export ZSH="$HOME/.oh-my-zsh"\nplugins=(git)\n' >"$HOME/.zshrc"
+
+echo "🧪 测试 --dry-run 执行计划"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+snapshot() {
+  (cd "$HOME" && find . -exec stat -c '%n %s %Y' {} + | sort)
+}
+snapshot >"$WORK_DIR/before.txt"
+
+# 在非 macOS 上把平台伪装成 Darwin，只用于生成计划
+python3 - "$SCRIPT_DIR" --dry-run --yes >"$WORK_DIR/plan.json" 2>"$WORK_DIR/stderr.txt" <<'EOF'
+import platform
+import runpy
+import sys
+
+script_dir = sys.argv[1]
+sys.path.insert(0, script_dir)
+platform.system = lambda: "Darwin"
+platform.machine = lambda: "arm64"
+sys.argv = ["mac-setup.py"] + sys.argv[2:]
+runpy.run_path(f"{script_dir}/mac-setup.py", run_name="__main__")
+EOF
+
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "测试 1：stdout 只包含 JSON 计划"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+python3 - "$WORK_DIR/plan.json" <<'EOF'
+import json
+import sys
+
+with open(sys.argv[1], encoding="utf-8") as f:
+    plan = json.load(f)
+
+expected = {"arch", "steps", "homebrew", "packages", "oh_my_zsh", "mise", "zshrc", "elapsed_ms"}
+missing = expected - set(plan)
+assert not missing, f"计划缺少字段: {missing}"
+assert plan["arch"] == "arm64"
+names = [step["name"] for step in plan["steps"]]
+assert len(names) == len(set(names)) and "mise" in names, names
+for step in plan["steps"]:
+    assert all(r in names for r in step["requires"]), step
+    assert step["resume_skip"] is False, "未指定 --resume 时不应标记跳过"
+assert plan["homebrew"]["installed"] is False and plan["homebrew"]["update"] is True
+assert set(plan["packages"]) == {"base", "formulae", "casks"}
+assert plan["oh_my_zsh"]["installed"] is False
+assert set(plan["zshrc"]) == {"path", "changed", "diff"}, plan["zshrc"]
+assert plan["zshrc"]["changed"] and "+### MISE-ACTIVATE START ###" in plan["zshrc"]["diff"]
+print(f"✅ 验证通过：计划包含 {len(names)} 个步骤，.zshrc 差异包含 Mise 激活")
+EOF
+
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "测试 2：不修改任何文件"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+snapshot >"$WORK_DIR/after.txt"
+if diff -u "$WORK_DIR/before.txt" "$WORK_DIR/after.txt"; then
+  echo "✅ 验证通过：HOME 下没有文件被创建或修改（含日志和备份目录）"
+else
+  echo "❌ 验证失败：--dry-run 修改了文件"
+  exit 1
+fi
+
+echo ""
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "🎉 测试完成"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
@@ -0,0 +1,97 @@
+#!/usr/bin/env bash
+# 测试步骤检查点（--resume / --from-step / 输入变化与 .zshrc 修改后失效）
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+export HOME="$WORK_DIR"
+
+echo "🧪 测试步骤检查点"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+python3 - "$SCRIPT_DIR" <<'EOF'
+import importlib.util
+import sys
+
+spec = importlib.util.spec_from_file_location("mac_setup", f"{sys.argv[1]}/mac-setup.py")
+ms = importlib.util.module_from_spec(spec)
+sys.path.insert(0, sys.argv[1])
+spec.loader.exec_module(ms)
+ms.log = lambda *args, **kwargs: None
+
+inputs = {"base": "v1", "tools": "v1"}
+ran = []
+
+
+def build_steps():
+    """base → tools → shell（shell 读写 .zshrc），other 独立"""
+    def step(name, **kwargs):
+        return ms.Step(name, lambda: ran.append(name), **kwargs)
+
+    return [
+        step("base", inputs=lambda: inputs["base"]),
+        step("tools", requires=["base"], inputs=lambda: inputs["tools"]),
+        step("shell", requires=["tools"], uses_zshrc=True),
+        step("other"),
+    ]
+
+
+def run(resume=True, force=()):
+    ran.clear()
+    journal = ms.StepJournal(ms.JOURNAL_FILE)
+    ms.StepScheduler(build_steps(), journal=journal, resume=resume, force=force).run()
+    return sorted(ran)
+
+
+def check(title, got, expected):
+    assert got == sorted(expected), f"{title}: 期望执行 {sorted(expected)}，实际 {got}"
+    print(f"✅ {title}: 执行 {got or '无'}")
+
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 1：首次运行与 --resume")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+check("首次运行", run(resume=False), ["base", "tools", "shell", "other"])
+check("--resume 且无变化", run(), [])
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 2：输入变化使步骤及其后续步骤失效")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+inputs["tools"] = "v2"
+check("tools 输入变化", run(), ["tools", "shell"])
+check("再次 --resume", run(), [])
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 3：--from-step 强制执行该步骤及依赖它的步骤")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+check("--from-step base", run(force={"base"}), ["base", "tools", "shell"])
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 4：.zshrc 被外部修改后，读写 .zshrc 的步骤失效")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+with open(ms.ZSHRC_PATH, "a", encoding="utf-8") as f:
+    f.write("alias ll='ls -lah'\n")
+check(".zshrc 被修改", run(), ["shell"])
+check("再次 --resume", run(), [])
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 5：中途失败后 --resume 不跳过受影响的步骤")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+inputs["base"] = "v2"
+steps = build_steps()
+steps[1].func = lambda: sys.exit(1)  # tools 失败
+try:
+    ms.StepScheduler(steps, journal=ms.StepJournal(ms.JOURNAL_FILE), resume=True).run()
+except SystemExit:
+    pass
+recorded = ms.StepJournal(ms.JOURNAL_FILE)
+assert recorded.is_done(build_steps()[0]), "成功的 base 应记录检查点"
+check("失败后 --resume", run(), ["tools", "shell"])
+EOF
+
+echo ""
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "🎉 测试完成"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
@@ -0,0 +1,103 @@
+#!/usr/bin/env bash
+# 测试步骤调度器（依赖图、错误传播、资源锁）
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+export HOME="$WORK_DIR"
+
+echo "🧪 测试步骤调度器"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+python3 - "$SCRIPT_DIR" <<'EOF'
+import importlib.util
+import sys
+import threading
+import time
+
+spec = importlib.util.spec_from_file_location("mac_setup", f"{sys.argv[1]}/mac-setup.py")
+ms = importlib.util.module_from_spec(spec)
+sys.path.insert(0, sys.argv[1])
+spec.loader.exec_module(ms)
+ms.log = lambda *args, **kwargs: None
+
+# 测试 1：失败的步骤不再调度依赖它的步骤，运行中的步骤结束后抛出原异常
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 1：错误传播")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+ran = []
+
+def fail():
+    time.sleep(0.05)
+    raise RuntimeError("boom")
+
+def slow():
+    time.sleep(0.2)
+    ran.append("slow")
+
+steps = [
+    ms.Step("fail", fail),
+    ms.Step("after-fail", lambda: ran.append("after-fail"), requires=["fail"]),
+    ms.Step("slow", slow),
+]
+try:
+    ms.StepScheduler(steps, jobs=2).run()
+except RuntimeError as e:
+    assert str(e) == "boom", e
+else:
+    raise AssertionError("调度器没有抛出步骤的异常")
+assert ran == ["slow"], f"依赖失败步骤的步骤不应执行，实际执行: {ran}"
+print("✅ 验证通过：异常被抛出，依赖步骤未执行，并行步骤正常结束")
+
+# 测试 2：run_cmd 失败时的 sys.exit 同样传播（不被当作普通异常吞掉）
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 2：SystemExit 传播")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+try:
+    ms.StepScheduler([ms.Step("exit", lambda: sys.exit(3))]).run()
+except SystemExit as e:
+    assert e.code == 3, e.code
+else:
+    raise AssertionError("调度器没有传播 SystemExit")
+print("✅ 验证通过：SystemExit(3) 被传播")
+
+# 测试 3：占用同一独占资源的步骤互斥，无资源约束的步骤并行
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 3：资源锁")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+intervals = {}
+guard = threading.Lock()
+
+def timed(name):
+    def run():
+        start = time.monotonic()
+        time.sleep(0.15)
+        with guard:
+            intervals[name] = (start, time.monotonic())
+    return run
+
+def overlap(a, b):
+    return intervals[a][0] < intervals[b][1] and intervals[b][0] < intervals[a][1]
+
+steps = [
+    ms.Step("brew-1", timed("brew-1"), resources=["brew"]),
+    ms.Step("brew-2", timed("brew-2"), resources=["brew"]),
+    ms.Step("free-1", timed("free-1")),
+    ms.Step("free-2", timed("free-2")),
+]
+ms.StepScheduler(steps, jobs=4).run()
+assert not overlap("brew-1", "brew-2"), "brew 资源的两个步骤同时执行"
+assert overlap("free-1", "free-2"), "无资源约束的步骤没有并行执行"
+# 独占资源为可重入锁：步骤内部再次获取同一资源不会死锁
+with ms.resource_lock("brew"):
+    with ms.resource_lock("brew"):
+        pass
+print("✅ 验证通过：brew 步骤互斥，其他步骤并行，资源锁可重入")
+EOF
+
+echo ""
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "🎉 测试完成"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
@@ -0,0 +1,129 @@
+#!/usr/bin/env bash
+# 测试回滚删除（移入回收区、并行清理、中断后用 --purge-trash 继续）
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+WORK_DIR="$(mktemp -d)"
+trap 'chmod -R u+w "$WORK_DIR" 2>/dev/null; rm -rf "$WORK_DIR"' EXIT
+export HOME="$WORK_DIR/home"
+mkdir -p "$HOME"
+
+echo "🧪 测试回收区删除"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+python3 - "$SCRIPT_DIR" "$WORK_DIR" <<'EOF'
+import importlib.util
+import os
+import stat
+import subprocess
+import sys
+from pathlib import Path
+
+spec = importlib.util.spec_from_file_location("rollback", f"{sys.argv[1]}/rollback.py")
+rb = importlib.util.module_from_spec(spec)
+sys.path.insert(0, sys.argv[1])
+spec.loader.exec_module(rb)
+rb.log = lambda *args, **kwargs: None
+
+home = Path.home()
+outside = Path(sys.argv[2]) / "outside"
+outside.mkdir()
+(outside / "keep.txt").write_text("keep\n")
+
+
+def make_tree(root: Path, width: int = 4, depth: int = 3) -> int:
+    """创建测试目录树，返回文件数"""
+    count = 0
+    root.mkdir(parents=True)
+    for i in range(width):
+        (root / f"file{i}.txt").write_text("x" * 100)
+        count += 1
+    if depth > 1:
+        for i in range(width):
+            count += make_tree(root / f"dir{i}", width, depth - 1)
+    return count
+
+
+def make_env_dirs():
+    dirs = [home / ".cargo", home / "go", home / ".oh-my-zsh"]
+    total = sum(make_tree(d) for d in dirs)
+    # Go module cache 是只读的
+    readonly = home / "go" / "pkg" / "mod"
+    readonly.mkdir(parents=True)
+    (readonly / "go.mod").write_text("module x\n")
+    readonly.chmod(stat.S_IRUSR | stat.S_IXUSR)
+    # 指向目录外的符号链接只删除链接本身
+    (home / ".cargo" / "linked").symlink_to(outside)
+    return dirs, total + 2
+
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 1：移入回收区并清理")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+dirs, total = make_env_dirs()
+rb.delete_env_dirs(dirs, jobs=4)
+assert not any(d.exists() or d.is_symlink() for d in dirs), "环境目录未被删除"
+assert not rb.TRASH_DIR.exists(), "清理完成后回收区应被删除"
+assert (outside / "keep.txt").exists(), "符号链接指向的目录外文件被删除"
+print(f"✅ 验证通过：{total} 个文件（含只读目录）已删除，目录外文件保留")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 2：清理中断后继续")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+dirs, total = make_env_dirs()
+purge_entries = rb._purge_entries
+visited = []
+
+
+def interrupted(path, progress):
+    """清理若干个目录后模拟 Ctrl+C"""
+    visited.append(path)
+    if len(visited) > 10:
+        raise KeyboardInterrupt
+    return purge_entries(path, progress)
+
+
+rb._purge_entries = interrupted
+try:
+    rb.delete_env_dirs(dirs, jobs=2)
+except KeyboardInterrupt:
+    pass
+else:
+    raise AssertionError("清理没有被中断")
+rb._purge_entries = purge_entries
+
+assert not any(d.exists() for d in dirs), "中断前目录应已全部移入回收区（立即生效）"
+left = [p for p in rb.TRASH_DIR.rglob("*") if p.is_file()]
+assert left, "回收区中应留有未清理的文件"
+print(f"✅ 验证通过：原目录已移走，回收区剩余 {len(left)} 个文件")
+
+# 新进程执行 --purge-trash 继续清理
+subprocess.run(
+    [sys.executable, f"{sys.argv[1]}/rollback.py", "--purge-trash", "--jobs", "4"],
+    check=True,
+    stdout=subprocess.DEVNULL,
+)
+assert not rb.TRASH_DIR.exists(), "--purge-trash 后回收区应被删除"
+assert (outside / "keep.txt").exists(), "符号链接指向的目录外文件被删除"
+print("✅ 验证通过：--purge-trash 清理了中断时剩余的内容")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 3：同名目录互不冲突")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+a = home / ".local" / "share" / "mise"
+b = home / ".config" / "mise"
+make_tree(a, 2, 2)
+make_tree(b, 2, 2)
+containers = [rb.move_to_trash(a), rb.move_to_trash(b)]
+assert all(containers) and containers[0] != containers[1], containers
+assert all((c / "mise" / "file0.txt").exists() for c in containers)
+files, _ = rb.purge_trash(rb.trash_roots([a, b]), jobs=2)
+assert files == 12 and not rb.TRASH_DIR.exists(), files
+print("✅ 验证通过：两个 mise 目录分别放入独立容器并被清理")
+EOF
+
+echo ""
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "🎉 测试完成"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
@@ -0,0 +1,121 @@
+#!/usr/bin/env bash
+# 测试 .zshrc 编辑事务（多次修改只写一次、提交前不落盘、无修改不写、保留符号链接和原有字节）
+
+set -e
+
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+WORK_DIR="$(mktemp -d)"
+trap 'rm -rf "$WORK_DIR"' EXIT
+export HOME="$WORK_DIR"
+
+echo "🧪 测试 .zshrc 编辑事务"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+
+python3 - "$SCRIPT_DIR" <<'EOF'
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+spec = importlib.util.spec_from_file_location("mac_setup", f"{sys.argv[1]}/mac-setup.py")
+ms = importlib.util.module_from_spec(spec)
+sys.path.insert(0, sys.argv[1])
+spec.loader.exec_module(ms)
+ms.log = lambda *args, **kwargs: None
+
+ORIGINAL = b'export ZSH="$HOME/.oh-my-zsh"\r\nZSH_THEME="robbyrussell"\nplugins=(git)\n# \xff\n'
+writes = []
+real_replace = os.replace
+
+
+def counting_replace(src, dst):
+    writes.append(Path(dst).name)
+    real_replace(src, dst)
+
+
+os.replace = counting_replace
+
+
+def edit(path):
+    """一组典型修改：追加行、追加/前置标记块、更新插件和主题"""
+    ms.ensure_line_in_file(path, 'export PATH="$HOME/.local/bin:$PATH"')
+    ms.ensure_line_in_file(path, 'eval "$(mise activate zsh)"', marker="mise")
+    ms.ensure_line_in_file(path, "# fast path", marker="top", prepend=True)
+    ms.ensure_line_in_file(path, 'eval "$(mise activate zsh)"', marker="mise")
+
+
+def reset(path, data=ORIGINAL):
+    path.write_bytes(data)
+    writes.clear()
+
+
+zshrc = ms.ZSHRC_PATH
+
+# 参照结果：不开启事务时逐次写文件
+reset(zshrc)
+edit(zshrc)
+expected = zshrc.read_bytes()
+assert len(writes) == 3, f"不开启事务时应逐次写入 3 次，实际 {len(writes)}"
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 1：多次修改只在提交时写入一次")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+reset(zshrc)
+ms.begin_zshrc_transaction()
+edit(zshrc)
+assert zshrc.read_bytes() == ORIGINAL, "提交前 .zshrc 已被修改"
+assert writes == [], f"提交前发生了写入: {writes}"
+ms.commit_zshrc_transaction()
+assert writes == [".zshrc"], f"提交时应写入 1 次，实际 {writes}"
+assert zshrc.read_bytes() == expected, "事务结果与逐次写文件不一致"
+print("✅ 验证通过：提交前未落盘，提交时写入 1 次，结果与逐次写入一致（保留 CRLF 和非 UTF-8 字节）")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 2：没有修改时提交不写文件")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+reset(zshrc, expected)
+inode = zshrc.stat().st_ino
+txn = ms.begin_zshrc_transaction()
+edit(zshrc)
+assert not txn.dirty, "重复应用相同修改后事务不应有改动"
+assert txn.digest() == ms.file_sha256(zshrc), "事务内容哈希与文件不一致"
+ms.commit_zshrc_transaction()
+assert writes == [] and zshrc.stat().st_ino == inode, f"无修改时发生了写入: {writes}"
+print("✅ 验证通过：幂等修改不产生写入")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 3：flush 写入已累积的修改，事务保持打开")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+reset(zshrc)
+ms.begin_zshrc_transaction()
+ms.ensure_line_in_file(zshrc, "alias ll='ls -lah'")
+ms.flush_zshrc_transaction()
+assert b"alias ll" in zshrc.read_bytes() and writes == [".zshrc"], writes
+ms.ensure_line_in_file(zshrc, "alias la='ls -A'")
+assert b"alias la" not in zshrc.read_bytes(), "flush 后事务应保持打开"
+ms.commit_zshrc_transaction()
+assert b"alias la" in zshrc.read_bytes() and len(writes) == 2, writes
+print("✅ 验证通过：flush 后继续累积，提交时再写入一次")
+
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+print("测试 4：.zshrc 是符号链接时写入链接指向的文件")
+print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
+dotfiles = Path(os.environ["HOME"]) / "dotfiles"
+dotfiles.mkdir()
+zshrc.unlink()
+(dotfiles / "zshrc").write_bytes(ORIGINAL)
+zshrc.symlink_to(dotfiles / "zshrc")
+writes.clear()
+ms.begin_zshrc_transaction()
+edit(zshrc)
+ms.commit_zshrc_transaction()
+assert zshrc.is_symlink(), "符号链接被替换成了普通文件"
+assert (dotfiles / "zshrc").read_bytes() == expected, "链接指向的文件内容不正确"
+assert writes == ["zshrc"], writes
+print("✅ 验证通过：符号链接保留，目标文件写入 1 次")
+EOF
+
+echo ""
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
+echo "🎉 测试完成"
+echo "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
@@ -0,0 +1,185 @@
+"""
+.zshrc 标记块解析器（mac-setup.py 与 rollback.py 共用）
+
+把 .zshrc 一次性切分为用户内容片段和脚本生成的标记块，支持两种格式:
+- ### NAME START ### ... ### NAME END ###   (mac-setup.py，如 AUTO-RUST、HOMEBREW-PATH)
+- ### AUTO-NAME ... ### END AUTO-NAME        (setup-macos.sh)
+
+提供两种用法:
+- ZshrcIndex(text): 整体解析，带区间索引，用于查询和定位
+- iter_segments(lines): 按行流式解析，用于超大文件的逐行改写（内存占用恒定）
+"""
+
+import os
+import re
+import shutil
+from bisect import bisect_right
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+# 标记行（行尾换行符已去除）
+START_MARKER = re.compile(r"^### (\S+) START ###\s*$")
+END_MARKER = re.compile(r"^### (\S+) END ###\s*$")
+LEGACY_START_MARKER = re.compile(r"^### (AUTO-.*)$")
+LEGACY_END_MARKER = re.compile(r"^### END AUTO-")
+
+# soft 回滚时需要禁用的标记前缀
+DISABLE_PREFIXES = ("AUTO-", "HOMEBREW-PATH", "MISE-ACTIVATE")
+
+
+class Segment:
+    """解析结果中的一个片段
+
+    Attributes:
+        kind: "text"（用户内容）或 "block"（标记块）
+        lines: 片段包含的行（保留换行符）
+        name: 标记块名称（text 片段为空）
+        legacy: 是否为 setup-macos.sh 的 ### AUTO-x / ### END AUTO-x 格式
+    """
+
+    __slots__ = ("kind", "lines", "name", "legacy")
+
+    def __init__(self, kind: str, lines: List[str], name: str = "", legacy=False):
+        self.kind = kind
+        self.lines = lines
+        self.name = name
+        self.legacy = legacy
+
+    @property
+    def is_block(self) -> bool:
+        return self.kind == "block"
+
+    @property
+    def text(self) -> str:
+        return "".join(self.lines)
+
+
+def _strip_eol(line: str) -> str:
+    return line.rstrip("\r\n")
+
+
+def split_lines(text: str) -> List[str]:
+    """按 \\n 切分并保留换行符（与逐行读取文件的结果一致）"""
+    parts = text.split("\n")
+    lines = [part + "\n" for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def iter_segments(lines: Iterable[str]) -> Iterator[Segment]:
+    """按行流式切分片段
+
+    用户内容按行逐个产出（每行一个 text 片段），标记块整体产出。
+    未闭合的标记块按用户内容处理。
+    """
+    block: Optional[Segment] = None
+    for line in lines:
+        bare = _strip_eol(line)
+        if block is None:
+            match = START_MARKER.match(bare)
+            if match:
+                block = Segment("block", [line], match.group(1))
+                continue
+            match = LEGACY_START_MARKER.match(bare)
+            if match:
+                block = Segment("block", [line], match.group(1), legacy=True)
+                continue
+            yield Segment("text", [line])
+            continue
+
+        block.lines.append(line)
+        if block.legacy:
+            closed = bool(LEGACY_END_MARKER.match(bare))
+        else:
+            match = END_MARKER.match(bare)
+            closed = bool(match) and match.group(1) == block.name
+        if closed:
+            yield block
+            block = None
+
+    if block is not None:
+        for line in block.lines:
+            yield Segment("text", [line])
+
+
+class ZshrcIndex:
+    """.zshrc 的一次性解析结果
+
+    相邻的用户内容行合并为一个片段；offsets 记录每个片段在原文中的起始位置，
+    用二分查找判断任意位置是否落在标记块内（O(log n)）。
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.segments: List[Segment] = []
+        for seg in iter_segments(split_lines(text)):
+            last = self.segments[-1] if self.segments else None
+            if not seg.is_block and last is not None and not last.is_block:
+                last.lines.extend(seg.lines)
+            else:
+                self.segments.append(seg)
+
+        self.offsets: List[int] = []
+        pos = 0
+        for seg in self.segments:
+            self.offsets.append(pos)
+            pos += sum(len(line) for line in seg.lines)
+
+        self.block_names = {seg.name for seg in self.segments if seg.is_block}
+        self._user_text: Optional[str] = None
+
+    @property
+    def user_text(self) -> str:
+        """移除所有标记块后的用户内容"""
+        if self._user_text is None:
+            self._user_text = "".join(
+                seg.text for seg in self.segments if not seg.is_block
+            )
+        return self._user_text
+
+    def has_block(self, name: str) -> bool:
+        return name in self.block_names
+
+    def in_block(self, pos: int) -> bool:
+        """原文中的位置 pos 是否位于某个标记块内"""
+        i = bisect_right(self.offsets, pos) - 1
+        return i >= 0 and self.segments[i].is_block
+
+
+def disable_lines(segments: Iterable[Segment], prefixes=DISABLE_PREFIXES):
+    """把标记块的标记行改为 ### DISABLED-xxx（块内容保持不变）"""
+    for seg in segments:
+        if not seg.is_block:
+            yield from seg.lines
+            continue
+        for line in seg.lines:
+            bare = _strip_eol(line)
+            if bare.startswith("### ") and bare[4:].startswith(prefixes):
+                line = "### DISABLED-" + line[4:]
+            yield line
+
+
+def strip_lines(segments: Iterable[Segment]):
+    """移除所有标记块（包括已禁用的块），保留用户内容"""
+    for seg in segments:
+        if not seg.is_block:
+            yield from seg.lines
+
+
+def rewrite_file(
+    path: Path, transform: Callable[[Iterator[Segment]], Iterable[str]]
+) -> None:
+    """流式改写文件：逐行解析、转换并写入临时文件，最后原子替换"""
+    path = Path(path)
+    target = path.resolve() if path.is_symlink() else path
+    tmp_path = target.with_name(f".{target.name}.rewrite.tmp")
+    with open(
+        target, "r", encoding="utf-8", errors="surrogateescape", newline=""
+    ) as src, open(
+        tmp_path, "w", encoding="utf-8", errors="surrogateescape", newline=""
+    ) as dst:
+        for line in transform(iter_segments(src)):
+            dst.write(line)
+    shutil.copymode(target, tmp_path)
+    os.replace(tmp_path, target)